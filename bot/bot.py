@@ -16,13 +16,14 @@ from aiogram import BaseMiddleware
 from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
 from aiogram.filters import ExceptionTypeFilter
 from aiogram.types import ErrorEvent
-from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.db import transaction
 from django.utils import timezone
-from core.models import TelegramUser, QRCode, QRCodeScanAttempt, Gift, GiftRedemption, VideoInstruction
+from core.models import TelegramUser, QRCode, Gift, GiftRedemption, VideoInstruction
 from core.utils import generate_qr_code_image
 from .translations import get_text, TRANSLATIONS
+from .dedup import UpdateDedupMiddleware
+from .db import db_sync_to_async
 
 # Настройка Django для использования в боте
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mona.settings')
@@ -65,6 +66,26 @@ if _sentry_dsn:
     logger.info("Sentry initialized for bot")
 # ────────────────────────────────────────────────────────────────────────────
 
+def create_fsm_storage():
+    """
+    Создает хранилище FSM по настройке BOT_FSM_STORAGE.
+    'redis' — состояние общее для всех процессов webhook и не теряется при деплое;
+    иначе — MemoryStorage текущего процесса.
+    """
+    if getattr(settings, 'BOT_FSM_STORAGE', 'memory') == 'redis':
+        from aiogram.fsm.storage.redis import RedisStorage, DefaultKeyBuilder
+
+        ttl = getattr(settings, 'BOT_FSM_TTL', 0) or None
+        logger.info("FSM storage: Redis (%s), ttl=%s", settings.BOT_FSM_REDIS_URL, ttl)
+        return RedisStorage.from_url(
+            settings.BOT_FSM_REDIS_URL,
+            key_builder=DefaultKeyBuilder(prefix='fsm'),
+            state_ttl=ttl,
+            data_ttl=ttl,
+        )
+    return MemoryStorage()
+
+
 # Инициализация бота и диспетчера
 bot_token = settings.TELEGRAM_BOT_TOKEN
 if not bot_token:
@@ -73,7 +94,7 @@ if not bot_token:
     dp = None
 else:
     bot = Bot(token=bot_token)
-    dp = Dispatcher(storage=MemoryStorage())
+    dp = Dispatcher(storage=create_fsm_storage())
 
 
 class BotFilterMiddleware(BaseMiddleware):
@@ -105,10 +126,73 @@ class BotFilterMiddleware(BaseMiddleware):
         return await handler(event, data)
 
 
+# Кеш пользователей на процесс: telegram_id -> (expires_at, TelegramUser).
+# Объекты из кеша общие для всех апдейтов пользователя: менять их поля можно только через
+# update_user_fields() (запись в БД + сброс кеша), refresh_from_db() — для чтения актуальных полей.
+# Включается через BOT_USER_CACHE_TTL. invalidate_cached_user() сбрасывает его только для записей
+# из хендлеров этого процесса: изменения из админки, веб-приложения, журнала баллов
+# (PointsTransaction.record), рассылок Celery и других процессов webhook видны лишь после
+# истечения TTL, поэтому TTL должен быть коротким (единицы секунд).
+_user_cache = {}
+_USER_CACHE_MAX_SIZE = 10000
+
+
+def invalidate_cached_user(telegram_id: int) -> None:
+    """Удаляет пользователя из кеша процесса (вызывать после записи в TelegramUser из бота)."""
+    _user_cache.pop(telegram_id, None)
+
+
+@db_sync_to_async
+def _fetch_user(telegram_id: int):
+    return TelegramUser.objects.filter(telegram_id=telegram_id).first()
+
+
+async def get_cached_user(telegram_id: int):
+    """Возвращает TelegramUser (или None) с учётом короткоживущего кеша процесса."""
+    ttl = getattr(settings, 'BOT_USER_CACHE_TTL', 0)
+    now = asyncio.get_running_loop().time()
+    if ttl > 0:
+        cached = _user_cache.get(telegram_id)
+        if cached and cached[0] > now:
+            return cached[1]
+
+    user = await _fetch_user(telegram_id)
+
+    if ttl > 0 and user is not None:
+        if len(_user_cache) >= _USER_CACHE_MAX_SIZE:
+            _user_cache.clear()
+        _user_cache[telegram_id] = (now + ttl, user)
+    return user
+
+
+class UserMiddleware(BaseMiddleware):
+    """
+    Загружает TelegramUser один раз на апдейт и передаёт его в handlers как db_user.
+    db_user = None, если пользователь ещё не создан (до первого /start).
+    """
+
+    async def __call__(self, handler, event, data):
+        from_user = getattr(event, 'from_user', None)
+        if from_user and 'db_user' not in data:
+            data['db_user'] = await get_cached_user(from_user.id)
+        return await handler(event, data)
+
+
+# Защита от повторной доставки апдейтов (см. bot/dedup.py); None — выключена
+update_dedup = None
+
 # Регистрируем middleware и обработчик блокировки бота
 if dp:
+    if getattr(settings, 'BOT_UPDATE_DEDUP_TTL', 0) > 0:
+        update_dedup = UpdateDedupMiddleware(
+            redis_url=settings.BOT_UPDATE_DEDUP_REDIS_URL,
+            ttl=settings.BOT_UPDATE_DEDUP_TTL,
+        )
+        dp.update.outer_middleware(update_dedup)
     dp.message.middleware(BotFilterMiddleware())
     dp.callback_query.middleware(BotFilterMiddleware())
+    dp.message.middleware(UserMiddleware())
+    dp.callback_query.middleware(UserMiddleware())
 
     @dp.error(ExceptionTypeFilter(TelegramForbiddenError))
     async def handle_user_blocked_bot(event: ErrorEvent):
@@ -125,7 +209,8 @@ if dp:
                     TelegramUser.objects.filter(telegram_id=telegram_id).update(
                         is_active=False, blocked_bot_at=timezone.now()
                     )
-                await sync_to_async(mark_user_blocked)()
+                await db_sync_to_async(mark_user_blocked)()
+                invalidate_cached_user(telegram_id)
                 logger.info("Пользователь %s заблокировал бота — помечен неактивным", telegram_id)
             except Exception as e:
                 logger.warning("Не удалось обновить статус пользователя %s: %s", telegram_id, e)
@@ -194,7 +279,7 @@ def format_number(number):
         return str(number)
 
 
-@sync_to_async
+@db_sync_to_async
 def get_or_create_user(telegram_id: int, username: str = None, first_name: str = None, last_name: str = None):
     """Получает или создает пользователя Telegram."""
     logger.info(f"[get_or_create_user] Получение/создание пользователя: telegram_id={telegram_id}, username={username}")
@@ -214,13 +299,35 @@ def get_or_create_user(telegram_id: int, username: str = None, first_name: str =
     if username and user.username != username:
         user.username = username
         user.save(update_fields=['username'])
+        invalidate_cached_user(telegram_id)
         logger.info(f"[get_or_create_user] Username обновлен на: {username}")
     
     return user, created
 
 
-@sync_to_async
-def is_registration_complete(user):
+async def reply_please_start(event):
+    """Просит отправить /start: пользователя ещё нет в БД (UserMiddleware передал db_user = None)."""
+    text = get_text(SimpleNamespace(language='uz_latin'), 'PLEASE_START')
+    if isinstance(event, CallbackQuery):
+        await event.answer(text, show_alert=True)
+    else:
+        await event.answer(text)
+
+
+@db_sync_to_async
+def update_user_fields(user, **fields):
+    """
+    Сохраняет переданные поля пользователя одним UPDATE и сбрасывает кеш процесса.
+    Единственный способ менять db_user в хендлерах: объект может быть общим из кеша.
+    """
+    for name, value in fields.items():
+        setattr(user, name, value)
+    user.save(update_fields=list(fields))
+    invalidate_cached_user(user.telegram_id)
+    return user
+
+
+async def is_registration_complete(user):
     """Проверяет, завершена ли регистрация пользователя."""
     # Базовые проверки
     base_checks = (
@@ -250,7 +357,7 @@ def is_registration_complete(user):
 
 
 @dp.message(CommandStart())
-async def cmd_start(message: Message, state: FSMContext):
+async def cmd_start(message: Message, state: FSMContext, db_user: TelegramUser = None):
     """Обработчик команды /start."""
     # Игнорируем сообщения от ботов
     if message.from_user.is_bot:
@@ -275,12 +382,17 @@ async def cmd_start(message: Message, state: FSMContext):
             qr_code_str = arg.upper().strip()
         logger.info(f"[cmd_start] Обнаружен QR-код в аргументе: {qr_code_str}")
     
-    user, is_new_user = await get_or_create_user(
-        telegram_id=message.from_user.id,
-        username=message.from_user.username,
-        first_name=message.from_user.first_name,
-        last_name=message.from_user.last_name
-    )
+    # Пользователь уже загружен UserMiddleware — повторно идём в БД только
+    # для создания новой записи или обновления username
+    if db_user is not None and (not message.from_user.username or db_user.username == message.from_user.username):
+        user, is_new_user = db_user, False
+    else:
+        user, is_new_user = await get_or_create_user(
+            telegram_id=message.from_user.id,
+            username=message.from_user.username,
+            first_name=message.from_user.first_name,
+            last_name=message.from_user.last_name
+        )
     
     logger.info(f"[cmd_start] Пользователь получен/создан: id={user.id}, telegram_id={user.telegram_id}, "
                 f"is_new_user={is_new_user}, language={user.language}, first_name={user.first_name}, "
@@ -382,55 +494,43 @@ async def cmd_start(message: Message, state: FSMContext):
 
 
 @dp.message(RegistrationStates.waiting_for_phone)
-async def process_phone(message: Message, state: FSMContext):
+async def process_phone(message: Message, state: FSMContext, db_user: TelegramUser = None):
     """Обработчик получения номера телефона."""
     # Игнорируем сообщения от ботов
     if message.from_user.is_bot:
         return
+    if db_user is None:
+        await reply_please_start(message)
+        return
     
+    user = db_user
     if message.contact:
-        phone_number = message.contact.phone_number
-        
-        @sync_to_async
-        def update_phone():
-            user = TelegramUser.objects.get(telegram_id=message.from_user.id)
-            user.phone_number = phone_number
-            user.save(update_fields=['phone_number'])
-            return user
-        
-        user = await update_phone()
+        user = await update_user_fields(user, phone_number=message.contact.phone_number)
         await message.answer(get_text(user, 'PHONE_SAVED'))
         
         # Переходим к следующему шагу - локация
         await ask_location(message, user, state)
     else:
-        @sync_to_async
-        def get_user():
-            return TelegramUser.objects.get(telegram_id=message.from_user.id)
-        user = await get_user()
         await message.answer(get_text(user, 'USE_BUTTON_PHONE'))
 
 
 @dp.message(RegistrationStates.waiting_for_location)
-async def process_location(message: Message, state: FSMContext):
+async def process_location(message: Message, state: FSMContext, db_user: TelegramUser = None):
     """Обработчик получения локации."""
     # Игнорируем сообщения от ботов
     if message.from_user.is_bot:
         return
+    if db_user is None:
+        await reply_please_start(message)
+        return
     
+    user = db_user
     if message.location:
-        latitude = message.location.latitude
-        longitude = message.location.longitude
-        
-        @sync_to_async
-        def update_location():
-            user = TelegramUser.objects.get(telegram_id=message.from_user.id)
-            user.latitude = latitude
-            user.longitude = longitude
-            user.save(update_fields=['latitude', 'longitude'])
-            return user
-        
-        user = await update_location()
+        user = await update_user_fields(
+            user,
+            latitude=message.location.latitude,
+            longitude=message.location.longitude,
+        )
         
         # Убираем клавиатуру с кнопкой геолокации
         remove_keyboard = types.ReplyKeyboardRemove()
@@ -449,10 +549,6 @@ async def process_location(message: Message, state: FSMContext):
             # Затем обычным текстом просим ввести промокод (без установки состояния)
             await message.answer(get_text(user, 'SEND_PROMO_CODE'))
     else:
-        @sync_to_async
-        def get_user_for_location():
-            return TelegramUser.objects.get(telegram_id=message.from_user.id)
-        user = await get_user_for_location()
         await message.answer(get_text(user, 'USE_BUTTON_LOCATION'))
 
 
@@ -487,34 +583,26 @@ async def ask_name(message: Message, user, state: FSMContext):
 
 
 @dp.message(RegistrationStates.waiting_for_name)
-async def process_name(message: Message, state: FSMContext):
+async def process_name(message: Message, state: FSMContext, db_user: TelegramUser = None):
     """Обработчик получения имени пользователя."""
     # Игнорируем сообщения от ботов
     if message.from_user.is_bot:
         return
+    if db_user is None:
+        await reply_please_start(message)
+        return
     
     name = message.text.strip()
     
     # Проверяем, что имя не пустое и не слишком длинное
     if not name or len(name) < 2:
-        @sync_to_async
-        def get_user():
-            return TelegramUser.objects.get(telegram_id=message.from_user.id)
-        user = await get_user()
-        await message.answer(get_text(user, 'NAME_TOO_SHORT'))
+        await message.answer(get_text(db_user, 'NAME_TOO_SHORT'))
         return
     
     if len(name) > 255:
         name = name[:255]
     
-    @sync_to_async
-    def update_name():
-        user = TelegramUser.objects.get(telegram_id=message.from_user.id)
-        user.first_name = name
-        user.save(update_fields=['first_name'])
-        return user
-    
-    user = await update_name()
+    user = await update_user_fields(db_user, first_name=name)
     await message.answer(get_text(user, 'NAME_SAVED'))
     
     # Переходим к следующему шагу - выбор типа пользователя
@@ -541,7 +629,7 @@ async def send_video_instruction(chat_id: int, language: str, user_type: str):
     """Отправляет видео инструкцию пользователю (для electrician или seller, с учётом языка)."""
     logger.info(f"[send_video_instruction] chat_id={chat_id}, language={language}, user_type={user_type}")
     
-    @sync_to_async
+    @db_sync_to_async
     def get_video_instruction():
         return VideoInstruction.objects.filter(is_active=True).first()
     
@@ -585,7 +673,7 @@ async def send_video_instruction(chat_id: int, language: str, user_type: str):
             return
         
         thumb_file = instruction.get_thumb_file(user_type, language)
-        thumb_input = await sync_to_async(_get_thumb_input)(thumb_file) if thumb_file else None
+        thumb_input = await db_sync_to_async(_get_thumb_input)(thumb_file) if thumb_file else None
         
         try:
             video_path = video_file.path
@@ -608,7 +696,7 @@ async def send_video_instruction(chat_id: int, language: str, user_type: str):
                 new_file_id = sent_message.video.file_id
                 def _save():
                     instruction.set_file_id(user_type, language, new_file_id)
-                await sync_to_async(_save)()
+                await db_sync_to_async(_save)()
                 logger.info("[send_video_instruction] file_id сохранён")
         except asyncio.TimeoutError:
             logger.error("[send_video_instruction] Таймаут при отправке видео")
@@ -625,12 +713,12 @@ async def ask_privacy_acceptance(message: Message, user, state: FSMContext):
     logger.info(f"[ask_privacy_acceptance] Запрос политики для user_id={user.id}, language={user.language}")
     
     # Получаем активную политику конфиденциальности из базы данных
-    @sync_to_async
+    @db_sync_to_async
     def get_privacy_policy():
         """Получает активную политику конфиденциальности."""
         return PrivacyPolicy.objects.filter(is_active=True).first()
     
-    @sync_to_async
+    @db_sync_to_async
     def get_privacy_pdf():
         """Получает PDF файл политики конфиденциальности на языке пользователя."""
         policy = PrivacyPolicy.objects.filter(is_active=True).first()
@@ -797,19 +885,17 @@ async def ask_smartup_id(message: Message, user, state: FSMContext):
 
 
 @dp.message(RegistrationStates.waiting_for_smartup_id)
-async def process_smartup_id(message: Message, state: FSMContext):
+async def process_smartup_id(message: Message, state: FSMContext, db_user: TelegramUser = None):
     """Обработчик получения SmartUP ID."""
     # Игнорируем сообщения от ботов
     if message.from_user.is_bot:
         return
+    if db_user is None:
+        await reply_please_start(message)
+        return
     
     smartup_id_str = message.text.strip() if message.text else ""
-    
-    @sync_to_async
-    def get_user():
-        return TelegramUser.objects.get(telegram_id=message.from_user.id)
-    
-    user = await get_user()
+    user = db_user
     
     # Проверяем, не является ли это командой меню
     all_menu_commands = [
@@ -828,7 +914,7 @@ async def process_smartup_id(message: Message, state: FSMContext):
     # Если это команда меню, выходим из состояния и обрабатываем как обычное сообщение
     if message.text in all_menu_commands:
         await state.clear()
-        await handle_message(message, state)
+        await handle_message(message, state, db_user=user)
         return
     
     if not smartup_id_str:
@@ -839,7 +925,7 @@ async def process_smartup_id(message: Message, state: FSMContext):
         smartup_id = int(smartup_id_str)
         
         # Проверяем существование ID в базе SmartUP
-        @sync_to_async
+        @db_sync_to_async
         def check_smartup_id():
             from core.models import SmartUPId
             return SmartUPId.objects.filter(id_value=smartup_id).exists()
@@ -852,14 +938,7 @@ async def process_smartup_id(message: Message, state: FSMContext):
             return
         
         # Сохраняем SmartUP ID
-        @sync_to_async
-        def save_smartup_id():
-            user_obj = TelegramUser.objects.get(telegram_id=message.from_user.id)
-            user_obj.smartup_id = smartup_id
-            user_obj.save(update_fields=['smartup_id'])
-            return user_obj
-        
-        user = await save_smartup_id()
+        user = await update_user_fields(user, smartup_id=smartup_id)
         
         # Убираем клавиатуру
         remove_keyboard = types.ReplyKeyboardRemove()
@@ -889,19 +968,17 @@ async def ask_promo_code(message: Message, user, state: FSMContext):
 
 
 @dp.message(RegistrationStates.waiting_for_promo_code)
-async def process_promo_code(message: Message, state: FSMContext):
+async def process_promo_code(message: Message, state: FSMContext, db_user: TelegramUser = None):
     """Обработчик получения промокода."""
     # Игнорируем сообщения от ботов
     if message.from_user.is_bot:
         return
+    if db_user is None:
+        await reply_please_start(message)
+        return
     
     promo_code = message.text.strip() if message.text else ""
-    
-    @sync_to_async
-    def get_user():
-        return TelegramUser.objects.get(telegram_id=message.from_user.id)
-    
-    user = await get_user()
+    user = db_user
     
     # Проверяем, не является ли это командой меню
     all_menu_commands = [
@@ -920,7 +997,7 @@ async def process_promo_code(message: Message, state: FSMContext):
     # Если это команда меню, выходим из состояния и обрабатываем как обычное сообщение
     if message.text in all_menu_commands:
         await state.clear()
-        await handle_message(message, state)
+        await handle_message(message, state, db_user=user)
         return
     
     # Проверяем, есть ли ожидающий QR-код из state (передан при /start)
@@ -933,7 +1010,7 @@ async def process_promo_code(message: Message, state: FSMContext):
     
     if qr_code_to_check:
         # Перед любыми проверками смотрим, не заблокирован ли пользователь по промокодам
-        blocked, block_type, blocked_until = await sync_to_async(user.is_promo_code_blocked)()
+        blocked, block_type, blocked_until = await db_sync_to_async(user.is_promo_code_blocked)()
         if blocked:
             if block_type == 'permanent':
                 msg = get_text(user, 'PROMO_BLOCKED_PERMANENT')
@@ -944,29 +1021,21 @@ async def process_promo_code(message: Message, state: FSMContext):
             return
 
         # Проверяем QR-код напрямую, чтобы определить результат до завершения регистрации
-        @sync_to_async
+        @db_sync_to_async
         def check_qr_code():
             """Проверяет существование QR-кода в базе."""
-            # Нормализуем ввод: приводим к верхнему регистру для поиска
-            qr_code_normalized = qr_code_to_check.upper().strip()
-            
-            try:
-                # Сначала ищем по полному коду (E-ABC123 или D-ABC123) - нечувствительно к регистру
-                qr_code = QRCode.objects.get(code__iexact=qr_code_normalized)
-                return {'found': True, 'qr_code': qr_code}
-            except QRCode.DoesNotExist:
-                # Если не нашли, пробуем найти по hash_code (без префикса) - нечувствительно к регистру
-                try:
-                    qr_code = QRCode.objects.get(hash_code__iexact=qr_code_normalized)
-                    return {'found': True, 'qr_code': qr_code}
-                except QRCode.DoesNotExist:
-                    return {'found': False}
+            # Ищем по коду или hash_code одним запросом (без учёта регистра)
+            qr_code = QRCode.find_by_code(qr_code_to_check)
+            if qr_code is None:
+                return {'found': False}
+            return {'found': True, 'qr_code': qr_code}
         
         qr_check_result = await check_qr_code()
         
         if not qr_check_result.get('found'):
             # QR-код не найден — регистрируем неверную попытку
-            await sync_to_async(user.register_invalid_promo_attempt)(source='bot', raw_code=promo_code or pending_qr_code or '')
+            await db_sync_to_async(user.register_invalid_promo_attempt)(source='bot', raw_code=promo_code or pending_qr_code or '')
+            invalidate_cached_user(user.telegram_id)
             await message.answer(get_text(user, 'QR_NOT_FOUND'))
             await ask_promo_code(message, user, state)
             return
@@ -979,12 +1048,8 @@ async def process_promo_code(message: Message, state: FSMContext):
         await handle_qr_code_scan(message, user, qr_code_to_check, state)
         
         # Проверяем, завершена ли регистрация после обработки QR-кода
-        @sync_to_async
-        def get_user_for_check():
-            return TelegramUser.objects.get(telegram_id=message.from_user.id)
-        
-        user_for_check = await get_user_for_check()
-        registration_complete = await is_registration_complete(user_for_check)
+        # (handle_qr_code_scan обновляет тот же объект user)
+        registration_complete = await is_registration_complete(user)
         
         if registration_complete:
             # Регистрация завершена, handle_qr_code_scan уже обработал QR-код и показал меню
@@ -1007,7 +1072,7 @@ async def process_promo_code(message: Message, state: FSMContext):
 
 
 @dp.callback_query(lambda c: c.data.startswith('lang_'))
-async def process_language_selection(callback: CallbackQuery, state: FSMContext):
+async def process_language_selection(callback: CallbackQuery, state: FSMContext, db_user: TelegramUser = None):
     """Обрабатывает выбор языка."""
     # Игнорируем callback от ботов
     if callback.from_user.is_bot:
@@ -1019,21 +1084,24 @@ async def process_language_selection(callback: CallbackQuery, state: FSMContext)
         language = callback.data.split('_', 1)[1]  # uz_latin или ru (берем всё после 'lang_')
         logger.info(f"[process_language_selection] Выбранный язык: {language}")
         
-        @sync_to_async
+        @db_sync_to_async
         def update_language_and_check_registration():
             # get_or_create: пользователь может прийти из Web App (resend_registration_step)
             # без предварительной отправки /start — в таком случае создаём запись
-            user, created = TelegramUser.objects.get_or_create(
-                telegram_id=callback.from_user.id,
-                defaults={
-                    'username': callback.from_user.username,
-                }
-            )
-            if created:
-                logger.info(f"[process_language_selection] Создан новый пользователь: telegram_id={callback.from_user.id}")
+            user = db_user
+            if user is None:
+                user, created = TelegramUser.objects.get_or_create(
+                    telegram_id=callback.from_user.id,
+                    defaults={
+                        'username': callback.from_user.username,
+                    }
+                )
+                if created:
+                    logger.info(f"[process_language_selection] Создан новый пользователь: telegram_id={callback.from_user.id}")
             logger.info(f"[process_language_selection] Текущий язык пользователя до обновления: {user.language}")
             user.language = language
             user.save(update_fields=['language'])
+            invalidate_cached_user(user.telegram_id)
             logger.info(f"[process_language_selection] Язык пользователя обновлен на: {user.language}")
             # Проверяем, завершена ли регистрация
             # Для типа "seller" требуется smartup_id
@@ -1064,13 +1132,8 @@ async def process_language_selection(callback: CallbackQuery, state: FSMContext)
             logger.info(f"[process_language_selection] Пользователь зарегистрирован, показываем меню")
             await state.clear()
             
-            # Получаем баллы пользователя
-            @sync_to_async
-            def get_user_points():
-                user_obj = TelegramUser.objects.get(telegram_id=callback.from_user.id)
-                return user_obj.points
-            
-            points = await get_user_points()
+            # Баллы берём из уже загруженного пользователя
+            points = user.points
             
             # Создаем reply keyboard кнопки
             keyboard_buttons = []
@@ -1166,22 +1229,17 @@ async def process_language_selection(callback: CallbackQuery, state: FSMContext)
 
 
 @dp.callback_query(lambda c: c.data.startswith('user_type_'))
-async def process_user_type_selection(callback: CallbackQuery, state: FSMContext):
+async def process_user_type_selection(callback: CallbackQuery, state: FSMContext, db_user: TelegramUser = None):
     """Обрабатывает выбор типа пользователя."""
     # Игнорируем callback от ботов
     if callback.from_user.is_bot:
         return
+    if db_user is None:
+        await reply_please_start(callback)
+        return
     
     user_type = callback.data.split('_')[2]  # electrician или seller
-    
-    @sync_to_async
-    def update_user_type():
-        user = TelegramUser.objects.get(telegram_id=callback.from_user.id)
-        user.user_type = user_type
-        user.save(update_fields=['user_type'])
-        return user
-    
-    user = await update_user_type()
+    user = await update_user_fields(db_user, user_type=user_type)
     
     await callback.answer(get_text(user, 'USER_TYPE_SAVED'))
     await _safe_delete_message(callback.message)
@@ -1197,16 +1255,12 @@ async def process_user_type_selection(callback: CallbackQuery, state: FSMContext
 
 
 @dp.callback_query(lambda c: c.data in ['hint_phone', 'hint_location'])
-async def process_hint_callback(callback: CallbackQuery):
+async def process_hint_callback(callback: CallbackQuery, db_user: TelegramUser = None):
     """Обрабатывает нажатия на подсказки для телефона и локации."""
     if callback.from_user.is_bot:
         return
     
-    @sync_to_async
-    def get_user():
-        return TelegramUser.objects.get(telegram_id=callback.from_user.id)
-    
-    user = await get_user()
+    user = db_user
     
     if callback.data == 'hint_phone':
         hint_text = get_text(user, 'USE_BUTTON_PHONE')
@@ -1217,29 +1271,21 @@ async def process_hint_callback(callback: CallbackQuery):
 
 
 @dp.callback_query(lambda c: c.data in ['accept_privacy', 'decline_privacy'])
-async def process_privacy_acceptance(callback: CallbackQuery, state: FSMContext):
+async def process_privacy_acceptance(callback: CallbackQuery, state: FSMContext, db_user: TelegramUser = None):
     """Обрабатывает согласие на политику конфиденциальности."""
     # Игнорируем callback от ботов
     if callback.from_user.is_bot:
         return
+    if db_user is None:
+        await reply_please_start(callback)
+        return
     
     if callback.data == 'decline_privacy':
-        @sync_to_async
-        def get_user():
-            return TelegramUser.objects.get(telegram_id=callback.from_user.id)
-        user = await get_user()
-        await callback.answer(get_text(user, 'PRIVACY_DECLINED'))
-        await callback.message.answer(get_text(user, 'PRIVACY_REQUIRED'))
+        await callback.answer(get_text(db_user, 'PRIVACY_DECLINED'))
+        await callback.message.answer(get_text(db_user, 'PRIVACY_REQUIRED'))
         return
     
-    @sync_to_async
-    def update_privacy():
-        user = TelegramUser.objects.get(telegram_id=callback.from_user.id)
-        user.privacy_accepted = True
-        user.save(update_fields=['privacy_accepted'])
-        return user
-    
-    user = await update_privacy()
+    user = await update_user_fields(db_user, privacy_accepted=True)
     
     await callback.answer(get_text(user, 'PRIVACY_ACCEPTED'))
     await _safe_delete_message(callback.message)
@@ -1251,76 +1297,33 @@ async def process_privacy_acceptance(callback: CallbackQuery, state: FSMContext)
 async def handle_qr_code_scan(message: Message, user, qr_code_str: str, state: FSMContext):
     """Обрабатывает сканирование QR-кода."""
     try:
-        @sync_to_async
+        @db_sync_to_async
         def process_qr_scan():
-            from django.utils import timezone
-            from django.db import transaction
-            from datetime import datetime, time as dt_time
-            
             # Используем транзакцию для атомарности операций
             with transaction.atomic():
-                # Нормализуем ввод: приводим к верхнему регистру для поиска
-                qr_code_str_normalized = qr_code_str.upper().strip()
-                
-                # Ищем QR-код по коду или hash_code (case-insensitive)
-                qr_code = None
-                try:
-                    # Сначала ищем по полному коду (E-ABC123 или D-ABC123) - нечувствительно к регистру
-                    qr_code = QRCode.objects.get(code__iexact=qr_code_str_normalized)
-                except QRCode.DoesNotExist:
-                    # Если не нашли, пробуем найти по hash_code (без префикса) - нечувствительно к регистру
-                    try:
-                        qr_code = QRCode.objects.get(hash_code__iexact=qr_code_str_normalized)
-                    except QRCode.DoesNotExist:
-                        # QR-код не найден, возвращаем ошибку без создания попытки
-                        user.register_invalid_promo_attempt(source='bot', raw_code=qr_code_str)
-                        return {'error': 'not_found'}
-                
-                # Проверяем, не был ли уже отсканирован
-                if qr_code.is_scanned:
-                    # Создаем запись о неудачной попытке
-                    QRCodeScanAttempt.objects.create(
-                        user=user,
-                        qr_code=qr_code,
-                        is_successful=False
-                    )
+                # Активируем код одним условным UPDATE (без гонки при одновременном вводе)
+                status, qr_code = QRCode.claim(qr_code_str, user)
+                if status == 'not_found':
+                    # QR-код не найден, возвращаем ошибку без создания попытки
                     user.register_invalid_promo_attempt(source='bot', raw_code=qr_code_str)
-                    return {'error': 'already_scanned'}
+                    return {'error': 'not_found'}
                 
-                # Валидация типа кода - проверяем соответствие типу пользователя
-                if user.user_type and user.user_type != qr_code.code_type:
-                    # Создаем запись о неудачной попытке (несоответствие типа)
-                    QRCodeScanAttempt.objects.create(
-                        user=user,
-                        qr_code=qr_code,
-                        is_successful=False
-                    )
-                    user.register_invalid_promo_attempt(source='bot', raw_code=qr_code_str)
-                    return {'error': 'wrong_type'}
+                # Уже отсканирован или не соответствует типу пользователя
+                if status != 'claimed':
+                    # Неудачная попытка попадает в журнал вместе с найденным кодом
+                    user.register_invalid_promo_attempt(source='bot', raw_code=qr_code_str, qr_code=qr_code)
+                    return {'error': status}
                 
                 # Определяем тип пользователя на основе типа QR-кода (если еще не установлен)
                 if not user.user_type:
                     user.user_type = qr_code.code_type
                     user.save(update_fields=['user_type'])
                 
-                # Отмечаем QR-код как отсканированный
-                qr_code.is_scanned = True
-                qr_code.scanned_at = timezone.now()
-                qr_code.scanned_by = user
-                qr_code.save(update_fields=['is_scanned', 'scanned_at', 'scanned_by'])
+                # Фиксируем успешный промокод (запись в журнал — после коммита, через буфер)
+                user.register_successful_promo(raw_code=qr_code_str, source='bot', qr_code=qr_code)
                 
-                # Создаем запись об успешной попытке
-                QRCodeScanAttempt.objects.create(
-                    user=user,
-                    qr_code=qr_code,
-                    is_successful=True
-                )
-                # Фиксируем успешный промокод
-                user.register_successful_promo(raw_code=qr_code_str, source='bot')
-                
-                # Инвалидируем кеш и пересчитываем баллы из БД (как в webapp)
-                user.invalidate_points_cache()
-                total_points = user.calculate_points(force=True)
+                # Баллы начислены в журнал в QRCode.claim — читаем актуальный баланс
+                total_points = user.calculate_points()
                 
                 return {
                     'success': True,
@@ -1329,7 +1332,7 @@ async def handle_qr_code_scan(message: Message, user, qr_code_str: str, state: F
                 }
         
         # Перед обработкой проверяем блокировку по промокодам
-        blocked, block_type, blocked_until = await sync_to_async(user.is_promo_code_blocked)()
+        blocked, block_type, blocked_until = await db_sync_to_async(user.is_promo_code_blocked)()
         if blocked:
             if block_type == 'permanent':
                 await message.answer(get_text(user, 'PROMO_BLOCKED_PERMANENT'))
@@ -1338,14 +1341,11 @@ async def handle_qr_code_scan(message: Message, user, qr_code_str: str, state: F
             return
 
         result = await process_qr_scan()
+        invalidate_cached_user(user.telegram_id)
         
         # Проверяем, завершена ли регистрация (для определения, нужно ли показывать меню или продолжать регистрацию)
-        @sync_to_async
-        def get_user_for_reg_check():
-            return TelegramUser.objects.get(telegram_id=message.from_user.id)
-        
-        user_for_reg_check = await get_user_for_reg_check()
-        registration_complete = await is_registration_complete(user_for_reg_check)
+        # process_qr_scan обновляет тот же объект user, повторная загрузка не нужна
+        registration_complete = await is_registration_complete(user)
         
         if result.get('error') == 'not_found':
             await message.answer(get_text(user, 'QR_NOT_FOUND'))
@@ -1393,12 +1393,8 @@ async def handle_qr_code_scan(message: Message, user, qr_code_str: str, state: F
 
 async def show_main_menu(message: Message, user: TelegramUser):
     """Показывает главное меню бота."""
-    @sync_to_async
-    def get_user_points():
-        user_obj = TelegramUser.objects.get(telegram_id=message.from_user.id)
-        return user_obj.points
-    
-    points = await get_user_points()
+    # Баллы актуальны: calculate_points() в путях записи обновляет user.points
+    points = user.points
     
     # Создаем reply keyboard кнопки
     keyboard_buttons = []
@@ -1447,22 +1443,16 @@ async def show_main_menu(message: Message, user: TelegramUser):
 
 
 @dp.message()
-async def handle_message(message: Message, state: FSMContext = None):
+async def handle_message(message: Message, state: FSMContext = None, db_user: TelegramUser = None):
     """Универсальный обработчик сообщений."""
     # Игнорируем сообщения от ботов
     if message.from_user.is_bot:
         return
     
-    @sync_to_async
-    def get_user():
-        return TelegramUser.objects.get(telegram_id=message.from_user.id)
-    
-    try:
-        user = await get_user()
-    except TelegramUser.DoesNotExist:
+    user = db_user
+    if user is None:
         # Пользователь ещё не зарегистрирован — просим отправить /start
-        no_user = SimpleNamespace(language='uz_latin')
-        await message.answer(get_text(no_user, 'PLEASE_START'))
+        await reply_please_start(message)
         return
     
     # Если пользователь в состоянии регистрации, не обрабатываем как QR-код
@@ -1492,27 +1482,17 @@ async def handle_message(message: Message, state: FSMContext = None):
     if registration_incomplete:
         if message.contact and not user.phone_number:
             # Пользователь отправил контакт (кнопка или из списка контактов) — сохраняем
-            phone_number = message.contact.phone_number
-            @sync_to_async
-            def update_phone():
-                u = TelegramUser.objects.get(telegram_id=message.from_user.id)
-                u.phone_number = phone_number
-                u.save(update_fields=['phone_number'])
-                return u
-            user = await update_phone()
+            user = await update_user_fields(user, phone_number=message.contact.phone_number)
             await message.answer(get_text(user, 'PHONE_SAVED'))
             await ask_location(message, user, state)
             return
         if message.location and user.phone_number and (user.latitude is None or user.longitude is None):
             # Пользователь отправил геолокацию
-            lat, lon = message.location.latitude, message.location.longitude
-            @sync_to_async
-            def update_loc():
-                u = TelegramUser.objects.get(telegram_id=message.from_user.id)
-                u.latitude, u.longitude = lat, lon
-                u.save(update_fields=['latitude', 'longitude'])
-                return u
-            user = await update_loc()
+            user = await update_user_fields(
+                user,
+                latitude=message.location.latitude,
+                longitude=message.location.longitude,
+            )
             remove_kb = types.ReplyKeyboardRemove()
             if user.user_type == 'seller':
                 await message.answer(get_text(user, 'LOCATION_SAVED'), reply_markup=remove_kb)
@@ -1595,9 +1575,9 @@ async def handle_message(message: Message, state: FSMContext = None):
             reply_markup=inline_keyboard
         )
     elif message.text in all_leaders_texts:
-        await show_leaders(message)
+        await show_leaders(message, user)
     elif message.text in all_language_texts:
-        await show_language_selection(message)
+        await show_language_selection(message, user)
     elif message.text in all_promo_code_texts:
         # Отправляем просьбу ввести промокод
         await message.answer(get_text(user, 'SEND_PROMO_CODE'))
@@ -1611,12 +1591,12 @@ async def handle_message(message: Message, state: FSMContext = None):
             qr_code_str = message.text.strip().upper()
             await handle_qr_code_scan(message, user, qr_code_str, state)
         else:
-            await handle_unknown_message(message)
+            await handle_unknown_message(message, user)
 
 
 async def show_balance(message: Message, user: TelegramUser):
     """Показывает баланс пользователя."""
-    @sync_to_async
+    @db_sync_to_async
     def get_actual_points():
         return user.calculate_points()
 
@@ -1626,12 +1606,11 @@ async def show_balance(message: Message, user: TelegramUser):
 
 
 
-async def show_gifts(message: Message, state: FSMContext):
+async def show_gifts(message: Message, state: FSMContext, user: TelegramUser):
     """Показывает список доступных подарков с фильтрацией по типу пользователя."""
-    @sync_to_async
-    def get_gifts_and_user():
+    @db_sync_to_async
+    def get_gifts():
         from django.db.models import Q
-        user = TelegramUser.objects.get(telegram_id=message.from_user.id)
         # Фильтруем подарки: для типа пользователя или без типа (для всех)
         if user.user_type:
             gifts_query = Gift.objects.filter(
@@ -1643,10 +1622,9 @@ async def show_gifts(message: Message, state: FSMContext):
             # Если у пользователя нет типа, показываем только подарки без типа
             gifts_query = Gift.objects.filter(is_active=True, user_type__isnull=True)
         
-        gifts = list(gifts_query.order_by('order', 'points_cost'))
-        return user, gifts
+        return list(gifts_query.order_by('order', 'points_cost'))
     
-    user, gifts = await get_gifts_and_user()
+    gifts = await get_gifts()
     
     if not gifts:
         await message.answer(get_text(user, 'NO_GIFTS'))
@@ -1678,19 +1656,24 @@ async def show_gifts(message: Message, state: FSMContext):
 
 
 @dp.callback_query(lambda c: c.data.startswith("gift_"))
-async def process_gift_selection(callback: CallbackQuery, state: FSMContext):
+async def process_gift_selection(callback: CallbackQuery, state: FSMContext, db_user: TelegramUser = None):
     """Обрабатывает выбор подарка."""
     # Игнорируем callback от ботов
     if callback.from_user.is_bot:
         return
+    if db_user is None:
+        await reply_please_start(callback)
+        return
     
     gift_id = int(callback.data.split("_")[1])
     
-    @sync_to_async
+    @db_sync_to_async
     def process_gift():
         try:
             gift = Gift.objects.get(id=gift_id, is_active=True)
-            user = TelegramUser.objects.get(telegram_id=callback.from_user.id)
+            user = db_user
+            # Баланс перечитываем: объект мог прийти из кеша процесса
+            user.refresh_from_db(fields=['points', 'user_type'])
             
             # Проверяем, доступен ли подарок для типа пользователя
             if gift.user_type and gift.user_type != user.user_type:
@@ -1706,9 +1689,9 @@ async def process_gift_selection(callback: CallbackQuery, state: FSMContext):
                 status='pending'
             )
             
-            # Инвалидируем кеш и пересчитываем баллы (GiftRedemption уже создан выше)
-            user.invalidate_points_cache()
-            remaining_points = user.calculate_points(force=True)
+            # Стоимость списана в журнал баллов при создании GiftRedemption
+            remaining_points = user.calculate_points()
+            invalidate_cached_user(user.telegram_id)
             
             return {
                 'success': True,
@@ -1720,12 +1703,7 @@ async def process_gift_selection(callback: CallbackQuery, state: FSMContext):
     
     try:
         result = await process_gift()
-        
-        @sync_to_async
-        def get_user_for_callback():
-            return TelegramUser.objects.get(telegram_id=callback.from_user.id)
-        
-        user = await get_user_for_callback()
+        user = db_user
         
         if result.get('error') == 'insufficient_points':
             await callback.answer(get_text(user, 'INSUFFICIENT_POINTS'), show_alert=True)
@@ -1743,19 +1721,14 @@ async def process_gift_selection(callback: CallbackQuery, state: FSMContext):
                 await state.clear()
     except Exception as e:
         logger.error(f"Error processing gift selection: {e}")
-        @sync_to_async
-        def get_user_for_error():
-            return TelegramUser.objects.get(telegram_id=callback.from_user.id)
-        user = await get_user_for_error()
-        await callback.answer(get_text(user, 'GIFT_REQUEST_ERROR'), show_alert=True)
+        await callback.answer(get_text(db_user, 'GIFT_REQUEST_ERROR'), show_alert=True)
 
 
-async def show_leaders(message: Message):
+async def show_leaders(message: Message, user: TelegramUser):
     """Показывает ТОП лидеров (только баллы по промокодам, без вычета заказов)."""
-    @sync_to_async
-    def get_leaders_and_user():
+    @db_sync_to_async
+    def get_leaders():
         from django.db.models import Sum
-        user = TelegramUser.objects.get(telegram_id=message.from_user.id)
         user_type = user.user_type or 'electrician'
         qs = (
             QRCode.objects
@@ -1776,9 +1749,9 @@ async def show_leaders(message: Message):
         leaders = [u for u in leaders if u]
         for u in leaders:
             u._leader_points = points_map.get(u.id, 0)
-        return user, leaders
+        return leaders
     
-    user, leaders = await get_leaders_and_user()
+    leaders = await get_leaders()
     
     if not leaders:
         await message.answer(get_text(user, 'NO_LEADERS'))
@@ -1797,14 +1770,8 @@ async def show_leaders(message: Message):
     await message.answer(text)
 
 
-async def show_language_selection(message: Message):
+async def show_language_selection(message: Message, user: TelegramUser):
     """Показывает выбор языка."""
-    @sync_to_async
-    def get_user():
-        return TelegramUser.objects.get(telegram_id=message.from_user.id)
-    
-    user = await get_user()
-    
     # Используем фиксированные тексты для кнопок выбора языка
     keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
         [types.InlineKeyboardButton(
@@ -1823,12 +1790,7 @@ async def show_language_selection(message: Message):
 # Этот обработчик удален - теперь смена языка обрабатывается в process_language_selection выше
 
 
-async def handle_unknown_message(message: Message):
+async def handle_unknown_message(message: Message, user: TelegramUser):
     """Обработчик неизвестных сообщений."""
-    @sync_to_async
-    def get_user():
-        return TelegramUser.objects.get(telegram_id=message.from_user.id)
-    
-    user = await get_user()
     await message.answer(get_text(user, 'UNKNOWN_COMMAND'))
 
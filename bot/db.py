@@ -0,0 +1,67 @@
+"""
+Доступ к БД из обработчиков бота.
+
+sync_to_async по умолчанию (thread_sensitive=True) выполняет все вызовы ORM в одном
+общем потоке, поэтому запросы разных апдейтов идут строго по очереди. Async-методы
+ORM Django (aget, acreate, aaggregate) внутри используют тот же sync_to_async и
+не снимают это ограничение.
+
+db_sync_to_async выполняет функцию в отдельном ограниченном пуле потоков
+(BOT_DB_THREADS). У каждого потока своё соединение с БД, поэтому запросы
+разных апдейтов выполняются параллельно. Транзакция (transaction.atomic)
+должна целиком находиться внутри одной обёрнутой функции.
+"""
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import SyncToAsync
+from django.conf import settings
+from django.db import connections
+
+_executor = None
+
+
+def get_db_executor():
+    """Пул потоков для запросов бота (создаётся лениво — после fork воркеров webhook)."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.BOT_DB_THREADS,
+            thread_name_prefix='bot-db',
+        )
+    return _executor
+
+
+def _close_broken_connections():
+    # Соединения потоков живут долго; после ошибки БД (рестарт, обрыв) переоткрываем их
+    for conn in connections.all(initialized_only=True):
+        if conn.errors_occurred and not conn.is_usable():
+            conn.close()
+
+
+class DatabaseSyncToAsync(SyncToAsync):
+    """SyncToAsync, выполняющий функцию в пуле потоков бота."""
+
+    def __init__(self, func):
+        super().__init__(func, thread_sensitive=False, executor=get_db_executor())
+
+    def thread_handler(self, loop, *args, **kwargs):
+        _close_broken_connections()
+        return super().thread_handler(loop, *args, **kwargs)
+
+
+def db_sync_to_async(func):
+    """
+    Декоратор/обёртка для синхронного кода с ORM в обработчиках бота.
+
+    При BOT_DB_THREADS = 0 работает как обычный sync_to_async (один общий поток).
+    """
+    if settings.BOT_DB_THREADS <= 0:
+        from asgiref.sync import sync_to_async
+        return sync_to_async(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await DatabaseSyncToAsync(func)(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,144 @@
+"""
+Защита от повторной обработки апдейтов Telegram.
+
+Telegram повторяет доставку апдейта, если не дождался ответа webhook, а при деплое
+мы не сбрасываем накопившиеся апдейты (drop_pending_updates=False). Middleware
+занимает update_id в Redis (SET NX, общий для всех процессов) и пропускает повторы до
+вызова handlers. Пока апдейт обрабатывается, ключ живет PROCESSING_TTL; после успешной
+обработки — ttl. Если handler упал, ключ снимается: повторная доставка от Telegram будет
+обработана. Если Redis недоступен — используется локальный LRU.
+"""
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateDedupMiddleware(BaseMiddleware):
+    """
+    Outer-middleware для dp.update: пропускает апдейты, update_id которых уже видели.
+
+    Args:
+        redis_url: URL Redis для общего журнала update_id ('' — только локальный LRU).
+        ttl: Сколько секунд помнить update_id.
+        local_size: Размер локального LRU (запасной вариант и быстрый путь).
+    """
+
+    KEY_PREFIX = 'tg_update'
+    # Сколько секунд апдейт считается «в обработке» (повтор в это время пропускается)
+    PROCESSING_TTL = 120
+    # Пауза перед повторным обращением к Redis после ошибки, секунды
+    REDIS_RETRY_DELAY = 30
+
+    def __init__(self, redis_url: str = '', ttl: int = 3600, local_size: int = 50000):
+        self.redis_url = redis_url
+        self.ttl = ttl
+        self.local_size = local_size
+        self._redis = None
+        self._redis_retry_at = 0.0
+        self._local = OrderedDict()
+        self.checked = 0
+        self.suppressed = 0
+        self.redis_errors = 0
+
+    def _get_redis(self):
+        # Клиент создаётся лениво: после fork у каждого воркера свой event loop
+        if not self.redis_url or time.monotonic() < self._redis_retry_at:
+            return None
+        if self._redis is None:
+            from redis.asyncio import Redis
+            self._redis = Redis.from_url(
+                self.redis_url,
+                socket_connect_timeout=0.5,
+                socket_timeout=0.5,
+            )
+        return self._redis
+
+    def _seen_locally(self, update_id: int) -> bool:
+        """Отмечает update_id в локальном LRU. Возвращает True, если он уже был."""
+        if update_id in self._local:
+            self._local.move_to_end(update_id)
+            return True
+        self._local[update_id] = None
+        if len(self._local) > self.local_size:
+            self._local.popitem(last=False)
+        return False
+
+    def _redis_failed(self, e: Exception) -> None:
+        self.redis_errors += 1
+        self._redis_retry_at = time.monotonic() + self.REDIS_RETRY_DELAY
+        logger.warning(f"[UpdateDedup] Redis недоступен, используем локальный LRU: {e}")
+
+    async def _seen_in_redis(self, update_id: int) -> Optional[bool]:
+        """True/False — результат SET NX в Redis (update_id занят на PROCESSING_TTL); None — Redis недоступен."""
+        redis = self._get_redis()
+        if redis is None:
+            return None
+        try:
+            created = await redis.set(f'{self.KEY_PREFIX}:{update_id}', 1, nx=True, ex=self.PROCESSING_TTL)
+        except Exception as e:
+            self._redis_failed(e)
+            return None
+        return not created
+
+    async def mark_done(self, update_id: int) -> None:
+        """Апдейт обработан: помним update_id полный ttl."""
+        redis = self._get_redis()
+        if redis is None:
+            return
+        try:
+            await redis.set(f'{self.KEY_PREFIX}:{update_id}', 1, ex=self.ttl)
+        except Exception as e:
+            self._redis_failed(e)
+
+    async def release(self, update_id: int) -> None:
+        """Handler упал: забываем update_id, чтобы повторная доставка была обработана."""
+        self._local.pop(update_id, None)
+        redis = self._get_redis()
+        if redis is None:
+            return
+        try:
+            await redis.delete(f'{self.KEY_PREFIX}:{update_id}')
+        except Exception as e:
+            self._redis_failed(e)
+
+    async def is_duplicate(self, update_id: int) -> bool:
+        self.checked += 1
+        if self._seen_locally(update_id):
+            return True
+        seen = await self._seen_in_redis(update_id)
+        return bool(seen)
+
+    async def __call__(self, handler, event, data):
+        if not isinstance(event, Update):
+            return await handler(event, data)
+        if await self.is_duplicate(event.update_id):
+            self.suppressed += 1
+            logger.info(f"[UpdateDedup] Повторный апдейт {event.update_id} пропущен")
+            return None
+        try:
+            result = await handler(event, data)
+        except BaseException:
+            await self.release(event.update_id)
+            raise
+        await self.mark_done(event.update_id)
+        return result
+
+    async def close(self) -> None:
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+    def stats(self) -> dict:
+        """Метрики для /health."""
+        return {
+            'checked': self.checked,
+            'suppressed': self.suppressed,
+            'redis_errors': self.redis_errors,
+            'local_size': len(self._local),
+        }
@@ -0,0 +1,146 @@
+"""
+Очередь входящих апдейтов webhook.
+
+Telegram получает 200 сразу после постановки апдейта в очередь, а обработку
+выполняет пул воркеров. Апдейты одного чата всегда попадают к одному воркеру
+(chat_id % workers) и обрабатываются строго по порядку; разные чаты
+обрабатываются параллельно.
+"""
+import asyncio
+import logging
+from typing import Any, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+def get_update_chat_id(update: Update) -> int:
+    """Возвращает ключ упорядочивания апдейта: id чата, иначе id пользователя, иначе update_id."""
+    if update.message:
+        return update.message.chat.id
+    if update.callback_query:
+        if update.callback_query.message:
+            return update.callback_query.message.chat.id
+        return update.callback_query.from_user.id
+    return update.update_id
+
+
+class OrderedUpdateQueue:
+    """
+    Ограниченная очередь апдейтов с пулом воркеров.
+
+    Каждый воркер читает свой шард очереди, поэтому порядок апдейтов внутри
+    одного чата сохраняется. Если шард заполнен, апдейт не принимается
+    (счётчик dropped), а Telegram получает 503 и повторит доставку позже.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, workers: int = 16, maxsize: int = 2000, **data: Any):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.data = data
+        self.workers = max(1, workers)
+        shard_size = max(1, maxsize // self.workers)
+        self._queues = [asyncio.Queue(maxsize=shard_size) for _ in range(self.workers)]
+        self._tasks = []
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def put_nowait(self, update: Update) -> bool:
+        """Ставит апдейт в шард его чата. Возвращает False, если шард переполнен."""
+        shard = self._queues[get_update_chat_id(update) % self.workers]
+        try:
+            shard.put_nowait((asyncio.get_running_loop().time(), update))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f"[OrderedUpdateQueue] Очередь переполнена, апдейт {update.update_id} отклонён")
+            return False
+        self.enqueued += 1
+        return True
+
+    async def _worker(self, shard: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            enqueued_at, update = await shard.get()
+            lag = loop.time() - enqueued_at
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            try:
+                result = await self.dispatcher.feed_update(self.bot, update, **self.data)
+                if isinstance(result, TelegramMethod):
+                    await self.dispatcher.silent_call_request(bot=self.bot, result=result)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"[OrderedUpdateQueue] Ошибка обработки апдейта {update.update_id}: {e}", exc_info=True)
+            finally:
+                shard.task_done()
+
+    async def start(self, app: Optional[web.Application] = None) -> None:
+        """Запускает воркеры (используется как aiohttp on_startup)."""
+        self._tasks = [asyncio.create_task(self._worker(shard)) for shard in self._queues]
+        logger.info(f"[OrderedUpdateQueue] Запущено {self.workers} воркеров")
+
+    async def stop(self, app: Optional[web.Application] = None, timeout: float = 30) -> None:
+        """Дожидается обработки принятых апдейтов (не дольше timeout) и останавливает воркеры."""
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(shard.join() for shard in self._queues)),
+                timeout=timeout,
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"[OrderedUpdateQueue] Не дождались обработки {self.depth} апдейтов при остановке")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    @property
+    def depth(self) -> int:
+        return sum(shard.qsize() for shard in self._queues)
+
+    def stats(self) -> dict:
+        """Метрики очереди для /health."""
+        return {
+            'workers': self.workers,
+            'depth': self.depth,
+            'max_depth': sum(shard.maxsize for shard in self._queues),
+            'enqueued': self.enqueued,
+            'processed': self.processed,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'last_lag_seconds': round(self.last_lag, 3),
+            'max_lag_seconds': round(self.max_lag, 3),
+        }
+
+
+class QueuedRequestHandler(SimpleRequestHandler):
+    """Webhook-обработчик, который только кладёт апдейт в OrderedUpdateQueue и сразу отвечает 200."""
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, update_queue: OrderedUpdateQueue, **kwargs: Any):
+        super().__init__(dispatcher=dispatcher, bot=bot, **kwargs)
+        self.update_queue = update_queue
+
+    async def handle(self, request: web.Request) -> web.Response:
+        bot = await self.resolve_bot(request)
+        if not self.verify_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), bot):
+            return web.Response(body="Unauthorized", status=401)
+
+        update = Update.model_validate(
+            await request.json(loads=bot.session.json_loads),
+            context={"bot": bot},
+        )
+        if not self.update_queue.put_nowait(update):
+            # Telegram повторит доставку, апдейт не теряется
+            return web.Response(body="Queue is full", status=503)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    __call__ = handle
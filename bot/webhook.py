@@ -2,7 +2,9 @@
 Webhook configuration for Telegram bot in production.
 """
 import os
+import signal
 import logging
+import multiprocessing
 import django
 from aiogram import Bot, Dispatcher
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler
@@ -13,7 +15,8 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mona.settings')
 django.setup()
 
 from django.conf import settings
-from .bot import dp, bot
+from .bot import dp, bot, update_dedup
+from .update_queue import OrderedUpdateQueue, QueuedRequestHandler
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
@@ -22,7 +25,7 @@ logging.basicConfig(level=logging.INFO)
 async def on_startup(bot: Bot):
     """Выполняется при запуске webhook."""
     webhook_url = f"{settings.WEBHOOK_URL}/webhook/{settings.TELEGRAM_BOT_TOKEN}"
-    
+
     try:
         # drop_pending_updates=False — не терять обновления, накопившиеся во время деплоя
         await bot.set_webhook(
@@ -44,38 +47,130 @@ async def on_shutdown(bot: Bot):
         logger.error(f"Ошибка при удалении webhook: {e}")
 
 
-def create_webhook_app():
-    """Создает aiohttp приложение для webhook."""
+async def close_storage(app):
+    """Закрывает соединения с Redis (FSM, дедупликация апдейтов) при остановке процесса."""
+    try:
+        await dp.storage.close()
+    except Exception as e:
+        logger.warning(f"Ошибка при закрытии FSM storage: {e}")
+    if update_dedup is not None:
+        await update_dedup.close()
+
+
+def create_webhook_app(manage_webhook=True):
+    """
+    Создает aiohttp приложение для webhook.
+
+    Args:
+        manage_webhook: Устанавливать/удалять webhook в Telegram при старте/остановке.
+            В многопроцессном режиме это делает только первый воркер.
+    """
     app = web.Application()
-    
-    # Создаем обработчик webhook
-    webhook_requests_handler = SimpleRequestHandler(
-        dispatcher=dp,
-        bot=bot,
-    )
-    
+
+    # Создаем обработчик webhook. При WEBHOOK_QUEUE_WORKERS > 0 апдейты идут через
+    # ограниченную очередь с пулом воркеров (порядок внутри чата сохраняется)
+    queue_workers = getattr(settings, 'WEBHOOK_QUEUE_WORKERS', 0)
+    if queue_workers > 0:
+        update_queue = OrderedUpdateQueue(
+            dispatcher=dp,
+            bot=bot,
+            workers=queue_workers,
+            maxsize=settings.WEBHOOK_QUEUE_MAXSIZE,
+        )
+        app['update_queue'] = update_queue
+        app.on_startup.append(update_queue.start)
+        app.on_shutdown.append(update_queue.stop)
+        webhook_requests_handler = QueuedRequestHandler(
+            dispatcher=dp,
+            bot=bot,
+            update_queue=update_queue,
+        )
+    else:
+        webhook_requests_handler = SimpleRequestHandler(
+            dispatcher=dp,
+            bot=bot,
+        )
+
     # Регистрируем путь для webhook
     webhook_path = f"/webhook/{settings.TELEGRAM_BOT_TOKEN}"
     webhook_requests_handler.register(app, path=webhook_path)
-    
+
     # Регистрируем startup и shutdown события
-    app.on_startup.append(lambda app: on_startup(bot))
-    app.on_shutdown.append(lambda app: on_shutdown(bot))
-    
+    if manage_webhook:
+        app.on_startup.append(lambda app: on_startup(bot))
+        app.on_shutdown.append(lambda app: on_shutdown(bot))
+    app.on_cleanup.append(close_storage)
+
     return app
 
 
 async def health_check(request):
-    """Health check endpoint."""
-    return web.json_response({"status": "ok"})
+    """Health check endpoint (с метриками очереди апдейтов и дедупликации, если они включены)."""
+    payload = {"status": "ok", "pid": os.getpid()}
+    update_queue = request.app.get('update_queue')
+    if update_queue is not None:
+        payload['update_queue'] = update_queue.stats()
+    if update_dedup is not None:
+        payload['update_dedup'] = update_dedup.stats()
+    return web.json_response(payload)
 
 
-def get_webhook_app():
+def get_webhook_app(manage_webhook=True):
     """Возвращает настроенное приложение для webhook."""
-    app = create_webhook_app()
-    
+    app = create_webhook_app(manage_webhook=manage_webhook)
+
     # Добавляем health check
     app.router.add_get("/health", health_check)
-    
+
     return app
 
+
+def _run_worker(worker_index, host, port):
+    """Точка входа процесса-воркера: свой event loop и своё aiohttp-приложение."""
+    app = get_webhook_app(manage_webhook=(worker_index == 0))
+    logger.info(f"Webhook воркер #{worker_index} (pid={os.getpid()}) слушает {host}:{port}")
+    web.run_app(app, host=host, port=port, reuse_port=True, print=None)
+
+
+def run_webhook_workers(host, port, workers):
+    """
+    Запускает несколько процессов webhook на одном порту (SO_REUSEPORT).
+    Ядро распределяет входящие соединения между процессами.
+
+    Состояние FSM должно быть общим для всех процессов, поэтому
+    многопроцессный режим требует BOT_FSM_STORAGE=redis. Для масштабирования
+    на несколько нод достаточно запустить run_webhook.py за балансировщиком
+    с тем же Redis.
+    """
+    if workers > 1 and getattr(settings, 'BOT_FSM_STORAGE', 'memory') != 'redis':
+        raise RuntimeError(
+            "WEBHOOK_WORKERS > 1 требует BOT_FSM_STORAGE=redis: "
+            "MemoryStorage не разделяется между процессами"
+        )
+
+    # Соединения с БД, открытые до fork, не должны наследоваться воркерами
+    from django.db import connections
+    connections.close_all()
+
+    ctx = multiprocessing.get_context('fork')
+    processes = []
+    for worker_index in range(workers):
+        process = ctx.Process(
+            target=_run_worker,
+            args=(worker_index, host, port),
+            name=f"webhook-worker-{worker_index}",
+        )
+        process.start()
+        processes.append(process)
+
+    def _terminate(signum, frame):
+        logger.info(f"Получен сигнал {signum}, останавливаем {len(processes)} воркеров")
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, _terminate)
+    signal.signal(signal.SIGINT, _terminate)
+
+    for process in processes:
+        process.join()
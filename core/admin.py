@@ -17,7 +17,6 @@ class NoDeleteAdminMixin:
         if 'delete_selected' in actions:
             del actions['delete_selected']
         return actions
-from django.http import HttpResponse
 from django.utils.html import format_html
 from django.urls import path
 from django.shortcuts import render, redirect
@@ -27,8 +26,9 @@ from django.conf import settings
 from django.db import models
 from simple_history.admin import SimpleHistoryAdmin
 from .models import (
-    TelegramUser, QRCode, QRCodeScanAttempt, PromoCodeAttempt,
-    Gift, GiftRedemption, BroadcastMessage, RegionMessageLog, Promotion, QRCodeGeneration, PrivacyPolicy, AdminContactSettings, VideoInstruction, SmartUPId
+    TelegramUser, QRCode, PromoCodeAttempt,
+    Gift, GiftRedemption, BroadcastMessage, RegionMessageLog, Promotion, QRCodeGeneration, PrivacyPolicy, AdminContactSettings, VideoInstruction, SmartUPId,
+    PointsTransaction,
 )
 from .utils import generate_qr_code_image, generate_qr_codes_batch
 
@@ -75,8 +75,9 @@ class PromoCodeAttemptInline(admin.TabularInline):
     model = PromoCodeAttempt
     extra = 0
     can_delete = False
-    readonly_fields = ['raw_code', 'attempted_at', 'is_successful', 'source']
-    fields = ['attempted_at', 'raw_code', 'is_successful', 'source']
+    fk_name = 'user'
+    readonly_fields = ['raw_code', 'qr_code', 'attempted_at', 'is_successful', 'source']
+    fields = ['attempted_at', 'raw_code', 'qr_code', 'is_successful', 'source']
     ordering = ['-attempted_at']
     verbose_name = 'Попытка ввода промокода'
     verbose_name_plural = 'Попытки ввода промокодов'
@@ -149,14 +150,10 @@ class TelegramUserAdmin(NoDeleteAdminMixin, SimpleHistoryAdmin):
     user_type_badge.admin_order_field = 'user_type'
     
     def points_display(self, obj):
-        """Отображает баллы с цветом (вычисляются динамически: промокоды − активные заказы)."""
+        """Отображает баллы с цветом (баланс из журнала баллов: промокоды − активные заказы)."""
         if obj is None:
             return '-'
-        try:
-            calculated = obj.calculate_points()
-        except Exception:
-            calculated = obj.points
-        points_formatted = f"{calculated:,}".replace(",", " ")
+        points_formatted = f"{max(0, obj.points):,}".replace(",", " ")
         return format_html(
             '<span style="color: #667eea; font-weight: 700; font-size: 16px;">{} баллов</span>',
             points_formatted
@@ -337,9 +334,16 @@ class TelegramUserAdmin(NoDeleteAdminMixin, SimpleHistoryAdmin):
                     readonly.append(field)
         # Для обычных админов (не superuser и не Call Center) user_type доступен для редактирования
         # Он не в списке readonly_fields, поэтому будет доступен по умолчанию
-        
+
         return readonly
-    
+
+    def save_model(self, request, obj, form, change):
+        """Ручное изменение блокировки по промокодам сбрасывает и счётчики в Redis."""
+        super().save_model(request, obj, form, change)
+        if change and {'promo_failed_attempts', 'promo_blocked_until'} & set(form.changed_data):
+            from .promo_limiter import reset
+            reset(obj.pk)
+
     def send_personal_message_action(self, request, queryset):
         """Действие для отправки персонального сообщения."""
         from django.shortcuts import render
@@ -362,25 +366,12 @@ class TelegramUserAdmin(NoDeleteAdminMixin, SimpleHistoryAdmin):
                 import asyncio
                 from django.conf import settings
                 from aiogram import Bot
-                from core.messaging import send_personal_message
+                from core.messaging import send_to_users
                 
                 async def send_messages():
                     bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
                     try:
-                        sent = 0
-                        failed = 0
-                        for user in queryset:
-                            success, error = await send_personal_message(
-                                bot=bot,
-                                telegram_id=user.telegram_id,
-                                text=message_text,
-                                parse_mode=parse_mode
-                            )
-                            if success:
-                                sent += 1
-                            else:
-                                failed += 1
-                        return sent, failed
+                        return await send_to_users(bot, list(queryset), message_text, parse_mode=parse_mode)
                     finally:
                         await bot.session.close()
                 
@@ -557,7 +548,7 @@ class TelegramUserAdmin(NoDeleteAdminMixin, SimpleHistoryAdmin):
         """Страница отправки сообщения по области (с фото, форматированием, ссылками)."""
         from django import forms
         from django.core.exceptions import PermissionDenied
-        from core.regions import get_region_by_coordinates, get_all_regions
+        from core.regions import get_all_regions
 
         if not request.user.has_perm('core.send_region_messages'):
             raise PermissionDenied
@@ -591,33 +582,17 @@ class TelegramUserAdmin(NoDeleteAdminMixin, SimpleHistoryAdmin):
                 user_type_filter = form.cleaned_data['user_type_filter'] or None
                 language_filter = form.cleaned_data.get('language_filter') or None
 
-                users_qs = TelegramUser.objects.filter(
-                    latitude__isnull=False,
-                    longitude__isnull=False,
-                    is_active=True
+                users_qs = TelegramUser.audience(
+                    user_type=user_type_filter, language=language_filter, region=region_code,
                 )
-                if user_type_filter:
-                    users_qs = users_qs.filter(user_type=user_type_filter)
-                if language_filter:
-                    users_qs = users_qs.filter(language=language_filter)
-
-                users = list(users_qs)
-                if region_code == 'all':
-                    filtered = users
-                else:
-                    filtered = [
-                        u for u in users
-                        if get_region_by_coordinates(u.latitude, u.longitude) == region_code
-                    ]
+                n = users_qs.count()
 
-                if not filtered:
+                if not n:
                     msg = 'Нет пользователей с координатами.' if region_code == 'all' else 'В выбранной области нет пользователей с координатами.'
                     self.message_user(request, msg, messages.WARNING)
                 else:
                     from core.tasks import send_region_message_task, REGION_MESSAGE_ASYNC_THRESHOLD
-                    from core.messaging import TELEGRAM_MESSAGE_DELAY
 
-                    n = len(filtered)
                     # Большая рассылка — в фоне (нет таймаута админки, соблюдаются лимиты Telegram)
                     if n > REGION_MESSAGE_ASYNC_THRESHOLD:
                         import os
@@ -657,6 +632,7 @@ class TelegramUserAdmin(NoDeleteAdminMixin, SimpleHistoryAdmin):
                         return redirect('admin:core_regionmessagelog_changelist')
 
                     # Небольшая рассылка — сразу в этом запросе
+                    filtered = list(users_qs)
                     import asyncio
                     import tempfile
                     import os
@@ -671,22 +647,12 @@ class TelegramUserAdmin(NoDeleteAdminMixin, SimpleHistoryAdmin):
 
                     async def send_all():
                         from aiogram import Bot
+                        from core.messaging import send_to_users
                         bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
-                        sent, failed = 0, 0
                         try:
-                            for i, user in enumerate(filtered):
-                                from core.messaging import send_message_to_user
-                                success, err = await send_message_to_user(
-                                    bot=bot, user=user, text=message_text,
-                                    parse_mode='HTML', photo_path=photo_path
-                                )
-                                if success:
-                                    sent += 1
-                                else:
-                                    failed += 1
-                                if i < len(filtered) - 1:
-                                    await asyncio.sleep(TELEGRAM_MESSAGE_DELAY)
-                            return sent, failed
+                            return await send_to_users(
+                                bot, filtered, message_text, parse_mode='HTML', photo_path=photo_path
+                            )
                         finally:
                             await bot.session.close()
                             if photo_path and os.path.exists(photo_path):
@@ -714,11 +680,14 @@ class TelegramUserAdmin(NoDeleteAdminMixin, SimpleHistoryAdmin):
         return TemplateResponse(request, 'admin/core/telegramuser/send_region_message.html', context)
 
 
-class QRCodeScanAttemptInline(admin.TabularInline):
-    """Инлайн для попыток сканирования."""
-    model = QRCodeScanAttempt
+class QRCodeAttemptInline(admin.TabularInline):
+    """Инлайн для попыток сканирования (журнал PromoCodeAttempt по QR-коду)."""
+    model = PromoCodeAttempt
+    fk_name = 'qr_code'
     extra = 0
-    readonly_fields = ['user', 'attempted_at', 'is_successful']
+    readonly_fields = ['user', 'attempted_at', 'is_successful', 'source']
+    fields = ['user', 'attempted_at', 'is_successful', 'source']
+    ordering = ['attempted_at']
     can_delete = False
 
 
@@ -736,10 +705,10 @@ class QRCodeAdmin(NoDeleteAdminMixin, SimpleHistoryAdmin):
     search_fields = ['code', 'hash_code', 'serial_number']
     readonly_fields = [
         'code', 'code_type', 'hash_code', 'serial_number',
-        'points', 'generated_at', 'scanned_at', 'scanned_by', 'is_scanned'
+        'points', 'generated_at', 'scanned_at', 'scanned_by', 'is_scanned', 'generation'
     ]
     ordering = ['-generated_at']
-    inlines = [QRCodeScanAttemptInline]
+    inlines = [QRCodeAttemptInline]
     list_per_page = 50
     date_hierarchy = 'generated_at'
     
@@ -1018,9 +987,9 @@ class QRCodeAdmin(NoDeleteAdminMixin, SimpleHistoryAdmin):
                 previous_scanned_by = obj.scanned_by
                 previous_scanned_at = obj.scanned_at
                 attempts_before = list(
-                    QRCodeScanAttempt.objects.filter(qr_code=obj).select_related('user').order_by('attempted_at')
+                    PromoCodeAttempt.objects.filter(qr_code=obj).select_related('user').order_by('attempted_at')
                 )
-                deleted_count, _ = QRCodeScanAttempt.objects.filter(qr_code=obj).delete()
+                deleted_count, _ = PromoCodeAttempt.objects.filter(qr_code=obj).delete()
 
                 # Формируем подробное описание для истории изменений (до save), читабельно
                 lines = ["Отменены сканирования (очистка попыток и сканировавшего пользователя).", ""]
@@ -1057,7 +1026,6 @@ class QRCodeAdmin(NoDeleteAdminMixin, SimpleHistoryAdmin):
                 obj._change_reason = change_message
                 obj.save(update_fields=['scanned_by', 'scanned_at', 'is_scanned'])
                 if previous_scanned_by:
-                    previous_scanned_by.invalidate_points_cache()
                     # Запись в историю пользователя (TelegramUser): что было отменено, читабельно
                     user_lines = [
                         f"Отменено сканирование по промокоду {obj.serial_number} (QRCode id={obj.id}).",
@@ -1438,12 +1406,6 @@ class GiftRedemptionAdmin(NoDeleteAdminMixin, SimpleHistoryAdmin):
         # Сохраняем объект
         super().save_model(request, obj, form, change)
         
-        # Инвалидируем кеш баллов при изменении статуса на отмену/отклонение
-        if change and 'status' in form.changed_data:
-            if obj.status in ['rejected', 'cancelled_by_user', 'not_received']:
-                obj.user.invalidate_points_cache()
-                obj.user.calculate_points(force=True)
-        
         # Отправляем уведомления после сохранения
         if change:
             import asyncio
@@ -1532,6 +1494,24 @@ class RegionMessageLogAdmin(NoDeleteAdminMixin, admin.ModelAdmin):
         return False
 
 
+@admin.register(PointsTransaction)
+class PointsTransactionAdmin(NoDeleteAdminMixin, admin.ModelAdmin):
+    """Журнал баллов (только просмотр; записи создаются при сканировании и заказах)."""
+    list_display = ['user', 'delta', 'reason', 'qr_code', 'redemption', 'created_at']
+    list_filter = ['reason', ('created_at', DateTimeRangeFilterBuilder(title='Дата'))]
+    search_fields = ['user__telegram_id', 'user__first_name', 'user__phone_number']
+    raw_id_fields = ['user', 'qr_code', 'redemption']
+    list_select_related = ['user', 'qr_code', 'redemption__gift']
+    ordering = ['-created_at']
+    date_hierarchy = 'created_at'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(BroadcastMessage)
 class BroadcastMessageAdmin(NoDeleteAdminMixin, SimpleHistoryAdmin):
     """Админка для массовых рассылок (скрыта из меню админки)."""
@@ -1545,7 +1525,7 @@ class BroadcastMessageAdmin(NoDeleteAdminMixin, SimpleHistoryAdmin):
     ]
     search_fields = ['title', 'message_text']
     readonly_fields = [
-        'status', 'total_users', 'sent_count', 'failed_count',
+        'status', 'total_users', 'sent_count', 'failed_count', 'retry_count', 'flood_wait_count',
         'created_at', 'started_at', 'completed_at'
     ]
     
@@ -1560,7 +1540,7 @@ class BroadcastMessageAdmin(NoDeleteAdminMixin, SimpleHistoryAdmin):
         }),
         ('Статистика', {
             'fields': (
-                'status', 'total_users', 'sent_count', 'failed_count',
+                'status', 'total_users', 'sent_count', 'failed_count', 'retry_count', 'flood_wait_count',
                 'created_at', 'started_at', 'completed_at'
             )
         }),
@@ -1651,7 +1631,13 @@ class BroadcastMessageAdmin(NoDeleteAdminMixin, SimpleHistoryAdmin):
             kwargs['choices'] = choices
             kwargs['required'] = False
         return super().formfield_for_dbfield(db_field, request, **kwargs)
-    
+
+    def save_model(self, request, obj, form, change):
+        """При замене фото сохраненный file_id больше не подходит — фото загрузится заново."""
+        if 'image' in form.changed_data:
+            obj.image_file_id = ''
+        super().save_model(request, obj, form, change)
+
     def send_broadcast_action(self, request, queryset):
         """Действие для отправки рассылки."""
         import subprocess
@@ -1776,7 +1762,7 @@ class QRCodeGenerationAdmin(NoDeleteAdminMixin, SimpleHistoryAdmin):
     """Админка для истории генерации QR-кодов."""
     list_display = [
         'generation_display', 'code_type_badge', 'quantity_display',
-        'points_display', 'status_badge', 'created_by_display',
+        'points_display', 'status_badge', 'progress_display', 'created_by_display',
         'created_at', 'completed_at_display', 'download_button'
     ]
     list_filter = [
@@ -1785,8 +1771,9 @@ class QRCodeGenerationAdmin(NoDeleteAdminMixin, SimpleHistoryAdmin):
     ]
     search_fields = ['id']
     readonly_fields = [
-        'code_type', 'quantity', 'points', 'status', 'zip_file',
-        'qr_codes', 'error_message', 'created_by', 'created_at', 'completed_at'
+        'code_type', 'quantity', 'points', 'status', 'generated_count', 'zip_file',
+        'export_status', 'export_progress', 'export_updated_at', 'export_file',
+        'error_message', 'created_by', 'created_at', 'completed_at'
     ]
     ordering = ['-created_at']
     list_per_page = 50
@@ -1856,6 +1843,16 @@ class QRCodeGenerationAdmin(NoDeleteAdminMixin, SimpleHistoryAdmin):
     status_badge.short_description = 'Статус'
     status_badge.admin_order_field = 'status'
     
+    def progress_display(self, obj):
+        """Отображает прогресс генерации (создано кодов из заказанных)."""
+        percent = obj.generated_count * 100 // obj.quantity if obj.quantity else 0
+        return format_html(
+            '<span style="font-weight: 600;">{} / {}</span> '
+            '<span style="color: #718096; font-size: 12px;">({}%)</span>',
+            obj.generated_count, obj.quantity, percent
+        )
+    progress_display.short_description = 'Прогресс'
+    
     def created_by_display(self, obj):
         """Отображает создателя."""
         if obj.created_by:
@@ -1872,20 +1869,46 @@ class QRCodeGenerationAdmin(NoDeleteAdminMixin, SimpleHistoryAdmin):
     completed_at_display.admin_order_field = 'completed_at'
     
     def download_button(self, obj):
-        """Кнопки для скачивания ZIP файла и Excel."""
+        """Кнопки для скачивания ZIP (потоком), PDF, Excel и CSV."""
         if obj.status == 'completed':
             buttons = []
-            if obj.zip_file:
+            buttons.append(
+                '<a href="{}" style="background: #417690; color: white; padding: 6px 12px; '
+                'border-radius: 4px; text-decoration: none; display: inline-block; margin-right: 5px;">📥 .zip</a>'.format(
+                    f'/admin/core/qrcodegeneration/{obj.id}/export_zip/'
+                )
+            )
+            buttons.append(
+                '<a href="{}" style="background: #6f42c1; color: white; padding: 6px 12px; '
+                'border-radius: 4px; text-decoration: none; display: inline-block; margin-right: 5px;">🖨 .pdf</a>'.format(
+                    f'/admin/core/qrcodegeneration/{obj.id}/export_pdf/'
+                )
+            )
+            if obj.export_in_progress():
                 buttons.append(
-                    '<a href="{}" style="background: #417690; color: white; padding: 6px 12px; '
-                    'border-radius: 4px; text-decoration: none; display: inline-block; margin-right: 5px;">📥 .zip</a>'.format(
-                        obj.zip_file.url
+                    '<span style="background: #e2e8f0; color: #4a5568; padding: 6px 12px; border-radius: 4px; '
+                    'display: inline-block; margin-right: 5px;">⏳ .xlsx {} / {}</span>'.format(
+                        obj.export_progress, obj.quantity
+                    )
+                )
+            else:
+                buttons.append(
+                    '<a href="{}" style="background: #28a745; color: white; padding: 6px 12px; '
+                    'border-radius: 4px; text-decoration: none; display: inline-block; margin-right: 5px;">📊 .xlsx</a>'.format(
+                        f'/admin/core/qrcodegeneration/{obj.id}/export_excel/'
+                    )
+                )
+            if obj.export_status == 'completed' and obj.export_file:
+                buttons.append(
+                    '<a href="{}" style="background: #1e7e34; color: white; padding: 6px 12px; '
+                    'border-radius: 4px; text-decoration: none; display: inline-block; margin-right: 5px;">📄 готовый .xlsx</a>'.format(
+                        obj.export_file.url
                     )
                 )
             buttons.append(
-                '<a href="{}" style="background: #28a745; color: white; padding: 6px 12px; '
-                'border-radius: 4px; text-decoration: none; display: inline-block;">📊 .xlsx</a>'.format(
-                    f'/admin/core/qrcodegeneration/{obj.id}/export_excel/'
+                '<a href="{}" style="background: #20c997; color: white; padding: 6px 12px; '
+                'border-radius: 4px; text-decoration: none; display: inline-block;">🧾 .csv</a>'.format(
+                    f'/admin/core/qrcodegeneration/{obj.id}/export_csv/'
                 )
             )
             return format_html(''.join(buttons))
@@ -1899,10 +1922,10 @@ class QRCodeGenerationAdmin(NoDeleteAdminMixin, SimpleHistoryAdmin):
     
     fieldsets = (
         ('Основная информация', {
-            'fields': ('code_type', 'quantity', 'points', 'status')
+            'fields': ('code_type', 'quantity', 'points', 'status', 'generated_count')
         }),
         ('Результаты', {
-            'fields': ('zip_file', 'qr_codes', 'error_message')
+            'fields': ('zip_file', 'export_status', 'export_progress', 'export_updated_at', 'export_file', 'error_message')
         }),
         ('Системная информация', {
             'fields': ('created_by', 'created_at', 'completed_at')
@@ -1918,66 +1941,134 @@ class QRCodeGenerationAdmin(NoDeleteAdminMixin, SimpleHistoryAdmin):
         return False
 
     def get_urls(self):
-        """Добавляет кастомные URL для экспорта Excel."""
+        """Добавляет кастомные URL для экспорта ZIP, Excel, CSV и PDF-листов."""
         urls = super().get_urls()
         custom_urls = [
+            path('<path:object_id>/export_zip/', self.admin_site.admin_view(self.export_zip_view), name='core_qrcodegeneration_export_zip'),
             path('<path:object_id>/export_excel/', self.admin_site.admin_view(self.export_excel_view), name='core_qrcodegeneration_export_excel'),
+            path('<path:object_id>/export_csv/', self.admin_site.admin_view(self.export_csv_view), name='core_qrcodegeneration_export_csv'),
+            path('<path:object_id>/export_pdf/', self.admin_site.admin_view(self.export_pdf_view), name='core_qrcodegeneration_export_pdf'),
         ]
         return custom_urls + urls
     
-    def export_excel_view(self, request, object_id):
-        """Экспорт QR-кодов в Excel формат."""
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, Alignment
-        from django.utils import timezone
+    def export_zip_view(self, request, object_id):
+        """
+        ZIP с изображениями карточек генерации. Архив собирается на лету: коды читаются
+        из БД частями, файлы пишутся в ответ по мере чтения.
+        """
+        from django.http import Http404, StreamingHttpResponse
+        from .zip_stream import stream_zip
         
         try:
             generation = QRCodeGeneration.objects.get(id=object_id)
         except QRCodeGeneration.DoesNotExist:
-            from django.http import Http404
             raise Http404("Генерация не найдена")
         
-        # Получаем все QR-коды для этой генерации
-        qr_codes = generation.qr_codes.all().order_by('generated_at')
-        
-        # Создаем Excel файл
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "QR Codes"
+        image_paths = (
+            generation.qr_codes.exclude(image_path__isnull=True).exclude(image_path='')
+            .order_by('serial_number').values_list('image_path', flat=True)
+        )
+        response = StreamingHttpResponse(
+            stream_zip(image_paths.iterator(chunk_size=2000)),
+            content_type='application/zip',
+        )
+        response['Content-Disposition'] = f'attachment; filename="qrcodes_{generation.id}.zip"'
+        return response
+    
+    def export_pdf_view(self, request, object_id):
+        """
+        PDF для типографии: карточки генерации на листах с метками реза.
+        Файл отдается потоком по мере генерации страниц.
+        """
+        from django.http import Http404, StreamingHttpResponse
+        from .card_sheets import stream_sheets
+        from .utils import iter_generation_cards
         
-        # Заголовки
-        headers = ['Дата создания QR кода', 'Серийный номер', 'Сканирован ли', 'Промо код']
-        ws.append(headers)
+        try:
+            generation = QRCodeGeneration.objects.get(id=object_id)
+        except QRCodeGeneration.DoesNotExist:
+            raise Http404("Генерация не найдена")
         
-        # Стили для заголовков
-        header_font = Font(bold=True)
-        header_alignment = Alignment(horizontal='center', vertical='center')
-        for cell in ws[1]:
-            cell.font = header_font
-            cell.alignment = header_alignment
+        response = StreamingHttpResponse(
+            stream_sheets(
+                iter_generation_cards(generation),
+                page_size=settings.QR_CODE_PDF_PAGE_SIZE,
+                card_width_mm=settings.QR_CODE_PDF_CARD_WIDTH_MM,
+            ),
+            content_type='application/pdf',
+        )
+        response['Content-Disposition'] = f'attachment; filename="qrcodes_{generation.id}_sheets.pdf"'
+        return response
+    
+    def export_excel_view(self, request, object_id):
+        """
+        Экспорт QR-кодов в Excel формат (openpyxl write-only, память не зависит от количества).
+        Генерации больше QR_CODE_EXPORT_SYNC_LIMIT кодов выгружаются Celery-задачей:
+        прогресс и готовый файл — в списке генераций.
+        """
+        from django.db.models import Q
+        from django.http import FileResponse, Http404
+        from django.utils import timezone
+        import tempfile
+        from .code_export import write_excel
+        from core.tasks import export_generation_excel_task
         
-        # Данные
-        for qr_code in qr_codes:
-            generated_at = qr_code.generated_at.strftime('%d.%m.%Y %H:%M:%S') if qr_code.generated_at else ''
-            serial_number = qr_code.serial_number
-            is_scanned = 'Да' if qr_code.is_scanned else 'Нет'
-            promo_code = qr_code.code
-            ws.append([generated_at, serial_number, is_scanned, promo_code])
+        try:
+            generation = QRCodeGeneration.objects.get(id=object_id)
+        except QRCodeGeneration.DoesNotExist:
+            raise Http404("Генерация не найдена")
         
-        # Автоподбор ширины колонок
-        from openpyxl.utils import get_column_letter
-        column_widths = [25, 20, 15, 20]
-        for idx, width in enumerate(column_widths, 1):
-            ws.column_dimensions[get_column_letter(idx)].width = width
+        if generation.quantity > settings.QR_CODE_EXPORT_SYNC_LIMIT:
+            # Запускаем выгрузку, если она еще не идет (условный UPDATE — без двойного запуска);
+            # выгрузка без обновлений дольше QR_CODE_EXPORT_STALE_SECONDS считается прерванной
+            not_running = (
+                ~Q(export_status__in=['pending', 'processing'])
+                | Q(export_updated_at__isnull=True)
+                | Q(export_updated_at__lt=QRCodeGeneration.export_stale_before())
+            )
+            started = QRCodeGeneration.objects.filter(not_running, id=generation.id).update(
+                export_status='pending', export_progress=0, export_updated_at=timezone.now()
+            )
+            if started:
+                export_generation_excel_task.delay(generation.id)
+                self.message_user(
+                    request,
+                    f'Выгрузка генерации #{generation.id} в Excel запущена. '
+                    f'Прогресс и ссылка на файл — в списке генераций.',
+                    messages.SUCCESS
+                )
+            else:
+                self.message_user(
+                    request,
+                    f'Выгрузка генерации #{generation.id} уже выполняется.',
+                    messages.INFO
+                )
+            return redirect('admin:core_qrcodegeneration_changelist')
         
-        # Создаем HttpResponse с Excel файлом
+        # Небольшая генерация — сразу в ответе (через временный файл)
+        excel_file = tempfile.TemporaryFile()
+        write_excel(generation, excel_file)
+        excel_file.seek(0)
         filename = f"qrcodes_{generation.id}_{timezone.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        response = HttpResponse(
+        return FileResponse(
+            excel_file,
+            as_attachment=True,
+            filename=filename,
             content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
         )
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    
+    def export_csv_view(self, request, object_id):
+        """Экспорт QR-кодов в CSV потоком (любой размер генерации, без фоновой задачи)."""
+        from django.http import Http404, StreamingHttpResponse
+        from .code_export import stream_csv
+        
+        try:
+            generation = QRCodeGeneration.objects.get(id=object_id)
+        except QRCodeGeneration.DoesNotExist:
+            raise Http404("Генерация не найдена")
         
-        wb.save(response)
+        response = StreamingHttpResponse(stream_csv(generation), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="qrcodes_{generation.id}.csv"'
         return response
 
 
@@ -0,0 +1,167 @@
+"""
+Растровая отрисовка карточек промокодов (Pillow) для печати.
+
+Карточка повторяет прежний HTML-макет (1000×600, рамка, серийный номер, код, инструкция),
+но рисуется напрямую, без браузера. Размеры макета умножаются на QR_CODE_IMAGE_SCALE
+(3 → 3000×1800, 300 dpi). Шрифты и растры глифов кэшируются в процессе, карточка —
+чёрно-белый PNG.
+
+render_cards() распределяет карточки по процессам (ProcessPoolExecutor, QR_CODE_RENDER_WORKERS) —
+для команд управления и бенчмарков. Задачи Celery рисуют в своем процессе (workers=1):
+параллельность дает число воркеров, без пула процессов внутри каждого воркера.
+Рабочие процессы не обращаются к Django: получают готовые тексты, пути и параметры.
+"""
+import multiprocessing
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+
+from PIL import Image, ImageDraw, ImageFont
+
+# Базовый макет, пиксели при scale=1
+CARD_WIDTH = 1000
+CARD_HEIGHT = 600
+BORDER = 4
+PADDING = 40
+GAP = 40
+SERIAL_SIZE = 28
+CODE_SIZE = 150
+CODE_LETTER_SPACING = 8
+INSTRUCTION_SIZE = 20
+BASE_DPI = 100
+
+# Меньше — рисуем в текущем процессе (запуск пула дороже отрисовки)
+MIN_PARALLEL = 32
+
+FONT_CANDIDATES = [
+    '/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    'Arial.ttf',
+]
+BOLD_FONT_CANDIDATES = [
+    '/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf',
+    'Arial Bold.ttf',
+]
+
+
+@lru_cache(maxsize=None)
+def _font(path, size, bold=False):
+    """Шрифт нужного размера (кэш на процесс): path из настроек или первый найденный."""
+    for candidate in ([path] if path else []) + (BOLD_FONT_CANDIDATES if bold else FONT_CANDIDATES):
+        try:
+            return ImageFont.truetype(candidate, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size)
+
+
+@lru_cache(maxsize=1024)
+def _text_mask(path, size, bold, text):
+    """
+    Растр текста (кэш на процесс): маска '1', сдвиг по x и ширина.
+
+    Символы кода и серийного номера повторяются на всех карточках, инструкция одна на все,
+    поэтому каждый глиф растеризуется один раз, а на карточку только вставляется.
+    """
+    font = _font(path, size, bold)
+    left, top, right, bottom = font.getbbox(text, anchor='la')
+    offset = min(left, 0)  # глиф может выступать левее точки начала
+    mask = Image.new('1', (max(right - offset, 1), max(bottom, 1)), 0)
+    ImageDraw.Draw(mask).text((-offset, 0), text, font=font, fill=1, anchor='la')
+    return mask, offset, font.getlength(text)
+
+
+def _text_width(path, size, bold, chars, spacing=0):
+    return sum(_text_mask(path, size, bold, char)[2] for char in chars) + spacing * (len(chars) - 1)
+
+
+def _paste_chars(image, x, y, path, size, bold, chars, spacing=0):
+    for char in chars:
+        mask, offset, advance = _text_mask(path, size, bold, char)
+        image.paste(0, (int(x) + offset, y), mask)
+        x += advance + spacing
+
+
+@lru_cache(maxsize=8)
+def _blank_card(scale):
+    """Пустая карточка с рамкой (копируется для каждой карточки)."""
+    width, height = CARD_WIDTH * scale, CARD_HEIGHT * scale
+    image = Image.new('1', (width, height), 1)
+    ImageDraw.Draw(image).rectangle((0, 0, width - 1, height - 1), outline=0, width=BORDER * scale)
+    return image
+
+
+def _style():
+    from django.conf import settings
+    return {
+        'scale': settings.QR_CODE_IMAGE_SCALE,
+        'font_path': settings.QR_CODE_FONT_PATH,
+        'bold_font_path': settings.QR_CODE_FONT_BOLD_PATH,
+    }
+
+
+def render_card(path, code_text, serial_text, instruction_text, scale=1, font_path='', bold_font_path=''):
+    """Рисует одну карточку и сохраняет PNG в path."""
+    image = _blank_card(scale).copy()
+    width, height = image.size
+
+    # Код крупно с разрядкой; длинный код уменьшаем, чтобы поместился в ширину карточки
+    spacing = CODE_LETTER_SPACING * scale
+    available = width - 2 * (BORDER + PADDING) * scale
+    code_size = CODE_SIZE * scale
+    code_width = _text_width(bold_font_path, code_size, True, code_text, spacing)
+    if code_width > available:
+        code_size = int(code_size * available / code_width)
+        spacing = spacing * code_size // (CODE_SIZE * scale)
+        code_width = _text_width(bold_font_path, code_size, True, code_text, spacing)
+
+    # Блоки по вертикали по центру, как flex-колонка в прежнем HTML
+    gap = GAP * scale
+    serial_size = SERIAL_SIZE * scale
+    instruction_size = INSTRUCTION_SIZE * scale
+    top = (height - (serial_size + gap + code_size + gap + instruction_size)) // 2
+    center = width // 2
+
+    serial_width = _text_width(font_path, serial_size, False, serial_text)
+    _paste_chars(image, center - serial_width / 2, top, font_path, serial_size, False, serial_text)
+    top += serial_size + gap
+    _paste_chars(image, center - code_width / 2, top, bold_font_path, code_size, True, code_text, spacing)
+    top += code_size + gap
+    mask, offset, instruction_width = _text_mask(font_path, instruction_size, False, instruction_text)
+    image.paste(0, (int(center - instruction_width / 2) + offset, top), mask)
+
+    # Чёрно-белый PNG (1 бит): кодируется в разы быстрее серого, для печати текста достаточно
+    dpi = BASE_DPI * scale
+    image.save(path, 'PNG', compress_level=1, compress_type=zlib.Z_RLE, dpi=(dpi, dpi))
+    return path
+
+
+def _render_job(style, job):
+    path, code_text, serial_text, instruction_text = job
+    return render_card(path, code_text, serial_text, instruction_text, **style)
+
+
+def render_cards(jobs, workers=None):
+    """
+    Рисует карточки параллельно.
+
+    Args:
+        jobs: список кортежей (path, code_text, serial_text, instruction_text)
+        workers: количество процессов (по умолчанию QR_CODE_RENDER_WORKERS или число ядер)
+
+    Returns:
+        list: пути к сохраненным изображениям (в порядке jobs)
+    """
+    from django.conf import settings
+
+    jobs = list(jobs)
+    render = partial(_render_job, _style())
+    workers = workers or settings.QR_CODE_RENDER_WORKERS or os.cpu_count() or 1
+    workers = min(workers, len(jobs))
+    # Демон-процессы (например, multiprocessing-пулы) не могут запускать дочерние
+    if workers <= 1 or len(jobs) < MIN_PARALLEL or multiprocessing.current_process().daemon:
+        return [render(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(render, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
@@ -0,0 +1,235 @@
+"""
+PDF для типографии: карточки промокодов на листах с метками реза (векторный PDF).
+
+Макет карточки — тот же, что у растровой карточки (core/card_renderer.py, прежний HTML):
+рамка, серийный номер, код крупно с разрядкой, инструкция; шрифты Helvetica / Helvetica-Bold
+(стандартные шрифты PDF, метрики совпадают с Arial из HTML). Карточки шириной
+QR_CODE_PDF_CARD_WIDTH_MM (высота — 0.6 ширины) раскладываются сеткой на листе
+QR_CODE_PDF_PAGE_SIZE, метки реза — по линиям сетки за её пределами.
+
+PDF пишется потоком: каждая страница выводится сразу, в памяти остаются только смещения
+объектов и номера страниц (несколько байт на страницу), поэтому память почти не растет
+с количеством карточек.
+"""
+import zlib
+from array import array
+
+from . import card_renderer as layout
+
+MM = 72 / 25.4
+PAGE_SIZES = {
+    'A4': (210, 297),
+    'A3': (297, 420),
+    'SRA3': (320, 450),
+}
+PAGE_MARGIN_MM = 5  # непечатаемое поле принтера
+CUT_MARK_MM = 4
+CUT_MARK_OFFSET_MM = 2
+ASCENT = 0.718  # высота прописных Helvetica (доля кегля)
+
+# Ширины символов Helvetica и Helvetica-Bold (AFM, 1/1000 кегля), ASCII 32–126
+_HELVETICA_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+_HELVETICA_BOLD_WIDTHS = [
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+    975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+    333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+]
+
+
+def _text_width(text, size, bold=False):
+    widths = _HELVETICA_BOLD_WIDTHS if bold else _HELVETICA_WIDTHS
+    return sum(widths[ord(c) - 32] if 32 <= ord(c) < 127 else 556 for c in text) * size / 1000
+
+
+def _pdf_string(text):
+    data = text.encode('cp1252', errors='replace')
+    return b'(' + data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+def _num(value):
+    return f'{value:.2f}'.rstrip('0').rstrip('.')
+
+
+class SheetLayout:
+    """Геометрия листа: размер страницы, карточки и позиции карточек на листе (в пунктах)."""
+
+    def __init__(self, page_size='A4', card_width_mm=90):
+        page_width_mm, page_height_mm = PAGE_SIZES[page_size]
+        self.page_width = page_width_mm * MM
+        self.page_height = page_height_mm * MM
+        self.card_width = card_width_mm * MM
+        self.card_height = self.card_width * layout.CARD_HEIGHT / layout.CARD_WIDTH
+        self.scale = self.card_width / layout.CARD_WIDTH  # пунктов на пиксель макета
+
+        margin = (PAGE_MARGIN_MM + CUT_MARK_OFFSET_MM + CUT_MARK_MM) * MM
+        self.columns = int((self.page_width - 2 * margin) // self.card_width)
+        self.rows = int((self.page_height - 2 * margin) // self.card_height)
+        if not self.columns or not self.rows:
+            raise ValueError(f"Карточка {card_width_mm} мм не помещается на лист {page_size}")
+        self.left = (self.page_width - self.columns * self.card_width) / 2
+        self.bottom = (self.page_height - self.rows * self.card_height) / 2
+
+    @property
+    def per_page(self):
+        return self.columns * self.rows
+
+    def card_origin(self, index):
+        """Левый нижний угол карточки index на листе (слева направо, сверху вниз)."""
+        row, column = divmod(index, self.columns)
+        return (
+            self.left + column * self.card_width,
+            self.bottom + (self.rows - 1 - row) * self.card_height,
+        )
+
+
+def _cut_marks(sheet):
+    """Метки реза: продолжения линий сетки за её пределами."""
+    offset, length = CUT_MARK_OFFSET_MM * MM, CUT_MARK_MM * MM
+    right = sheet.left + sheet.columns * sheet.card_width
+    top = sheet.bottom + sheet.rows * sheet.card_height
+    ops = ['0.25 w 0 G']  # тонкие черные линии
+    for column in range(sheet.columns + 1):
+        x = _num(sheet.left + column * sheet.card_width)
+        ops.append(f'{x} {_num(top + offset)} m {x} {_num(top + offset + length)} l S')
+        ops.append(f'{x} {_num(sheet.bottom - offset)} m {x} {_num(sheet.bottom - offset - length)} l S')
+    for row in range(sheet.rows + 1):
+        y = _num(sheet.bottom + row * sheet.card_height)
+        ops.append(f'{_num(sheet.left - offset)} {y} m {_num(sheet.left - offset - length)} {y} l S')
+        ops.append(f'{_num(right + offset)} {y} m {_num(right + offset + length)} {y} l S')
+    return '\n'.join(ops).encode()
+
+
+def _card_ops(sheet, x0, y0, code_text, serial_text, instruction_text):
+    """Операторы страницы для одной карточки (геометрия — как в render_card)."""
+    s = sheet.scale
+    border = layout.BORDER * s
+    ops = [
+        f'{_num(border)} w {_num(x0 + border / 2)} {_num(y0 + border / 2)} '
+        f'{_num(sheet.card_width - border)} {_num(sheet.card_height - border)} re S'.encode()
+    ]
+
+    spacing = layout.CODE_LETTER_SPACING * s
+    available = sheet.card_width - 2 * (layout.BORDER + layout.PADDING) * s
+    code_size = layout.CODE_SIZE * s
+    code_width = _text_width(code_text, code_size, bold=True) + spacing * (len(code_text) - 1)
+    if code_width > available:
+        ratio = available / code_width
+        code_size, spacing, code_width = code_size * ratio, spacing * ratio, available
+
+    # Блоки по вертикали по центру карточки
+    gap = layout.GAP * s
+    serial_size = layout.SERIAL_SIZE * s
+    instruction_size = layout.INSTRUCTION_SIZE * s
+    top = y0 + (sheet.card_height + serial_size + gap + code_size + gap + instruction_size) / 2
+    center = x0 + sheet.card_width / 2
+
+    lines = (
+        ('/F1', serial_size, 0, _text_width(serial_text, serial_size), serial_text, gap),
+        ('/F2', code_size, spacing, code_width, code_text, gap),
+        ('/F1', instruction_size, 0, _text_width(instruction_text, instruction_size), instruction_text, 0),
+    )
+    for font, size, char_spacing, width, text, after in lines:
+        position = f'BT {font} {_num(size)} Tf {_num(char_spacing)} Tc ' \
+                   f'{_num(center - width / 2)} {_num(top - size * ASCENT)} Td '
+        ops.append(position.encode() + _pdf_string(text) + b' Tj ET')
+        top -= size + after
+    return b'\n'.join(ops)
+
+
+class _Writer:
+    """Последовательная запись объектов PDF с учетом смещений для xref."""
+
+    def __init__(self):
+        self.position = 0
+        self.offsets = array('Q', [0])  # смещение объекта по его номеру (8 байт на объект)
+        self.next_id = 1
+
+    def reserve(self):
+        object_id = self.next_id
+        self.next_id += 1
+        self.offsets.append(0)
+        return object_id
+
+    def raw(self, data):
+        self.position += len(data)
+        return data
+
+    def obj(self, object_id, body):
+        self.offsets[object_id] = self.position
+        return self.raw(b'%d 0 obj\n' % object_id + body + b'\nendobj\n')
+
+    def stream(self, object_id, data):
+        data = zlib.compress(data)
+        return self.obj(
+            object_id,
+            b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(data) + data + b'\nendstream',
+        )
+
+
+def stream_sheets(cards, page_size='A4', card_width_mm=90):
+    """
+    Генерирует PDF по частям (по странице).
+
+    Args:
+        cards: итератор кортежей (code_text, serial_text, instruction_text)
+        page_size: формат листа (ключ PAGE_SIZES)
+        card_width_mm: ширина карточки, мм
+
+    Yields:
+        bytes: очередной фрагмент файла
+    """
+    sheet = SheetLayout(page_size, card_width_mm)
+    writer = _Writer()
+    catalog_id, pages_id, resources_id = writer.reserve(), writer.reserve(), writer.reserve()
+    page_ids = array('L')
+
+    yield writer.raw(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    yield writer.obj(resources_id, (
+        b'<< /Font << '
+        b'/F1 << /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >> '
+        b'/F2 << /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >> '
+        b'>> >>'
+    ))
+    marks = _cut_marks(sheet)
+    media_box = f'[0 0 {_num(sheet.page_width)} {_num(sheet.page_height)}]'.encode()
+
+    def page(contents):
+        content_id, page_id = writer.reserve(), writer.reserve()
+        page_ids.append(page_id)
+        return writer.stream(content_id, b'\n'.join([b'0 g', marks] + contents)) + writer.obj(
+            page_id,
+            b'<< /Type /Page /Parent %d 0 R /MediaBox %s /Resources %d 0 R /Contents %d 0 R >>'
+            % (pages_id, media_box, resources_id, content_id),
+        )
+
+    contents = []
+    for card in cards:
+        contents.append(_card_ops(sheet, *sheet.card_origin(len(contents)), *card))
+        if len(contents) == sheet.per_page:
+            yield page(contents)
+            contents = []
+    if contents or not page_ids:
+        yield page(contents)
+
+    kids = b' '.join(b'%d 0 R' % page_id for page_id in page_ids)
+    yield writer.obj(pages_id, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(page_ids)))
+    yield writer.obj(catalog_id, b'<< /Type /Catalog /Pages %d 0 R >>' % pages_id)
+
+    xref_position = writer.position
+    yield b'xref\n0 %d\n0000000000 65535 f \n' % writer.next_id
+    for start in range(1, writer.next_id, 1000):
+        end = min(start + 1000, writer.next_id)
+        yield b''.join(b'%010d 00000 n \n' % writer.offsets[i] for i in range(start, end))
+    yield b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (
+        writer.next_id, catalog_id, xref_position
+    )
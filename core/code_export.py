@@ -0,0 +1,98 @@
+"""
+Выгрузка кодов генерации в Excel и CSV с постоянным расходом памяти.
+
+Коды читаются пачками по ключу (id > последний, ORDER BY id LIMIT CHUNK_SIZE) — без OFFSET
+и без загрузки всей генерации. Excel пишется в режиме write-only openpyxl (строки сразу
+сбрасываются во временный файл), CSV отдается потоком.
+
+Небольшие генерации (до QR_CODE_EXPORT_SYNC_LIMIT кодов) выгружаются прямо в запросе,
+большие — Celery-задачей export_generation_excel_task в файл QRCodeGeneration.export_file.
+"""
+import csv
+
+CHUNK_SIZE = 5000
+HEADERS = ['Дата создания QR кода', 'Серийный номер', 'Сканирован ли', 'Промо код']
+COLUMN_WIDTHS = [25, 20, 15, 20]
+
+
+def iter_rows(generation, chunk_size=CHUNK_SIZE):
+    """Строки выгрузки по порядку создания кодов (keyset-пагинация по id)."""
+    codes = generation.qr_codes.order_by('id').values_list(
+        'id', 'generated_at', 'serial_number', 'is_scanned', 'code'
+    )
+    last_id = 0
+    while True:
+        chunk = list(codes.filter(id__gt=last_id)[:chunk_size])
+        for _, generated_at, serial_number, is_scanned, code in chunk:
+            yield [
+                generated_at.strftime('%d.%m.%Y %H:%M:%S') if generated_at else '',
+                serial_number,
+                'Да' if is_scanned else 'Нет',
+                code,
+            ]
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1][0]
+
+
+def write_excel(generation, fileobj, progress=None, progress_every=CHUNK_SIZE):
+    """
+    Пишет выгрузку в Excel (openpyxl write-only).
+
+    Args:
+        generation: QRCodeGeneration
+        fileobj: файл или путь для сохранения .xlsx
+        progress: функция progress(rows) — вызывается каждые progress_every строк
+
+    Returns:
+        int: количество строк с кодами
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Font
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("QR Codes")
+    for idx, width in enumerate(COLUMN_WIDTHS, 1):
+        ws.column_dimensions[get_column_letter(idx)].width = width
+
+    header_font = Font(bold=True)
+    header_alignment = Alignment(horizontal='center', vertical='center')
+    header = []
+    for title in HEADERS:
+        cell = WriteOnlyCell(ws, value=title)
+        cell.font = header_font
+        cell.alignment = header_alignment
+        header.append(cell)
+    ws.append(header)
+
+    rows = 0
+    for row in iter_rows(generation):
+        ws.append(row)
+        rows += 1
+        if progress and rows % progress_every == 0:
+            progress(rows)
+    wb.save(fileobj)
+    if progress:
+        progress(rows)
+    return rows
+
+
+class _Echo:
+    """Файл для csv.writer: write() возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(generation, rows_per_chunk=1000):
+    """CSV выгрузка частями (UTF-8 с BOM, разделитель «;» — открывается в Excel)."""
+    writer = csv.writer(_Echo(), delimiter=';')
+    chunk = ['\ufeff' + writer.writerow(HEADERS)]
+    for row in iter_rows(generation):
+        chunk.append(writer.writerow(row))
+        if len(chunk) >= rows_per_chunk:
+            yield ''.join(chunk)
+            chunk = []
+    yield ''.join(chunk)
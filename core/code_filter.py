@@ -0,0 +1,188 @@
+"""
+Фильтр Блума по выданным промокодам (Redis).
+
+Неверный промокод отсекается до обращения к PostgreSQL: если фильтр говорит «такого кода
+нет», это гарантированно так. Ложноположительные ответы (код не выдавался, но фильтр
+говорит «возможно есть») просто приводят к обычному запросу в БД.
+
+Фильтр — битовая строка в Redis (SETBIT/GETBIT, без модулей Redis), общая для бота,
+webapp и Celery. В него попадают code и hash_code каждого QR-кода. Новые коды
+добавляются после коммита транзакции, создавшей QRCode; полная пересборка —
+python manage.py rebuild_code_filter. Пока фильтр не собран или Redis недоступен,
+проверка пропускает все коды (fail-open).
+"""
+import hashlib
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+FILTER_KEY = 'qr_code_filter'
+READY_KEY = 'qr_code_filter:ready'
+BUILDING_KEY = f'{FILTER_KEY}:building'
+# Признак идущей пересборки: новые коды пишутся и в рабочий, и в собираемый фильтр
+REBUILDING_KEY = f'{FILTER_KEY}:rebuilding'
+REBUILDING_TTL = 600
+# После подмены фильтра коды, созданные незадолго до начала пересборки, добавляются повторно
+REBUILD_MARGIN = timedelta(minutes=30)
+ADD_CHUNK_SIZE = 1000
+
+# Биты нового кода ставятся в рабочем фильтре и, во время пересборки, в собираемом — одной
+# командой Redis, поэтому код не может попасть только в фильтр, который будет заменен.
+# KEYS: рабочий фильтр, собираемый фильтр, признак пересборки; ARGV: позиции битов
+_ADD_LUA = """
+local building = redis.call('EXISTS', KEYS[3]) == 1
+for _, position in ipairs(ARGV) do
+    redis.call('SETBIT', KEYS[1], position, 1)
+    if building then
+        redis.call('SETBIT', KEYS[2], position, 1)
+    end
+end
+return 1
+"""
+
+_client = None
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        import redis
+        _client = redis.Redis.from_url(
+            settings.QR_CODE_FILTER_REDIS_URL,
+            socket_connect_timeout=0.5,
+            socket_timeout=0.5,
+        )
+    return _client
+
+
+def _bit_positions(value):
+    """Позиции битов для значения (двойное хеширование: h1 + i * h2)."""
+    digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:], 'little') | 1
+    size = settings.QR_CODE_FILTER_BITS
+    return [(h1 + i * h2) % size for i in range(settings.QR_CODE_FILTER_HASHES)]
+
+
+def _normalize(value):
+    return (value or '').strip().upper()
+
+
+def is_enabled():
+    return getattr(settings, 'QR_CODE_FILTER_ENABLED', False)
+
+
+def might_exist(raw_code):
+    """
+    False — промокода с таким code/hash_code точно нет; True — возможно есть (нужен запрос в БД).
+    """
+    value = _normalize(raw_code)
+    if not value:
+        return False
+    if not is_enabled():
+        return True
+    try:
+        client = _get_client()
+        pipe = client.pipeline(transaction=False)
+        pipe.exists(READY_KEY)
+        for position in _bit_positions(value):
+            pipe.getbit(FILTER_KEY, position)
+        ready, *bits = pipe.execute()
+    except Exception as e:
+        logger.warning(f"[code_filter] Redis недоступен, проверка пропущена: {e}")
+        return True
+    if not ready:
+        return True
+    return all(bits)
+
+
+def _set_bits(client, key, values):
+    pipe = client.pipeline(transaction=False)
+    for value in values:
+        value = _normalize(value)
+        if not value:
+            continue
+        for position in _bit_positions(value):
+            pipe.setbit(key, position, 1)
+    pipe.execute()
+
+
+def add_codes(values):
+    """
+    Добавляет значения (code и/или hash_code) в фильтр после коммита текущей транзакции.
+
+    Код попадает в фильтр только когда он уже виден в БД: пересборка, прочитавшая таблицу
+    раньше, получит его через признак пересборки (_ADD_LUA), а откаченные коды в фильтр не попадут.
+    """
+    if not is_enabled():
+        return
+    values = [value for value in map(_normalize, values) if value]
+    transaction.on_commit(lambda: _add_committed(values))
+
+
+def _add_committed(values):
+    try:
+        client = _get_client()
+        script = client.register_script(_ADD_LUA)
+        for i in range(0, len(values), ADD_CHUNK_SIZE):
+            positions = [p for value in values[i:i + ADD_CHUNK_SIZE] for p in _bit_positions(value)]
+            script(keys=[FILTER_KEY, BUILDING_KEY, REBUILDING_KEY], args=positions)
+    except Exception as e:
+        # Фильтр без нового кода дал бы ложное «нет» — снимаем признак готовности до пересборки
+        logger.error(f"[code_filter] Не удалось добавить коды в фильтр, он отключён до пересборки: {e}")
+        try:
+            _get_client().delete(READY_KEY)
+        except Exception:
+            pass
+
+
+def rebuild(batch_size=10000):
+    """
+    Полностью пересобирает фильтр по таблице QRCode.
+
+    Строится во временном ключе и атомарно подменяет рабочий (RENAME), поэтому проверки
+    во время пересборки продолжают работать. Пока идет пересборка, add_codes() пишет новые коды
+    и во временный ключ, так что коды, закоммиченные после чтения таблицы, не теряются. После
+    подмены коды, созданные за REBUILD_MARGIN до начала пересборки, добавляются повторно.
+
+    Returns:
+        int: количество QR-кодов в фильтре
+    """
+    from core.models import QRCode
+
+    client = _get_client()
+    started_at = timezone.now()
+
+    def fill(queryset, key):
+        count = 0
+        batch = []
+        for code, hash_code in queryset.order_by().values_list('code', 'hash_code').iterator(chunk_size=batch_size):
+            batch.extend((code, hash_code))
+            count += 1
+            if len(batch) >= batch_size:
+                _set_bits(client, key, batch)
+                client.expire(REBUILDING_KEY, REBUILDING_TTL)
+                batch = []
+        _set_bits(client, key, batch)
+        return count
+
+    client.delete(BUILDING_KEY)
+    # Признак ставится до чтения таблицы: всё, что закоммитят позже, попадет и во временный ключ
+    client.set(REBUILDING_KEY, 1, ex=REBUILDING_TTL)
+    try:
+        count = fill(QRCode.objects.all(), BUILDING_KEY)
+        # SETRANGE создаёт ключ нужного размера даже для пустой таблицы (RENAME требует ключ)
+        client.setrange(BUILDING_KEY, settings.QR_CODE_FILTER_BITS // 8, b'\x00')
+        client.rename(BUILDING_KEY, FILTER_KEY)
+        client.set(READY_KEY, 1)
+    finally:
+        client.delete(REBUILDING_KEY)
+        client.delete(BUILDING_KEY)
+    fill(QRCode.objects.filter(generated_at__gte=started_at - REBUILD_MARGIN), FILTER_KEY)
+    logger.info(f"[code_filter] Фильтр пересобран: {count} QR-кодов")
+    return count
@@ -0,0 +1,96 @@
+"""
+Пространство хешей промокодов: заполненность по длинам и выбор длины хеша.
+
+hash_code уникален для всех типов кодов, поэтому заполненность считается по длине хеша:
+на длине L доступно 32^L значений (алфавит QRCode.HASH_ALPHABET). Длина для новых кодов —
+наименьшая (не меньше QR_CODE_HASH_MIN_LENGTH), при которой после генерации:
+- доля занятых значений не больше QR_CODE_HASH_MAX_COLLISION — случайный кандидат занят с
+  такой вероятностью, поэтому подбор хешей остаётся за константное время на код;
+- вероятность угадать существующий код одной случайной попыткой не больше
+  QR_CODE_HASH_MAX_GUESS_PROBABILITY.
+
+Заполненность считается одним запросом с группировкой и кэшируется (Django cache);
+созданные после подсчёта коды учитываются атомарными счётчиками по длинам (cache.incr),
+пересчёт — по истечении CACHE_TTL.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import Length
+
+ALPHABET_SIZE = 32
+CACHE_KEY = 'codespace:snapshot'
+# Номер подсчёта: счётчики созданных кодов относятся к подсчёту, после которого созданы коды
+EPOCH_KEY = 'codespace:epoch'
+CACHE_TTL = 600
+MAX_LENGTH = 12
+
+
+def capacity(length):
+    """Количество возможных хешей длины length."""
+    return ALPHABET_SIZE ** length
+
+
+def _created_key(epoch, length):
+    return f'codespace:created:{epoch}:{length}'
+
+
+def occupancy(refresh=False):
+    """
+    Количество кодов по длине хеша.
+
+    Returns:
+        dict: {длина: количество}
+    """
+    snapshot = None if refresh else cache.get(CACHE_KEY)
+    if snapshot is None:
+        from core.models import QRCode
+        # Номер подсчёта увеличивается до запроса: коды, закоммиченные во время подсчёта,
+        # могут учесться дважды (длина выбирается с запасом), но не теряются
+        cache.add(EPOCH_KEY, 0, None)
+        epoch = cache.incr(EPOCH_KEY)
+        counts = dict(
+            QRCode.objects.order_by().annotate(length=Length('hash_code'))
+            .values_list('length').annotate(count=Count('id'))
+        )
+        snapshot = {'epoch': epoch, 'counts': counts}
+        cache.set(CACHE_KEY, snapshot, CACHE_TTL)
+    counts = dict(snapshot['counts'])
+    created = cache.get_many([_created_key(snapshot['epoch'], length) for length in range(1, MAX_LENGTH + 1)])
+    for key, count in created.items():
+        length = int(key.rsplit(':', 1)[1])
+        counts[length] = counts.get(length, 0) + count
+    return counts
+
+
+def register_created(length, count):
+    """Учитывает созданные коды в закэшированной заполненности (после коммита транзакции)."""
+    transaction.on_commit(lambda: _increment(length, count))
+
+
+def _increment(length, count):
+    epoch = cache.get(EPOCH_KEY)
+    if epoch is None:
+        return  # подсчёта ещё не было — коды учтёт первый запрос
+    key = _created_key(epoch, length)
+    cache.add(key, 0, CACHE_TTL)
+    try:
+        cache.incr(key, count)
+    except ValueError:
+        pass  # счётчик истёк вместе с подсчётом — коды учтёт новый запрос
+
+
+def fits(length, occupied, new_count):
+    """Подходит ли длина для new_count новых кодов при occupied занятых."""
+    fill = (occupied + new_count) / capacity(length)
+    return fill <= settings.QR_CODE_HASH_MAX_COLLISION and fill <= settings.QR_CODE_HASH_MAX_GUESS_PROBABILITY
+
+
+def choose_length(new_count=1):
+    """Длина хеша для генерации new_count кодов."""
+    counts = occupancy()
+    length = settings.QR_CODE_HASH_MIN_LENGTH
+    while length < MAX_LENGTH and not fits(length, counts.get(length, 0), new_count):
+        length += 1
+    return length
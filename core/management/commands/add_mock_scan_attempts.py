@@ -3,7 +3,7 @@
 
 from django.db import transaction
 from django.utils import timezone
-from core.models import QRCode, QRCodeScanAttempt, TelegramUser
+from core.models import QRCode, PromoCodeAttempt, TelegramUser, PointsTransaction
 
 user_success, user_fail = TelegramUser.objects.order_by("id")[:2]
 qrcodes = list(QRCode.objects.all())
@@ -11,18 +11,26 @@ to_create = []
 to_update_qr = []
 now = timezone.now()
 
+points_delta = {}  # user_id -> изменение баллов (bulk_update минует QRCode.save)
+
 for qr in qrcodes:
-    to_create.append(QRCodeScanAttempt(qr_code=qr, user=user_fail, is_successful=False))
-    to_create.append(QRCodeScanAttempt(qr_code=qr, user=user_success, is_successful=False))
-    to_create.append(QRCodeScanAttempt(qr_code=qr, user=user_success, is_successful=True))
+    previous_owner, _ = qr._loaded_scan
+    if previous_owner != user_success.pk:
+        if previous_owner:
+            points_delta[previous_owner] = points_delta.get(previous_owner, 0) - qr.points
+        points_delta[user_success.pk] = points_delta.get(user_success.pk, 0) + qr.points
+    to_create.append(PromoCodeAttempt(qr_code=qr, user=user_fail, raw_code=qr.code, is_successful=False))
+    to_create.append(PromoCodeAttempt(qr_code=qr, user=user_success, raw_code=qr.code, is_successful=False))
+    to_create.append(PromoCodeAttempt(qr_code=qr, user=user_success, raw_code=qr.code, is_successful=True))
     qr.scanned_by = user_success
     qr.scanned_at = now
     qr.is_scanned = True
     to_update_qr.append(qr)
 
 with transaction.atomic():
-    QRCodeScanAttempt.objects.bulk_create(to_create)
+    PromoCodeAttempt.objects.bulk_create(to_create)
     QRCode.objects.bulk_update(to_update_qr, ["scanned_by", "scanned_at", "is_scanned"])
-    user_success.invalidate_points_cache()
+    for user_id, delta in points_delta.items():
+        PointsTransaction.record(user_id, delta, 'adjustment')
 
 print(f"Создано попыток: {len(to_create)}, обновлено QR: {len(to_update_qr)}")
@@ -0,0 +1,48 @@
+"""
+Management команда: заполнение области и района пользователей по координатам.
+
+Получатели рассылок по области выбираются в SQL по TelegramUser.region. Поле заполняет save()
+при сохранении координат, для существующих записей его пересчитала миграция 0063. Команда нужна
+для повторного заполнения: после прямых изменений координат в БД или с --all после изменения
+границ/центров областей в core/regions.py. Работает пачками по id, каждая пачка — один bulk_update.
+
+Использование:
+  python manage.py backfill_user_regions [--all] [--chunk-size 2000]
+"""
+from django.core.management.base import BaseCommand
+
+from core.models import TelegramUser
+
+
+class Command(BaseCommand):
+    help = "Заполняет TelegramUser.region и district по координатам."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Пересчитать всех пользователей с координатами")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        users = TelegramUser.objects.filter(latitude__isnull=False, longitude__isnull=False)
+        if not options["all"]:
+            users = users.filter(region__isnull=True)
+        users = users.order_by('id').only('id', 'latitude', 'longitude', 'region', 'district')
+
+        checked = changed = 0
+        last_id = 0
+        while True:
+            chunk = list(users.filter(id__gt=last_id)[:options["chunk_size"]])
+            if not chunk:
+                break
+            updated = []
+            for user in chunk:
+                before = (user.region, user.district)
+                user.update_location()
+                if (user.region, user.district) != before:
+                    updated.append(user)
+            TelegramUser.objects.bulk_update(updated, ['region', 'district'])
+            checked += len(chunk)
+            changed += len(updated)
+            last_id = chunk[-1].id
+            self.stdout.write(f"Проверено {checked}, обновлено {changed}")
+
+        self.stdout.write(self.style.SUCCESS(f"Готово: проверено {checked}, обновлено {changed}"))
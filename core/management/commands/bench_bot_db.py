@@ -0,0 +1,97 @@
+"""
+Management команда: бенчмарк пропускной способности запросов бота к БД.
+
+Имитирует N одновременных апдейтов. Каждый выполняет типичные запросы
+горячего пути бота: загрузка пользователя, баланс, подарки и ТОП лидеров.
+Сравниваются два режима:
+- sync_to_async (thread_sensitive=True) — все запросы в одном общем потоке (как было);
+- db_sync_to_async — пул потоков бота (BOT_DB_THREADS), см. bot/db.py.
+
+Для теста создаются временные пользователи (удаляются в конце).
+
+Использование:
+  python manage.py bench_bot_db [--updates 500] [--concurrency 100] [--threads 8]
+  python manage.py bench_bot_db --latency-ms 2   # добавить задержку сети к каждому запросу (для SQLite/локальной БД)
+"""
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand
+from django.db.models import Q, Sum
+from django.test.utils import override_settings
+
+from core.models import TelegramUser, QRCode, Gift
+
+# Диапазон telegram_id временных пользователей бенчмарка
+BENCH_TELEGRAM_ID_BASE = 9_000_000_000_000
+
+
+class Command(BaseCommand):
+    help = "Сравнивает пропускную способность запросов бота к БД: общий поток vs пул потоков."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--updates", type=int, default=500, help="Количество апдейтов в прогоне")
+        parser.add_argument("--concurrency", type=int, default=100, help="Одновременных апдейтов")
+        parser.add_argument("--threads", type=int, default=8, help="BOT_DB_THREADS для пула")
+        parser.add_argument("--users", type=int, default=100, help="Временных пользователей")
+        parser.add_argument(
+            "--latency-ms", type=float, default=0,
+            help="Искусственная задержка на каждый запрос, мс (имитация сетевой задержки до БД)",
+        )
+
+    def handle(self, *args, **options):
+        telegram_ids = [BENCH_TELEGRAM_ID_BASE + i for i in range(options["users"])]
+        TelegramUser.objects.bulk_create(
+            [TelegramUser(telegram_id=tid, user_type='electrician') for tid in telegram_ids],
+            ignore_conflicts=True,
+        )
+        try:
+            with override_settings(BOT_DB_THREADS=options["threads"]):
+                from bot import db as bot_db
+                bot_db._executor = None  # пул с нужным числом потоков
+                modes = [
+                    ("sync_to_async (общий поток)", sync_to_async),
+                    (f"db_sync_to_async ({options['threads']} потоков)", bot_db.db_sync_to_async),
+                ]
+                for title, wrapper in modes:
+                    elapsed = asyncio.run(self._run(wrapper, telegram_ids, options))
+                    rate = options["updates"] / elapsed if elapsed else 0
+                    self.stdout.write(f"{title:40s} {elapsed:8.2f} с  {rate:10.1f} апдейтов/с")
+        finally:
+            TelegramUser.objects.filter(telegram_id__in=telegram_ids).delete()
+
+    async def _run(self, wrapper, telegram_ids, options):
+        latency = options["latency_ms"] / 1000
+        semaphore = asyncio.Semaphore(options["concurrency"])
+
+        def query(fn):
+            def run(*args):
+                if latency:
+                    time.sleep(latency)
+                return fn(*args)
+            return wrapper(run)
+
+        get_user = query(lambda tid: TelegramUser.objects.filter(telegram_id=tid).first())
+        get_balance = query(lambda user: user.calculate_points())
+        get_gifts = query(lambda user: list(
+            Gift.objects.filter(is_active=True)
+            .filter(Q(user_type=user.user_type) | Q(user_type__isnull=True))
+            .order_by('order', 'points_cost')
+        ))
+        get_leaders = query(lambda user: list(
+            QRCode.objects.filter(is_scanned=True, scanned_by__user_type=user.user_type)
+            .values('scanned_by').annotate(total_points=Sum('points'))
+            .order_by('-total_points')[:10]
+        ))
+
+        async def one_update(i):
+            async with semaphore:
+                user = await get_user(telegram_ids[i % len(telegram_ids)])
+                await get_balance(user)
+                await get_gifts(user)
+                await get_leaders(user)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one_update(i) for i in range(options["updates"])))
+        return time.perf_counter() - start
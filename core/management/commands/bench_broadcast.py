@@ -0,0 +1,212 @@
+"""
+Management команда: бенчмарк отправки рассылки на локальном фейковом Bot API.
+
+Поднимает aiohttp-сервер, отвечающий на sendMessage с задержкой --latency, и отправляет
+--count сообщений: сначала по-старому (последовательно с паузой 1/30 с), затем через
+core/send_rate.py (--processes движков в отдельных процессах делят общий лимит в Redis,
+как воркеры Celery). Выводит скорость (по времени приема на сервере) и максимум сообщений за любое скользящее окно 1 с
+на стороне сервера — он не должен превышать TELEGRAM_BROADCAST_RATE (+ емкость корзины).
+БД не используется: отправка идет напрямую через bot.send_message.
+
+С --photo-kb рассылается фото: по-старому файл загружается каждому получателю, движок
+загружает его один раз и дальше отправляет по file_id (BroadcastPhoto). Выводится объем
+переданных данных; время загрузки на сервере зависит от --bandwidth.
+
+Использование:
+  python manage.py bench_broadcast [--count 300] [--latency 0.05] [--processes 2] [--photo-kb 500]
+"""
+import asyncio
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from bisect import bisect_right
+
+from aiohttp import web
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.send_rate import RedisTokenBucket, TokenBucket, send_concurrently
+
+TOKEN = '123456:BENCH'
+
+
+def _bot(url):
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    return Bot(token=TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(url)))
+
+
+async def _serve(latency, port=0, bandwidth_mbit=100, traffic=None):
+    """
+    Фейковый Bot API: POST /bot<token>/<method>, время приема каждого сообщения.
+
+    Загрузка запроса занимает время по --bandwidth; объем данных копится в traffic['bytes'].
+    """
+    received = []
+    traffic = traffic if traffic is not None else {}
+    traffic.setdefault('bytes', 0)
+
+    async def handle(request):
+        data = await request.post()
+        # aiogram загружает файлы chunked — размер считается по полям формы
+        size = 0
+        for value in data.values():
+            if hasattr(value, 'file'):
+                value.file.seek(0, os.SEEK_END)
+                size += value.file.tell()
+            else:
+                size += len(value)
+        traffic['bytes'] += size
+        await asyncio.sleep(latency * random.uniform(0.5, 1.5) + size * 8 / (bandwidth_mbit * 1e6))
+        received.append(time.monotonic())
+        chat_id = int(data.get('chat_id') or 0)
+        result = {
+            'message_id': len(received), 'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+        }
+        if request.match_info['method'].lower() == 'sendphoto':
+            # Загруженный файл передается как attach://<поле>, отправка по file_id — самим file_id
+            photo = data.get('photo')
+            uploaded = not isinstance(photo, str) or photo.startswith('attach://')
+            file_id = f'bench-{len(received)}' if uploaded else photo
+            result['photo'] = [{'file_id': file_id, 'file_unique_id': 'bench', 'width': 1000, 'height': 600}]
+        else:
+            result['text'] = 'ok'
+        return web.json_response({'ok': True, 'result': result})
+
+    app = web.Application()
+    app.router.add_post('/bot{token}/{method}', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://127.0.0.1:{port}', received
+
+
+def _max_per_second(times):
+    times = sorted(times)
+    return max((bisect_right(times, t + 1.0) - i for i, t in enumerate(times)), default=0)
+
+
+async def _send_engine(url, chat_ids, redis_url, concurrency, photo_path=None):
+    from core.messaging import BroadcastPhoto
+
+    bot = _bot(url)
+    photo = BroadcastPhoto(photo_path) if photo_path else None
+    if redis_url:
+        bucket = RedisTokenBucket(settings.TELEGRAM_BROADCAST_RATE, settings.TELEGRAM_BROADCAST_BURST, url=redis_url)
+    else:
+        bucket = TokenBucket(settings.TELEGRAM_BROADCAST_RATE, settings.TELEGRAM_BROADCAST_BURST)
+
+    async def send(chat_id):
+        if photo:
+            await photo.send(bot, chat_id=chat_id, caption='bench')
+        else:
+            await bot.send_message(chat_id=chat_id, text='bench')
+        return True, None
+
+    try:
+        return await send_concurrently(chat_ids, send, concurrency=concurrency, bucket=bucket)
+    finally:
+        await bucket.close()
+        await bot.session.close()
+
+
+def _engine_process(url, chat_ids, redis_url, concurrency, start_at, photo_path):
+    import django
+    django.setup()
+    time.sleep(max(0, start_at - time.time()))
+    asyncio.run(_send_engine(url, chat_ids, redis_url, concurrency, photo_path))
+
+
+class Command(BaseCommand):
+    help = "Сравнивает последовательную рассылку с параллельной под общим лимитом на фейковом Bot API."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=300, help="Сообщений")
+        parser.add_argument("--latency", type=float, default=0.05, help="Средняя задержка ответа API, с")
+        parser.add_argument("--concurrency", type=int, default=settings.TELEGRAM_BROADCAST_CONCURRENCY)
+        parser.add_argument("--processes", type=int, default=2, help="Процессов-отправителей с общим лимитом")
+        parser.add_argument("--local", action="store_true", help="Лимит в памяти процесса вместо Redis (--processes 1)")
+        parser.add_argument("--skip-sequential", action="store_true")
+        parser.add_argument("--photo-kb", type=int, default=0, help="Рассылка с фото такого размера, КБ")
+        parser.add_argument("--bandwidth", type=float, default=100, help="Скорость загрузки на API, Мбит/с")
+
+    def handle(self, *args, **options):
+        photo_path = None
+        if options["photo_kb"]:
+            fd, photo_path = tempfile.mkstemp(suffix=".jpg")
+            with os.fdopen(fd, "wb") as f:
+                f.write(os.urandom(options["photo_kb"] * 1024))
+        try:
+            asyncio.run(self._run(options, photo_path))
+        finally:
+            if photo_path:
+                os.unlink(photo_path)
+
+    async def _run(self, options, photo_path):
+        count = options["count"]
+        traffic = {}
+        runner, url, received = await _serve(options["latency"], bandwidth_mbit=options["bandwidth"], traffic=traffic)
+        try:
+            chat_ids = list(range(1, count + 1))
+            if not options["skip_sequential"]:
+                from aiogram.types import FSInputFile
+
+                bot = _bot(url)
+                try:
+                    for i, chat_id in enumerate(chat_ids):
+                        if photo_path:
+                            # Как раньше: файл загружается заново каждому получателю
+                            await bot.send_photo(chat_id=chat_id, photo=FSInputFile(photo_path), caption='bench')
+                        else:
+                            await bot.send_message(chat_id=chat_id, text='bench')
+                        if i < count - 1:
+                            await asyncio.sleep(1.0 / 30)
+                finally:
+                    await bot.session.close()
+                self._report("Последовательно (пауза 1/30 с)", received, traffic)
+                received.clear()
+                traffic['bytes'] = 0
+
+            redis_url = None if options["local"] else settings.TELEGRAM_RATE_LIMIT_REDIS_URL
+            processes = 1 if options["local"] else options["processes"]
+            if processes == 1:
+                await _send_engine(url, chat_ids, redis_url, options["concurrency"], photo_path)
+            else:
+                # Движки в отдельных процессах, как воркеры Celery с батчами одной рассылки
+                start_at = time.time() + 1.0
+                context = multiprocessing.get_context("spawn")
+                workers = [
+                    context.Process(
+                        target=_engine_process,
+                        args=(url, chat_ids[i::processes], redis_url, options["concurrency"], start_at, photo_path),
+                    )
+                    for i in range(processes)
+                ]
+                for worker in workers:
+                    worker.start()
+                await asyncio.get_running_loop().run_in_executor(None, lambda: [w.join() for w in workers])
+            label = "В памяти процесса" if options["local"] else f"Лимит в Redis, процессов: {processes}"
+            self._report(f"{label}, одновременно {options['concurrency']}", received, traffic)
+        finally:
+            await runner.cleanup()
+        self.stdout.write(
+            f"Лимит: {settings.TELEGRAM_BROADCAST_RATE:g} сообщений/с, "
+            f"емкость корзины {settings.TELEGRAM_BROADCAST_BURST:g}"
+        )
+
+    def _report(self, label, received, traffic):
+        # Скорость — по времени приема на сервере (без запуска процессов и сессии бота)
+        elapsed = max(received) - min(received) if len(received) > 1 else 0
+        rate = (len(received) - 1) / elapsed if elapsed else 0
+        self.stdout.write(
+            f"{label}: {len(received)} сообщений за {elapsed:.2f} с ({rate:.1f} сообщений/с), "
+            f"максимум за 1 с: {_max_per_second(received)}, "
+            f"передано {traffic['bytes'] / 1024 / 1024:.2f} МБ"
+        )
@@ -0,0 +1,56 @@
+"""
+Management команда: бенчмарк отрисовки карточек промокодов (core/card_renderer.py).
+
+Рисует --count карточек со случайными кодами во временную директорию: в одном процессе
+и пулом процессов. База данных не используется. Выводит скорость (карточек в секунду).
+
+Использование:
+  python manage.py bench_card_render [--count 2000] [--workers 0] [--scale 3]
+"""
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from core.card_renderer import render_cards
+from core.models import QRCode
+
+
+class Command(BaseCommand):
+    help = "Измеряет скорость отрисовки карточек промокодов: один процесс vs пул процессов."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=2000, help="Карточек для пула процессов")
+        parser.add_argument("--single", type=int, default=200, help="Карточек в одном процессе (0 — пропустить)")
+        parser.add_argument("--workers", type=int, default=0, help="Процессов (0 — QR_CODE_RENDER_WORKERS / число ядер)")
+        parser.add_argument("--scale", type=int, default=settings.QR_CODE_IMAGE_SCALE, help="Масштаб макета")
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as tmp_dir, override_settings(QR_CODE_IMAGE_SCALE=options["scale"]):
+            def jobs(count):
+                return [
+                    (
+                        f"{tmp_dir}/{i}.png",
+                        f"E-{hash_code}",
+                        f"Seriya raqami: E-{i:08d}",
+                        "Botga o'ting va kodni kiriting",
+                    )
+                    for i, hash_code in enumerate(QRCode._random_hashes(count, 8))
+                ]
+
+            if options["single"]:
+                batch = jobs(options["single"])
+                start = time.perf_counter()
+                render_cards(batch, workers=1)
+                self._report("1 процесс", len(batch), time.perf_counter() - start)
+
+            batch = jobs(options["count"])
+            start = time.perf_counter()
+            render_cards(batch, workers=options["workers"] or None)
+            self._report("пул процессов", len(batch), time.perf_counter() - start)
+
+    def _report(self, title, count, elapsed):
+        rate = count / elapsed if elapsed else 0
+        self.stdout.write(f"{title:16s} {count:6d} карточек  {elapsed:7.2f} с  {rate:8.0f} карточек/с")
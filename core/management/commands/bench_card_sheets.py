@@ -0,0 +1,70 @@
+"""
+Management команда: бенчмарк PDF-листов для типографии (core/card_sheets.py).
+
+Генерирует PDF на --count карточек со случайными кодами (без БД) и пишет его в файл
+(по умолчанию во временный, удаляется). Выводит время, размер файла, число страниц и
+пик памяти Python при генерации (tracemalloc) — он не должен расти с --count.
+
+Использование:
+  python manage.py bench_card_sheets [--count 100000] [--output sheets.pdf]
+"""
+import os
+import tempfile
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.card_sheets import SheetLayout, stream_sheets
+from core.models import QRCode
+
+
+class Command(BaseCommand):
+    help = "Измеряет скорость и память генерации PDF-листов с карточками промокодов."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=100000, help="Карточек")
+        parser.add_argument("--output", default="", help="Сохранить PDF в файл (по умолчанию — временный)")
+        parser.add_argument("--page-size", default=settings.QR_CODE_PDF_PAGE_SIZE)
+        parser.add_argument("--card-width", type=float, default=settings.QR_CODE_PDF_CARD_WIDTH_MM, help="Ширина карточки, мм")
+        parser.add_argument("--trace", action="store_true", help="Пик памяти через tracemalloc (медленнее)")
+
+    def handle(self, *args, **options):
+        count = options["count"]
+
+        def cards():
+            # Коды генерируются на лету, как строки из БД при iterator()
+            for start in range(0, count, 1000):
+                for i, hash_code in enumerate(QRCode._random_hashes(min(1000, count - start), 8), start):
+                    yield f"E-{hash_code}", f"Seriya raqami: E-{i:08d}", "Botga o'ting @mono_bot va kodni kiriting"
+
+        output = options["output"]
+        if not output:
+            fd, output = tempfile.mkstemp(suffix=".pdf")
+            os.close(fd)
+        if options["trace"]:
+            tracemalloc.start()
+        try:
+            start = time.perf_counter()
+            with open(output, "wb") as f:
+                for chunk in stream_sheets(cards(), options["page_size"], options["card_width"]):
+                    f.write(chunk)
+            elapsed = time.perf_counter() - start
+            size = os.path.getsize(output)
+        finally:
+            peak = tracemalloc.get_traced_memory()[1] if options["trace"] else None
+            tracemalloc.stop()
+            if not options["output"]:
+                os.unlink(output)
+
+        sheet = SheetLayout(options["page_size"], options["card_width"])
+        pages = (count + sheet.per_page - 1) // sheet.per_page
+        self.stdout.write(
+            f"{count} карточек, {pages} листов {options['page_size']} по {sheet.per_page}: "
+            f"{elapsed:.2f} с ({count / elapsed:.0f} карточек/с), {size / 1024 / 1024:.1f} МБ"
+        )
+        if peak is not None:
+            self.stdout.write(f"Пик памяти Python: {peak / 1024 / 1024:.1f} МБ")
+        if options["output"]:
+            self.stdout.write(f"PDF сохранен: {output}")
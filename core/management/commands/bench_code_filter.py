@@ -0,0 +1,50 @@
+"""
+Management команда: сколько запросов к БД экономит фильтр выданных промокодов.
+
+Имитирует подбор промокодов: N случайных кодов из алфавита QRCode.generate_hash
+(4–5 символов, с префиксом E/D и без) проверяются через QRCode.find_by_code
+с выключенным и включённым фильтром. Считаются запросы к БД и время.
+
+Использование:
+  python manage.py bench_code_filter [--guesses 10000] [--no-rebuild]
+"""
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from core import code_filter
+from core.models import QRCode
+
+ALPHABET = ''.join(c for c in string.ascii_uppercase + string.digits if c not in '0O1I')
+
+
+class Command(BaseCommand):
+    help = "Сравнивает число запросов к БД при подборе промокодов без фильтра и с фильтром."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--guesses", type=int, default=10000, help="Количество случайных кодов")
+        parser.add_argument("--no-rebuild", action="store_true", help="Не пересобирать фильтр перед замером")
+
+    def handle(self, *args, **options):
+        if not options["no_rebuild"]:
+            with override_settings(QR_CODE_FILTER_ENABLED=True):
+                code_filter.rebuild()
+
+        guesses = [
+            random.choice(['', 'E', 'D']) + ''.join(random.choices(ALPHABET, k=random.choice([4, 5])))
+            for _ in range(options["guesses"])
+        ]
+
+        for title, enabled in (("без фильтра", False), ("с фильтром", True)):
+            with override_settings(QR_CODE_FILTER_ENABLED=enabled), CaptureQueriesContext(connection) as ctx:
+                start = time.perf_counter()
+                found = sum(1 for guess in guesses if QRCode.find_by_code(guess) is not None)
+                elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"{title:12s} запросов к БД: {len(ctx.captured_queries):7d}  "
+                f"найдено: {found:5d}  время: {elapsed:6.2f} с"
+            )
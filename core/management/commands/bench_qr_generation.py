@@ -0,0 +1,74 @@
+"""
+Management команда: бенчмарк генерации QR-кодов.
+
+Сравнивает:
+- QRCode.create_code — по одному коду (запросы exists() и INSERT на каждый код, как было);
+- QRCode.bulk_create_codes — пачками (проверка хешей набором, диапазон серийных номеров,
+  bulk_create).
+
+Выводит скорость (кодов в минуту), число запросов к БД на код и сколько новых
+совпадений hash_code с полным кодом другого QR-кода появилось (должно быть 0). Созданные коды удаляются
+в конце (с --keep остаются).
+
+Использование:
+  python manage.py bench_qr_generation [--count 100000] [--batch-size 1000] [--single 500]
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from core.models import QRCode
+
+
+class Command(BaseCommand):
+    help = "Сравнивает скорость генерации QR-кодов: по одному vs пачками."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=100000, help="Кодов для пакетной генерации")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Размер пачки (как QR_CODE_BATCH_SIZE)")
+        parser.add_argument("--single", type=int, default=500, help="Кодов для генерации по одному (0 — пропустить)")
+        parser.add_argument("--code-type", default="electrician", choices=["electrician", "seller"])
+        parser.add_argument("--keep", action="store_true", help="Не удалять созданные коды")
+
+    def handle(self, *args, **options):
+        created_ids = []
+        ambiguous_before = QRCode.ambiguous_codes().count()
+        try:
+            if options["single"]:
+                with CaptureQueriesContext(connection) as ctx:
+                    start = time.perf_counter()
+                    for _ in range(options["single"]):
+                        created_ids.append(QRCode.create_code(options["code_type"]).pk)
+                    elapsed = time.perf_counter() - start
+                self._report("create_code (по одному)", options["single"], elapsed, len(ctx.captured_queries))
+
+            count = options["count"]
+            with CaptureQueriesContext(connection) as ctx:
+                start = time.perf_counter()
+                done = 0
+                while done < count:
+                    batch = QRCode.bulk_create_codes(options["code_type"], min(options["batch_size"], count - done))
+                    created_ids.extend(qr.pk for qr in batch)
+                    done += len(batch)
+                elapsed = time.perf_counter() - start
+            self._report(f"bulk_create_codes (по {options['batch_size']})", count, elapsed, len(ctx.captured_queries))
+
+            unique = QRCode.objects.filter(pk__in=created_ids[-count:]).values('hash_code').distinct().count()
+            self.stdout.write(f"Уникальных хешей в пакетной генерации: {unique} из {count}")
+            ambiguous = QRCode.ambiguous_codes().count() - ambiguous_before
+            self.stdout.write(f"Новых совпадений hash_code с полным кодом другого QR-кода: {ambiguous}")
+        finally:
+            if not options["keep"]:
+                for i in range(0, len(created_ids), 5000):
+                    chunk = created_ids[i:i + 5000]
+                    QRCode.history.filter(id__in=chunk).delete()
+                    QRCode.objects.filter(pk__in=chunk).delete()
+
+    def _report(self, title, count, elapsed, queries):
+        rate = count / elapsed * 60 if elapsed else 0
+        self.stdout.write(
+            f"{title:32s} {count:7d} кодов  {elapsed:7.2f} с  {rate:10.0f} кодов/мин  "
+            f"{queries / count:6.2f} запросов/код"
+        )
@@ -0,0 +1,99 @@
+"""
+Management команда: бенчмарк поиска промокода без учёта регистра.
+
+Сравнивает старый поиск (code__iexact, затем hash_code__iexact — UPPER(col) без индекса)
+с QRCode.find_by_code (один запрос по уникальным индексам code и hash_code).
+
+Временные строки QRCode создаются внутри транзакции, которая в конце откатывается —
+данные в БД не остаются. Запускать на копии production-БД или на тестовой БД.
+
+Использование:
+  python manage.py bench_qr_lookup [--rows 3000000] [--lookups 200] [--explain]
+"""
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from core.models import QRCode
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Сравнивает поиск промокода через iexact и через QRCode.find_by_code."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=3_000_000, help="Временных строк QRCode")
+        parser.add_argument("--lookups", type=int, default=200, help="Поисков на каждый вариант")
+        parser.add_argument("--batch-size", type=int, default=10_000)
+        parser.add_argument("--explain", action="store_true", help="Показать планы запросов")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._bench(options)
+                raise _Rollback
+        except _Rollback:
+            self.stdout.write("Временные строки удалены (откат транзакции)")
+
+    def _bench(self, options):
+        rows = options["rows"]
+        batch_size = options["batch_size"]
+
+        start = time.perf_counter()
+        for offset in range(0, rows, batch_size):
+            QRCode.objects.bulk_create([
+                QRCode(
+                    code=f"EBENCH{i:09d}",
+                    hash_code=f"BENCH{i:09d}",
+                    serial_number=f"BENCH{i:09d}",
+                    code_type='electrician',
+                    points=0,
+                )
+                for i in range(offset, min(offset + batch_size, rows))
+            ])
+        self.stdout.write(f"Создано {rows} строк за {time.perf_counter() - start:.1f} с")
+
+        # Ввод пользователей: полный код и hash_code в нижнем регистре, плюс несуществующие коды
+        inputs = []
+        for _ in range(options["lookups"]):
+            i = random.randrange(rows)
+            inputs.append(random.choice([f"ebench{i:09d}", f"bench{i:09d}", f"missing{i:09d}"]))
+
+        def old_lookup(raw):
+            normalized = raw.upper().strip()
+            try:
+                return QRCode.objects.get(code__iexact=normalized)
+            except QRCode.DoesNotExist:
+                try:
+                    return QRCode.objects.get(hash_code__iexact=normalized)
+                except QRCode.DoesNotExist:
+                    return None
+
+        variants = [
+            ("iexact (code, затем hash_code)", old_lookup),
+            ("QRCode.find_by_code", QRCode.find_by_code),
+        ]
+        results = {}
+        for title, lookup in variants:
+            start = time.perf_counter()
+            results[title] = [getattr(lookup(raw), 'pk', None) for raw in inputs]
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"{title:35s} {elapsed / len(inputs) * 1000:9.2f} мс/поиск")
+
+        if len(set(map(tuple, results.values()))) != 1:
+            self.stdout.write(self.style.ERROR("Результаты поиска различаются!"))
+
+        if options["explain"]:
+            sample = inputs[0].upper()
+            self.stdout.write("\nПлан iexact:")
+            self.stdout.write(QRCode.objects.filter(code__iexact=sample).explain())
+            self.stdout.write("\nПлан find_by_code:")
+            self.stdout.write(
+                QRCode.objects.filter(Q(code=sample) | Q(hash_code=sample)).order_by()[:2].explain()
+            )
@@ -0,0 +1,99 @@
+"""
+Management команда: проверка правил блокировки за неверные промокоды (core/promo_limiter.py).
+
+Прогоняет сценарии на рабочем Redis с временными идентификаторами (ключи удаляются):
+- 3 неверных подряд → блокировка;
+- 2 неверных + верный + неверный → блокировка (3 неверных за день);
+- во время блокировки попытки не продлевают её, но входят в дневной лимит;
+- блокировка снимается по истечении срока и через reset.
+
+Использование:
+  python manage.py check_promo_limiter
+"""
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from core import promo_limiter
+
+
+class Command(BaseCommand):
+    help = "Проверяет правила блокировки за неверные промокоды на Redis."
+
+    def handle(self, *args, **options):
+        self.failed = 0
+        with override_settings(PROMO_MAX_FAILED_ATTEMPTS=3, PROMO_BLOCK_SECONDS=2):
+            self._scenario("3 неверных подряд → блокировка", self._consecutive)
+            self._scenario("3 неверных за день (с верным между ними) → блокировка", self._daily)
+            self._scenario("Попытки во время блокировки её не продлевают", self._while_blocked)
+            self._scenario("Попытки во время блокировки входят в дневной лимит", self._blocked_count_daily)
+            self._scenario("Блокировка снимается по сроку и через reset", self._expiry_and_reset)
+        if self.failed:
+            raise CommandError(f"Не пройдено сценариев: {self.failed}")
+        self.stdout.write(self.style.SUCCESS("Все сценарии пройдены"))
+
+    def _scenario(self, title, func):
+        user_id = f'check-{uuid.uuid4().hex}'
+        try:
+            error = func(user_id)
+        finally:
+            promo_limiter.reset(user_id)
+        if error:
+            self.failed += 1
+            self.stdout.write(self.style.ERROR(f"✗ {title}: {error}"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"✓ {title}"))
+
+    def _consecutive(self, user_id):
+        results = [promo_limiter.register_failure(user_id) for _ in range(3)]
+        if results[0] or results[1]:
+            return "блокировка раньше третьей попытки"
+        if not results[2] or not promo_limiter.blocked_until(user_id):
+            return "нет блокировки после третьей попытки"
+
+    def _daily(self, user_id):
+        promo_limiter.register_failure(user_id)
+        promo_limiter.register_failure(user_id)
+        promo_limiter.register_success(user_id)
+        if promo_limiter.blocked_until(user_id):
+            return "блокировка без трёх неверных"
+        if not promo_limiter.register_failure(user_id):
+            return "нет блокировки после третьей неверной за день"
+
+    def _while_blocked(self, user_id):
+        first = None
+        for _ in range(3):
+            first = promo_limiter.register_failure(user_id)
+        again = promo_limiter.register_failure(user_id)
+        if again != first:
+            return f"срок блокировки изменился: {first} → {again}"
+
+    def _blocked_count_daily(self, user_id):
+        promo_limiter.register_failure(user_id)
+        promo_limiter.register_success(user_id)
+        promo_limiter.register_failure(user_id)
+        promo_limiter.register_success(user_id)
+        # Третья неверная за день блокирует; ещё две — во время блокировки
+        first = promo_limiter.register_failure(user_id)
+        promo_limiter.register_failure(user_id)
+        promo_limiter.register_failure(user_id)
+        if not first:
+            return "нет блокировки после третьей неверной за день"
+        daily = promo_limiter._get_client().zcard(promo_limiter._keys(user_id)[2])
+        if daily != 5:
+            return f"в дневном лимите {daily} попыток вместо 5"
+
+    def _expiry_and_reset(self, user_id):
+        for _ in range(3):
+            promo_limiter.register_failure(user_id)
+        time.sleep(2.1)
+        if promo_limiter.blocked_until(user_id):
+            return "блокировка не истекла"
+        # Счётчик «подряд» обнулён блокировкой, но дневные попытки сохраняются
+        if not promo_limiter.register_failure(user_id):
+            return "4-я неверная за день не заблокировала"
+        promo_limiter.reset(user_id)
+        if promo_limiter.blocked_until(user_id) or promo_limiter.register_failure(user_id):
+            return "reset не снял блокировку"
@@ -0,0 +1,77 @@
+"""
+Management команда: отчёт о заполненности пространства хешей промокодов.
+
+Для каждой длины хеша: количество кодов по типам, неиспользованные коды, ёмкость (32^L),
+доля занятых хешей (вероятность коллизии при подборе) и вероятность угадать
+неиспользованный код одной случайной попыткой. Также показывает длину, которую получат
+новые коды при генерации --plan штук (см. core/codespace.py) и коды, чей hash_code совпадает
+с полным кодом другого QR-кода (такой ввод находит не тот код).
+
+Использование:
+  python manage.py codespace_report [--plan 100000]
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Q
+from django.db.models.functions import Length
+
+from core import codespace
+from core.models import QRCode
+
+
+class Command(BaseCommand):
+    help = "Показывает заполненность пространства хешей промокодов и длину для новых кодов."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--plan", type=int, default=100000, help="Сколько кодов планируется сгенерировать")
+
+    def handle(self, *args, **options):
+        rows = (
+            QRCode.objects.order_by().annotate(length=Length('hash_code'))
+            .values('length')
+            .annotate(
+                total=Count('id'),
+                electrician=Count('id', filter=Q(code_type='electrician')),
+                seller=Count('id', filter=Q(code_type='seller')),
+                unscanned=Count('id', filter=Q(is_scanned=False)),
+            )
+            .order_by('length')
+        )
+        codespace.occupancy(refresh=True)
+
+        self.stdout.write(
+            f"{'Длина':>5} {'Всего':>10} {'E':>10} {'D':>10} {'Не исп.':>10} "
+            f"{'Ёмкость':>16} {'Занято':>9} {'Угадать':>10}"
+        )
+        for row in rows:
+            cap = codespace.capacity(row['length'])
+            fill = row['total'] / cap
+            guess = row['unscanned'] / cap
+            style = self.style.WARNING if not codespace.fits(row['length'], row['total'], 0) else str
+            self.stdout.write(style(
+                f"{row['length']:>5} {row['total']:>10} {row['electrician']:>10} {row['seller']:>10} "
+                f"{row['unscanned']:>10} {cap:>16} {fill:>8.3%} {guess:>10.2e}"
+            ))
+
+        ambiguous = list(QRCode.ambiguous_codes().values_list('hash_code', flat=True)[:10])
+        self.stdout.write("")
+        if ambiguous:
+            total = QRCode.ambiguous_codes().count()
+            self.stdout.write(self.style.WARNING(
+                f"hash_code совпадает с полным кодом другого QR-кода: {total} ({', '.join(ambiguous)})"
+            ))
+        else:
+            self.stdout.write("Совпадений hash_code с полными кодами нет")
+
+        plan = options["plan"]
+        length = codespace.choose_length(plan)
+        self.stdout.write("")
+        self.stdout.write(
+            f"Пороги: коллизия ≤ {settings.QR_CODE_HASH_MAX_COLLISION:.2%}, "
+            f"угадывание ≤ {settings.QR_CODE_HASH_MAX_GUESS_PROBABILITY:.2%}, "
+            f"минимальная длина {settings.QR_CODE_HASH_MIN_LENGTH}"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Для генерации {plan} кодов будет использована длина хеша {length} "
+            f"(длина кода с префиксом E/D — {length + 1})"
+        ))
@@ -3,10 +3,10 @@ Management команда для очистки истории сканиров
 
 Делает следующее для заданного telegram_id:
 - находит TelegramUser;
-- удаляет все QRCodeScanAttempt, связанные с этим пользователем;
+- удаляет его попытки сканирования (PromoCodeAttempt с QR-кодом);
 - «отсканированные» им QRCode помечает как неотсканированные
   (scanned_by = None, is_scanned = False, scanned_at = None);
-- пересчитывает баллы пользователя.
+- списывает баллы за эти QR-коды в журнале баллов.
 
 Использование:
   python manage.py delete_user_scans <telegram_id> [--dry-run]
@@ -14,14 +14,15 @@ Management команда для очистки истории сканиров
 
 from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
+from django.db.models import Sum
 
-from core.models import TelegramUser, QRCode, QRCodeScanAttempt
+from core.models import TelegramUser, QRCode, PromoCodeAttempt, PointsTransaction
 
 
 class Command(BaseCommand):
     help = (
         "Очищает историю сканирования QR-кодов пользователя по telegram_id: "
-        "удаляет QRCodeScanAttempt и сбрасывает сканы QRCode."
+        "удаляет PromoCodeAttempt и сбрасывает сканы QRCode."
     )
 
     def add_arguments(self, parser):
@@ -47,13 +48,13 @@ class Command(BaseCommand):
 
         self.stdout.write(self.style.MIGRATE_HEADING(f"Пользователь: id={user.id}, telegram_id={telegram_id}"))
 
-        attempts_qs = QRCodeScanAttempt.objects.filter(user=user)
+        attempts_qs = PromoCodeAttempt.objects.filter(user=user, qr_code__isnull=False)
         scanned_qr_qs = QRCode.objects.filter(scanned_by=user, is_scanned=True)
 
         attempts_count = attempts_qs.count()
         scanned_qr_count = scanned_qr_qs.count()
 
-        self.stdout.write(f"Найдено попыток сканирования (QRCodeScanAttempt): {attempts_count}")
+        self.stdout.write(f"Найдено попыток сканирования (PromoCodeAttempt): {attempts_count}")
         self.stdout.write(f"Найдено отсканированных QR-кодов (QRCode.scanned_by == user): {scanned_qr_count}")
 
         if dry_run:
@@ -64,6 +65,10 @@ class Command(BaseCommand):
             # Удаляем попытки сканирования
             deleted_attempts, _ = attempts_qs.delete()
 
+            # Списываем баллы за сбрасываемые QR-коды (update() минует QRCode.save)
+            scanned_points = scanned_qr_qs.aggregate(total=Sum('points'))['total'] or 0
+            PointsTransaction.record(user.pk, -scanned_points, 'qr_unscan')
+
             # Сбрасываем состояние отсканированных QR-кодов
             updated_qr = scanned_qr_qs.update(
                 scanned_by=None,
@@ -71,11 +76,9 @@ class Command(BaseCommand):
                 scanned_at=None,
             )
 
-            # Пересчитываем баллы пользователя
-            user.invalidate_points_cache()
-            new_points = user.calculate_points(force=True)
+            new_points = user.calculate_points()
 
-        self.stdout.write(self.style.SUCCESS(f"Удалено QRCodeScanAttempt: {deleted_attempts}"))
+        self.stdout.write(self.style.SUCCESS(f"Удалено PromoCodeAttempt: {deleted_attempts}"))
         self.stdout.write(self.style.SUCCESS(f"Сброшено отсканированных QR-кодов: {updated_qr}"))
         self.stdout.write(self.style.SUCCESS(f"Новые баллы пользователя: {new_points}"))
 
@@ -0,0 +1,30 @@
+"""
+Management команда: полная пересборка фильтра выданных промокодов в Redis.
+
+Запускать после деплоя (первая сборка), после восстановления Redis и после массовых
+изменений QRCode в обход модели. Новые коды добавляются в фильтр автоматически.
+
+Использование:
+  python manage.py rebuild_code_filter
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core import code_filter
+
+
+class Command(BaseCommand):
+    help = "Пересобирает фильтр Блума выданных промокодов (Redis) по таблице QRCode."
+
+    def handle(self, *args, **options):
+        if not code_filter.is_enabled():
+            raise CommandError("Фильтр выключен (QR_CODE_FILTER_ENABLED=False)")
+
+        start = time.perf_counter()
+        count = code_filter.rebuild()
+        size_mb = settings.QR_CODE_FILTER_BITS / 8 / 1024 / 1024
+        self.stdout.write(self.style.SUCCESS(
+            f"Фильтр пересобран: {count} QR-кодов, {size_mb:.1f} МБ, {time.perf_counter() - start:.1f} с"
+        ))
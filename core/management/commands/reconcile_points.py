@@ -0,0 +1,88 @@
+"""
+Management команда: сверка журнала баллов с исходными данными.
+
+Для каждого пользователя сравнивает:
+- сумму журнала баллов (PointsTransaction.delta);
+- счётчик TelegramUser.points;
+- пересчёт по исходным данным: сумма отсканированных QR-кодов − стоимость активных заказов,
+  не меньше 0 (как TelegramUser.aggregate_points).
+
+Удаление отсканированного кода или активного заказа записывается в журнал (pre_delete).
+Расхождения возможны после прямых изменений в БД (в обход ORM) или смены стоимости подарка
+(журнал хранит стоимость на момент заказа). С --fix добавляет корректирующую запись
+('adjustment') и выставляет points по исходным данным.
+
+Использование:
+  python manage.py reconcile_points [--fix] [--telegram-id 123456]
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from core.models import TelegramUser, QRCode, GiftRedemption, PointsTransaction
+
+
+def _sum_subquery(queryset, group_field, sum_field):
+    return Coalesce(
+        Subquery(
+            queryset.values(group_field).annotate(total=Sum(sum_field)).values('total'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+class Command(BaseCommand):
+    help = "Сверяет журнал баллов с TelegramUser.points и с пересчётом по QR-кодам и заказам."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fix", action="store_true", help="Исправить расхождения корректирующими записями")
+        parser.add_argument("--telegram-id", type=int, help="Проверить только одного пользователя")
+
+    def handle(self, *args, **options):
+        users = TelegramUser.objects.order_by().annotate(
+            ledger_total=_sum_subquery(
+                PointsTransaction.objects.filter(user=OuterRef('pk')), 'user', 'delta'
+            ),
+            earned=_sum_subquery(
+                QRCode.objects.filter(scanned_by=OuterRef('pk'), is_scanned=True).order_by(),
+                'scanned_by', 'points'
+            ),
+            spent=_sum_subquery(
+                GiftRedemption.objects.filter(user=OuterRef('pk'))
+                .exclude(status__in=GiftRedemption.REFUNDED_STATUSES).order_by(),
+                'user', 'gift__points_cost'
+            ),
+        )
+        if options["telegram_id"]:
+            users = users.filter(telegram_id=options["telegram_id"])
+
+        checked = 0
+        mismatches = 0
+        for user in users.only('id', 'telegram_id', 'points').iterator(chunk_size=2000):
+            checked += 1
+            expected = max(0, user.earned - user.spent)
+            if user.ledger_total == expected and user.points == expected:
+                continue
+            mismatches += 1
+            self.stdout.write(self.style.WARNING(
+                f"telegram_id={user.telegram_id}: журнал={user.ledger_total}, "
+                f"points={user.points}, по данным={expected}"
+            ))
+            if options["fix"]:
+                with transaction.atomic():
+                    if user.ledger_total != expected:
+                        PointsTransaction.objects.create(
+                            user_id=user.pk,
+                            delta=expected - user.ledger_total,
+                            reason='adjustment',
+                        )
+                    # Относительное изменение: не затирает параллельные начисления
+                    TelegramUser.objects.filter(pk=user.pk).update(points=F('points') + (expected - user.points))
+
+        self.stdout.write(f"Проверено пользователей: {checked}, расхождений: {mismatches}")
+        if mismatches and options["fix"]:
+            self.stdout.write(self.style.SUCCESS("Расхождения исправлены"))
+        elif not mismatches:
+            self.stdout.write(self.style.SUCCESS("Журнал баллов совпадает с исходными данными"))
@@ -0,0 +1,82 @@
+"""
+Management команда: проверка гонки при активации промокода.
+
+Создаёт временный QR-код и N временных пользователей, затем N потоков одновременно
+(через Barrier) вызывают QRCode.claim для одного и того же кода. Успешной должна быть
+ровно одна попытка, остальные — 'already_scanned'. Временные данные удаляются в конце.
+
+Использование:
+  python manage.py stress_qr_claim [--parallel 50] [--rounds 5]
+"""
+import threading
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from core.models import TelegramUser, QRCode
+
+# Диапазон telegram_id временных пользователей
+STRESS_TELEGRAM_ID_BASE = 9_100_000_000_000
+
+
+class Command(BaseCommand):
+    help = "Одновременно активирует один промокод из N потоков и проверяет, что успешна ровно одна попытка."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--parallel", type=int, default=50, help="Одновременных попыток")
+        parser.add_argument("--rounds", type=int, default=5, help="Количество прогонов")
+
+    def handle(self, *args, **options):
+        parallel = options["parallel"]
+        telegram_ids = [STRESS_TELEGRAM_ID_BASE + i for i in range(parallel)]
+        TelegramUser.objects.bulk_create(
+            [TelegramUser(telegram_id=tid, user_type='electrician') for tid in telegram_ids],
+            ignore_conflicts=True,
+        )
+        users = list(TelegramUser.objects.filter(telegram_id__in=telegram_ids))
+        codes = []
+        failed_rounds = 0
+        try:
+            for round_no in range(1, options["rounds"] + 1):
+                qr_code = QRCode.create_code('electrician', points=0)
+                codes.append(qr_code.pk)
+                results = self._race(qr_code.code.lower(), users)
+
+                claimed = QRCode.objects.get(pk=qr_code.pk)
+                ok = results['claimed'] == 1 and claimed.is_scanned and claimed.scanned_by_id is not None
+                failed_rounds += not ok
+                style = self.style.SUCCESS if ok else self.style.ERROR
+                self.stdout.write(style(f"Прогон {round_no}: {dict(results)}"))
+        finally:
+            QRCode.history.filter(id__in=codes).delete()
+            QRCode.objects.filter(pk__in=codes).delete()
+            TelegramUser.objects.filter(telegram_id__in=telegram_ids).delete()
+
+        if failed_rounds:
+            raise CommandError(f"Гонка обнаружена в {failed_rounds} прогонах")
+        self.stdout.write(self.style.SUCCESS("Во всех прогонах код активирован ровно один раз"))
+
+    def _race(self, raw_code, users):
+        barrier = threading.Barrier(len(users))
+        results = Counter()
+        lock = threading.Lock()
+
+        def attempt(user):
+            try:
+                barrier.wait()
+                with transaction.atomic():
+                    status, _ = QRCode.claim(raw_code, user)
+            except Exception as e:
+                status = f'error: {type(e).__name__}'
+            finally:
+                connection.close()
+            with lock:
+                results[status] += 1
+
+        threads = [threading.Thread(target=attempt, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
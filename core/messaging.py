@@ -6,19 +6,21 @@ import logging
 import re
 from typing import List, Optional
 from aiogram import Bot
-from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramAPIError
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramForbiddenError, TelegramAPIError,
+    TelegramRetryAfter, TelegramServerError, TelegramNetworkError,
+)
 from aiogram.types import Message
 from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.utils import timezone
 from .models import TelegramUser, BroadcastMessage
+from .send_rate import send_concurrently
 
 logger = logging.getLogger(__name__)
 
-# Лимиты Telegram API
-# 30 сообщений в секунду для broadcast
-TELEGRAM_BROADCAST_RATE_LIMIT = 30  # сообщений в секунду
-TELEGRAM_MESSAGE_DELAY = 1.0 / TELEGRAM_BROADCAST_RATE_LIMIT  # ~0.033 секунды между сообщениями
+# Ошибки, после которых отправку можно повторить
+RETRYABLE_ERRORS = (TelegramRetryAfter, TelegramServerError, TelegramNetworkError)
 
 # Telegram HTML поддерживает только: b, strong, i, em, u, ins, s, strike, del, span, tg-spoiler, a, code, pre, blockquote
 # Теги <p>, <div>, <br> вызывают "Unsupported start tag"
@@ -47,6 +49,132 @@ def sanitize_html_for_telegram(text: str) -> str:
     return result.strip()
 
 
+class BroadcastPhoto:
+    """
+    Фото рассылки: загружается в Telegram один раз, дальше отправляется по file_id.
+
+    Пока file_id неизвестен, загрузка идет по одной (параллельные отправки ждут первую успешную),
+    затем все отправки — по file_id без передачи файла. on_file_id(file_id) — корутина для
+    сохранения file_id (BroadcastMessage.image_file_id), чтобы его переиспользовали другие батчи.
+    """
+
+    def __init__(self, path: Optional[str] = None, file_id: str = '', on_file_id=None):
+        self.path = path
+        self.file_id = file_id or ''
+        self.on_file_id = on_file_id
+        self.uploads = 0
+        self._upload_lock = asyncio.Lock()
+
+    async def send(self, bot: Bot, **kwargs) -> Message:
+        file_id = self.file_id
+        if file_id:
+            try:
+                return await bot.send_photo(photo=file_id, **kwargs)
+            except TelegramBadRequest as e:
+                # file_id недействителен (например, сменили токен бота) — загружаем файл заново
+                if not self.path or 'file' not in e.message.lower():
+                    raise
+                logger.warning(f"file_id фото рассылки не принят Telegram, загружаем заново: {e}")
+                if self.file_id == file_id:
+                    self.file_id = ''
+
+        async with self._upload_lock:
+            if self.file_id:
+                return await bot.send_photo(photo=self.file_id, **kwargs)
+            from aiogram.types import FSInputFile
+            message = await bot.send_photo(photo=FSInputFile(self.path), **kwargs)
+            self.uploads += 1
+            # Самый большой размер — исходное изображение
+            self.file_id = message.photo[-1].file_id
+            if self.on_file_id:
+                await self.on_file_id(self.file_id)
+            return message
+
+
+class RecipientStatusBuffer:
+    """
+    Итоги отправки получателям (last_message_sent_at, is_active, blocked_bot_at) с записью в БД пачками.
+
+    Вместо UPDATE на каждого получателя итоги копятся в памяти и записываются каждые
+    BROADCAST_STATUS_FLUSH_SIZE получателей: одним UPDATE ... WHERE id IN (...) на каждый исход
+    (значения внутри исхода одинаковые). Запись истории — только для пользователей, у которых
+    изменились is_active / blocked_bot_at. Последнюю пачку записывает flush() — вызывать в finally.
+    """
+
+    SENT = 'sent'
+    BLOCKED = 'blocked'
+    INVALID = 'invalid'
+
+    def __init__(self, flush_size: Optional[int] = None):
+        self.flush_size = flush_size or settings.BROADCAST_STATUS_FLUSH_SIZE
+        self._pending = {}
+
+    async def add(self, user: TelegramUser, outcome: str):
+        self._pending[user.pk] = (user, outcome)
+        if len(self._pending) >= self.flush_size:
+            await self.flush()
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            await sync_to_async(self._write)(list(pending.values()))
+        except Exception as e:
+            # Сообщения уже доставлены — статусы вернутся в буфер и запишутся со следующей пачкой
+            logger.error(f"Не удалось записать статусы {len(pending)} получателей рассылки: {e}")
+            for pk, item in pending.items():
+                self._pending.setdefault(pk, item)
+
+    @staticmethod
+    def _write(pending):
+        from django.db import transaction
+
+        now = timezone.now()
+        values = {
+            RecipientStatusBuffer.SENT: {'last_message_sent_at': now, 'is_active': True, 'blocked_bot_at': None},
+            RecipientStatusBuffer.BLOCKED: {'is_active': False, 'blocked_bot_at': now},
+            RecipientStatusBuffer.INVALID: {'is_active': False},
+        }
+        ids = {outcome: [] for outcome in values}
+        changed = []
+        for user, outcome in pending:
+            ids[outcome].append(user.pk)
+            if any(
+                getattr(user, name) != value
+                for name, value in values[outcome].items() if name != 'last_message_sent_at'
+            ):
+                changed.append(user)
+        with transaction.atomic():
+            for outcome, user_ids in ids.items():
+                if user_ids:
+                    TelegramUser.objects.filter(pk__in=user_ids).update(**values[outcome])
+            for user, outcome in pending:
+                for name, value in values[outcome].items():
+                    setattr(user, name, value)
+            if changed:
+                # UPDATE минует save(), поэтому историю смены статуса пишем явно
+                TelegramUser.history.bulk_history_create(changed, update=True)
+
+
+def stored_photo(instance, path: Optional[str]) -> Optional[BroadcastPhoto]:
+    """
+    Фото рассылки с file_id, сохраняемым в instance.image_file_id (BroadcastMessage, RegionMessageLog).
+
+    Returns:
+        BroadcastPhoto или None, если нет ни файла, ни сохраненного file_id
+    """
+    if not path and not instance.image_file_id:
+        return None
+
+    @sync_to_async
+    def save_file_id(file_id):
+        instance.image_file_id = file_id
+        type(instance).objects.filter(pk=instance.pk).update(image_file_id=file_id)
+
+    return BroadcastPhoto(path, instance.image_file_id, on_file_id=save_file_id)
+
+
 async def send_message_to_user(
     bot: Bot,
     user: TelegramUser,
@@ -54,6 +182,9 @@ async def send_message_to_user(
     parse_mode: Optional[str] = None,
     disable_notification: bool = False,
     photo_path: Optional[str] = None,
+    raise_retryable: bool = False,
+    photo: Optional['BroadcastPhoto'] = None,
+    status_buffer: Optional[RecipientStatusBuffer] = None,
 ) -> tuple[bool, Optional[str]]:
     """
     Отправляет сообщение конкретному пользователю.
@@ -66,6 +197,10 @@ async def send_message_to_user(
         parse_mode: Режим парсинга (HTML, Markdown)
         disable_notification: Отключить уведомление
         photo_path: Путь к файлу изображения (если указан — отправляется фото с caption)
+        raise_retryable: Не обрабатывать флуд-контроль (429), ошибки сервера Telegram и сети —
+            исключение получает вызывающий для повтора (см. core/send_rate.py)
+        photo: Фото рассылки (BroadcastPhoto) — вместо photo_path, отправляется по file_id
+        status_buffer: Буфер итогов рассылки — статус пользователя записывается пачкой, а не сразу
     
     Returns:
         tuple: (успешно ли отправлено, сообщение об ошибке если есть)
@@ -73,12 +208,12 @@ async def send_message_to_user(
     try:
         if parse_mode and parse_mode.upper() == 'HTML' and text:
             text = sanitize_html_for_telegram(text)
-        if photo_path:
-            from aiogram.types import FSInputFile
-            photo = FSInputFile(photo_path)
-            await bot.send_photo(
+        if photo_path and photo is None:
+            photo = BroadcastPhoto(photo_path)
+        if photo:
+            await photo.send(
+                bot,
                 chat_id=user.telegram_id,
-                photo=photo,
                 caption=text or None,
                 parse_mode=parse_mode,
                 disable_notification=disable_notification,
@@ -92,6 +227,10 @@ async def send_message_to_user(
             )
         
         # Обновляем время последнего сообщения
+        if status_buffer is not None:
+            await status_buffer.add(user, RecipientStatusBuffer.SENT)
+            return True, None
+
         @sync_to_async
         def update_user_success():
             user.last_message_sent_at = timezone.now()
@@ -106,6 +245,9 @@ async def send_message_to_user(
     except TelegramForbiddenError as e:
         # Пользователь заблокировал бота
         logger.warning(f"Пользователь {user.telegram_id} заблокировал бота: {e}")
+        if status_buffer is not None:
+            await status_buffer.add(user, RecipientStatusBuffer.BLOCKED)
+            return False, "Пользователь заблокировал бота"
         
         @sync_to_async
         def update_user_blocked():
@@ -119,6 +261,9 @@ async def send_message_to_user(
     except TelegramBadRequest as e:
         # Неверный запрос (пользователь не найден и т.д.)
         logger.warning(f"Ошибка при отправке пользователю {user.telegram_id}: {e}")
+        if status_buffer is not None:
+            await status_buffer.add(user, RecipientStatusBuffer.INVALID)
+            return False, f"Ошибка запроса: {str(e)}"
         
         @sync_to_async
         def update_user_inactive():
@@ -129,6 +274,8 @@ async def send_message_to_user(
         return False, f"Ошибка запроса: {str(e)}"
         
     except TelegramAPIError as e:
+        if raise_retryable and isinstance(e, RETRYABLE_ERRORS):
+            raise
         # Другие ошибки API
         logger.error(f"Ошибка Telegram API для пользователя {user.telegram_id}: {e}")
         return False, f"Ошибка API: {str(e)}"
@@ -139,6 +286,67 @@ async def send_message_to_user(
         return False, f"Неожиданная ошибка: {str(e)}"
 
 
+async def send_to_users(
+    bot: Bot,
+    users,
+    text: str,
+    parse_mode: Optional[str] = None,
+    photo_path: Optional[str] = None,
+    on_result=None,
+    retry_stats: Optional[dict] = None,
+    photo: Optional[BroadcastPhoto] = None,
+) -> tuple[int, int]:
+    """
+    Отправляет одно сообщение списку пользователей.
+
+    Отправки идут параллельно (TELEGRAM_BROADCAST_CONCURRENCY), темп ограничен общим для
+    всех рассылок и воркеров лимитом бота; при флуд-контроле и ошибках сервера Telegram
+    отправка повторяется (см. core/send_rate.py). Статусы получателей записываются пачками
+    (RecipientStatusBuffer).
+
+    Args:
+        bot: Экземпляр бота
+        users: Пользователи Telegram
+        text: Текст сообщения
+        parse_mode: Режим парсинга (HTML, Markdown)
+        photo_path: Путь к файлу изображения (загружается в Telegram один раз на вызов)
+        on_result: корутина on_result(user, success, error) после каждой отправки
+        retry_stats: словарь {'retry_count': 0, 'flood_wait_count': 0} — счетчики повторов
+            и ответов 429 (флуд-контроль)
+        photo: Фото рассылки с сохраненным file_id (вместо photo_path)
+
+    Returns:
+        tuple: (отправлено, ошибок)
+    """
+    if photo is None and photo_path:
+        photo = BroadcastPhoto(photo_path)
+    status_buffer = RecipientStatusBuffer()
+
+    async def send(user):
+        return await send_message_to_user(
+            bot=bot,
+            user=user,
+            text=text,
+            parse_mode=parse_mode,
+            photo=photo,
+            raise_retryable=True,
+            status_buffer=status_buffer,
+        )
+
+    async def on_retry(user, error, delay):
+        logger.info(f"Повтор отправки пользователю {user.telegram_id} через {delay:.1f} с: {error}")
+        if retry_stats is not None:
+            retry_stats['retry_count'] += 1
+            if isinstance(error, TelegramRetryAfter):
+                retry_stats['flood_wait_count'] += 1
+
+    try:
+        return await send_concurrently(users, send, on_result=on_result, on_retry=on_retry)
+    finally:
+        # Итоги последних получателей — и при ошибке или отмене (soft time limit Celery)
+        await status_buffer.flush()
+
+
 async def send_broadcast_message(
     broadcast: BroadcastMessage,
     bot: Bot,
@@ -158,42 +366,11 @@ async def send_broadcast_message(
     # Получаем активных пользователей
     @sync_to_async
     def get_users():
-        users_query = TelegramUser.objects.filter(is_active=True)
-        
-        # Фильтр по типу пользователя
-        filter_user_type = user_type_filter or broadcast.user_type_filter
-        if filter_user_type:
-            users_query = users_query.filter(user_type=filter_user_type)
-        
-        # Фильтр по языку
-        if broadcast.language_filter:
-            users_query = users_query.filter(language=broadcast.language_filter)
-        
-        # Фильтр по региону
-        if broadcast.region_filter:
-            from core.regions import get_region_by_coordinates
-            
-            # Получаем всех пользователей с геолокацией
-            users_with_location = list(users_query.filter(
-                latitude__isnull=False,
-                longitude__isnull=False
-            ))
-            
-            # Фильтруем по выбранному региону
-            filtered_user_ids = []
-            for user in users_with_location:
-                user_region = get_region_by_coordinates(user.latitude, user.longitude)
-                if user_region == broadcast.region_filter:
-                    filtered_user_ids.append(user.id)
-            
-            # Применяем фильтр по ID
-            if filtered_user_ids:
-                users_query = users_query.filter(id__in=filtered_user_ids)
-            else:
-                # Если никого не найдено, возвращаем пустой queryset
-                users_query = users_query.none()
-        
-        return list(users_query)
+        return list(TelegramUser.audience(
+            user_type=user_type_filter or broadcast.user_type_filter,
+            language=broadcast.language_filter,
+            region=broadcast.region_filter,
+        ))
     
     users = await get_users()
     total_users = len(users)
@@ -208,9 +385,6 @@ async def send_broadcast_message(
     
     await update_broadcast_start()
     
-    sent_count = 0
-    failed_count = 0
-    
     logger.info(f"Начало рассылки '{broadcast.title}' для {total_users} пользователей")
     
     # Путь к изображению (если есть)
@@ -221,69 +395,58 @@ async def send_broadcast_message(
         except (ValueError, OSError):
             pass
 
-    # Отправляем сообщения с учетом лимитов
-    for i, user in enumerate(users):
-        try:
-            success, error = await send_message_to_user(
-                bot=bot,
-                user=user,
-                text=broadcast.message_text,
-                parse_mode='HTML',
-                photo_path=photo_path,
-            )
-            
-            if success:
-                sent_count += 1
-            else:
-                failed_count += 1
-                logger.warning(f"Не удалось отправить пользователю {user.telegram_id}: {error}")
-            
-            # Обновляем статистику каждые 10 сообщений
-            if (i + 1) % 10 == 0:
-                @sync_to_async
-                def update_broadcast_progress():
-                    broadcast.sent_count = sent_count
-                    broadcast.failed_count = failed_count
-                    broadcast.save(update_fields=['sent_count', 'failed_count'])
-                
-                await update_broadcast_progress()
-            
-            # Соблюдаем лимит Telegram API (30 сообщений в секунду)
-            # Добавляем небольшую задержку между сообщениями
-            if i < total_users - 1:  # Не ждем после последнего сообщения
-                await asyncio.sleep(TELEGRAM_MESSAGE_DELAY)
-                
-        except Exception as e:
-            logger.error(f"Критическая ошибка при отправке пользователю {user.telegram_id}: {e}")
-            failed_count += 1
-            # Помечаем пользователя как неактивного при критической ошибке
+    counts = {'sent': 0, 'failed': 0}
+    retry_stats = {'retry_count': 0, 'flood_wait_count': 0}
+
+    # Обновляем статистику каждые 10 сообщений
+    async def on_result(user, success, error):
+        counts['sent' if success else 'failed'] += 1
+        if not success:
+            logger.warning(f"Не удалось отправить пользователю {user.telegram_id}: {error}")
+        if (counts['sent'] + counts['failed']) % 10 == 0:
             @sync_to_async
-            def mark_user_inactive():
-                user.is_active = False
-                user.save(update_fields=['is_active'])
-            
-            await mark_user_inactive()
+            def update_broadcast_progress():
+                broadcast.sent_count = counts['sent']
+                broadcast.failed_count = counts['failed']
+                broadcast.retry_count = retry_stats['retry_count']
+                broadcast.flood_wait_count = retry_stats['flood_wait_count']
+                broadcast.save(update_fields=['sent_count', 'failed_count', 'retry_count', 'flood_wait_count'])
+
+            await update_broadcast_progress()
+
+    # Отправляем параллельно в пределах общего лимита Telegram API
+    sent_count, failed_count = await send_to_users(
+        bot, users, broadcast.message_text, parse_mode='HTML', photo=stored_photo(broadcast, photo_path),
+        on_result=on_result, retry_stats=retry_stats,
+    )
     
     # Завершаем рассылку
     @sync_to_async
     def update_broadcast_complete():
         broadcast.sent_count = sent_count
         broadcast.failed_count = failed_count
+        broadcast.retry_count = retry_stats['retry_count']
+        broadcast.flood_wait_count = retry_stats['flood_wait_count']
         broadcast.status = 'completed'
         broadcast.completed_at = timezone.now()
-        broadcast.save(update_fields=['sent_count', 'failed_count', 'status', 'completed_at'])
+        broadcast.save(update_fields=[
+            'sent_count', 'failed_count', 'retry_count', 'flood_wait_count', 'status', 'completed_at',
+        ])
     
     await update_broadcast_complete()
     
     logger.info(
         f"Рассылка '{broadcast.title}' завершена: "
-        f"отправлено {sent_count}, ошибок {failed_count} из {total_users}"
+        f"отправлено {sent_count}, ошибок {failed_count} из {total_users}, "
+        f"повторов {retry_stats['retry_count']} (флуд-контроль: {retry_stats['flood_wait_count']})"
     )
     
     return {
         'total': total_users,
         'sent': sent_count,
-        'failed': failed_count
+        'failed': failed_count,
+        'retries': retry_stats['retry_count'],
+        'flood_waits': retry_stats['flood_wait_count'],
     }
 
 
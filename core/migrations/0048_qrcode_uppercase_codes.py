@@ -0,0 +1,27 @@
+# Generated manually
+
+from django.db import migrations
+from django.db.models.functions import Upper
+
+
+def uppercase_codes(apps, schema_editor):
+    """
+    Приводит code и hash_code к верхнему регистру.
+    Поиск промокода идёт точным сравнением с нормализованным вводом (QRCode.find_by_code),
+    поэтому все коды должны храниться в верхнем регистре. Обновляются только строки,
+    где регистр отличается (обычно ни одной).
+    """
+    QRCode = apps.get_model('core', 'QRCode')
+    QRCode.objects.exclude(code=Upper('code')).update(code=Upper('code'))
+    QRCode.objects.exclude(hash_code=Upper('hash_code')).update(hash_code=Upper('hash_code'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0047_alter_historicaladmincontactsettings_history_change_reason_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(uppercase_codes, migrations.RunPython.noop),
+    ]
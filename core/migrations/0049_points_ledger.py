@@ -0,0 +1,81 @@
+# Generated by Django 5.0.1 on 2026-10-17 04:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 5000
+
+
+def backfill_ledger(apps, schema_editor):
+    """
+    Заполняет журнал баллов по текущим данным: +баллы за каждый отсканированный QR-код,
+    −стоимость подарка за каждый активный заказ. Затем TelegramUser.points = сумма журнала.
+    Записи привязаны к QR-коду/заказу, поэтому последующие отмены и возвраты точны.
+    """
+    QRCode = apps.get_model('core', 'QRCode')
+    GiftRedemption = apps.get_model('core', 'GiftRedemption')
+    PointsTransaction = apps.get_model('core', 'PointsTransaction')
+    TelegramUser = apps.get_model('core', 'TelegramUser')
+
+    def flush(batch):
+        PointsTransaction.objects.bulk_create(batch, batch_size=BATCH_SIZE)
+        batch.clear()
+
+    batch = []
+    scanned = (
+        QRCode.objects.filter(is_scanned=True, scanned_by__isnull=False)
+        .exclude(points=0)
+        .values_list('id', 'scanned_by_id', 'points')
+    )
+    for qr_code_id, user_id, points in scanned.iterator(chunk_size=BATCH_SIZE):
+        batch.append(PointsTransaction(user_id=user_id, delta=points, reason='qr_scan', qr_code_id=qr_code_id))
+        if len(batch) >= BATCH_SIZE:
+            flush(batch)
+
+    active = (
+        GiftRedemption.objects.exclude(status__in=['rejected', 'cancelled_by_user', 'not_received'])
+        .exclude(gift__points_cost=0)
+        .values_list('id', 'user_id', 'gift__points_cost')
+    )
+    for redemption_id, user_id, cost in active.iterator(chunk_size=BATCH_SIZE):
+        batch.append(PointsTransaction(user_id=user_id, delta=-cost, reason='redemption', redemption_id=redemption_id))
+        if len(batch) >= BATCH_SIZE:
+            flush(batch)
+    flush(batch)
+
+    ledger_sum = (
+        PointsTransaction.objects.filter(user=OuterRef('pk'))
+        .values('user').annotate(total=Sum('delta')).values('total')
+    )
+    TelegramUser.objects.update(points=Coalesce(Subquery(ledger_sum), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0048_qrcode_uppercase_codes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PointsTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delta', models.IntegerField(verbose_name='O‘zgarish')),
+                ('reason', models.CharField(choices=[('qr_scan', 'Promo-kod skanerlandi'), ('qr_unscan', 'Skanerlash bekor qilindi'), ('redemption', 'Sovg‘a uchun yechildi'), ('redemption_refund', 'Sovg‘a uchun qaytarildi'), ('adjustment', 'Tuzatish')], max_length=20, verbose_name='Sabab')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Vaqt')),
+                ('qr_code', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='points_transactions', to='core.qrcode', verbose_name='Promo-kod')),
+                ('redemption', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='points_transactions', to='core.giftredemption', verbose_name='Ariza')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='points_transactions', to='core.telegramuser', verbose_name='Foydalanuvchi')),
+            ],
+            options={
+                'verbose_name': 'Ballar jurnali',
+                'verbose_name_plural': 'Ballar jurnali',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['user', 'created_at'], name='core_points_user_id_44ac54_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_ledger, migrations.RunPython.noop),
+    ]
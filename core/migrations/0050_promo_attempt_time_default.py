@@ -0,0 +1,19 @@
+# Generated by Django 5.0.1 on 2026-10-17 04:24
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0049_points_ledger'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='promocodeattempt',
+            name='attempted_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='Urinish vaqti'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.1 on 2026-10-17 04:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0050_promo_attempt_time_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='promocodeattempt',
+            name='qr_code',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='promo_code_attempts', to='core.qrcode', verbose_name='QR-kod'),
+        ),
+        migrations.AddIndex(
+            model_name='promocodeattempt',
+            index=models.Index(fields=['user', 'attempted_at'], name='core_promoc_user_id_161a53_idx'),
+        ),
+    ]
@@ -0,0 +1,75 @@
+from datetime import timedelta
+
+from django.db import migrations
+
+BATCH_SIZE = 2000
+# Обе записи создавались в одной транзакции, разница во времени — доли секунды
+MATCH_WINDOW = timedelta(seconds=5)
+
+
+def merge_scan_attempts(apps, schema_editor):
+    """
+    Переносит QRCodeScanAttempt в журнал PromoCodeAttempt.
+
+    Для попытки сканирования ищется запись PromoCodeAttempt того же пользователя с тем же
+    результатом в пределах MATCH_WINDOW — ей проставляется qr_code. Попытки без пары
+    (созданные до появления PromoCodeAttempt) добавляются новыми записями.
+    """
+    QRCodeScanAttempt = apps.get_model('core', 'QRCodeScanAttempt')
+    PromoCodeAttempt = apps.get_model('core', 'PromoCodeAttempt')
+
+    last_id = 0
+    while True:
+        batch = list(
+            QRCodeScanAttempt.objects.filter(id__gt=last_id).order_by('id')
+            .values('id', 'user_id', 'qr_code_id', 'attempted_at', 'is_successful')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        last_id = batch[-1]['id']
+
+        times = [a['attempted_at'] for a in batch]
+        candidates = {}
+        for promo in (
+            PromoCodeAttempt.objects.filter(
+                user_id__in={a['user_id'] for a in batch},
+                attempted_at__range=(min(times) - MATCH_WINDOW, max(times) + MATCH_WINDOW),
+                qr_code__isnull=True,
+            ).only('id', 'user_id', 'attempted_at', 'is_successful')
+        ):
+            candidates.setdefault((promo.user_id, promo.is_successful), []).append(promo)
+
+        matched = []
+        created = []
+        for attempt in batch:
+            pool = candidates.get((attempt['user_id'], attempt['is_successful']), [])
+            best = min(
+                (p for p in pool if abs(p.attempted_at - attempt['attempted_at']) <= MATCH_WINDOW),
+                key=lambda p: abs(p.attempted_at - attempt['attempted_at']),
+                default=None,
+            )
+            if best is not None:
+                pool.remove(best)
+                best.qr_code_id = attempt['qr_code_id']
+                matched.append(best)
+            else:
+                created.append(PromoCodeAttempt(
+                    user_id=attempt['user_id'],
+                    qr_code_id=attempt['qr_code_id'],
+                    attempted_at=attempt['attempted_at'],
+                    is_successful=attempt['is_successful'],
+                    source='unknown',
+                ))
+        PromoCodeAttempt.objects.bulk_update(matched, ['qr_code'], batch_size=BATCH_SIZE)
+        PromoCodeAttempt.objects.bulk_create(created, batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0051_promo_attempt_qr_code'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_scan_attempts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,14 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0052_merge_scan_attempts'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='QRCodeScanAttempt',
+        ),
+    ]
@@ -0,0 +1,46 @@
+from django.db import migrations
+
+SEQUENCES = {
+    'E': 'core_qrcode_serial_e_seq',
+    'D': 'core_qrcode_serial_d_seq',
+}
+
+
+def create_sequences(apps, schema_editor):
+    """
+    Создаёт последовательности серийных номеров (PostgreSQL) и продолжает их с
+    наибольшего существующего номера каждого префикса.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    table = apps.get_model('core', 'QRCode')._meta.db_table
+    with schema_editor.connection.cursor() as cursor:
+        for prefix, sequence in SEQUENCES.items():
+            cursor.execute(f"CREATE SEQUENCE IF NOT EXISTS {sequence} AS bigint MINVALUE 1")
+            cursor.execute(
+                f"SELECT MAX(CAST(SUBSTRING(serial_number FROM 2) AS bigint)) FROM {table} "
+                f"WHERE serial_number ~ %s",
+                [f'^{prefix}[0-9]+$'],
+            )
+            last_number = cursor.fetchone()[0]
+            if last_number:
+                cursor.execute("SELECT setval(%s, %s, true)", [sequence, last_number])
+
+
+def drop_sequences(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for sequence in SEQUENCES.values():
+            cursor.execute(f"DROP SEQUENCE IF EXISTS {sequence}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0053_delete_qrcodescanattempt'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_sequences, drop_sequences),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.1 on 2026-10-17 04:35
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_completed(apps, schema_editor):
+    """Для завершённых генераций прогресс равен количеству."""
+    QRCodeGeneration = apps.get_model('core', 'QRCodeGeneration')
+    QRCodeGeneration.objects.filter(status='completed').update(generated_count=F('quantity'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0054_qrcode_serial_sequences'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalqrcodegeneration',
+            name='completed_batches',
+            field=models.JSONField(blank=True, default=list, verbose_name='Yakunlangan partiyalar'),
+        ),
+        migrations.AddField(
+            model_name='historicalqrcodegeneration',
+            name='generated_count',
+            field=models.IntegerField(default=0, verbose_name='Yaratilgan'),
+        ),
+        migrations.AddField(
+            model_name='qrcodegeneration',
+            name='completed_batches',
+            field=models.JSONField(blank=True, default=list, verbose_name='Yakunlangan partiyalar'),
+        ),
+        migrations.AddField(
+            model_name='qrcodegeneration',
+            name='generated_count',
+            field=models.IntegerField(default=0, verbose_name='Yaratilgan'),
+        ),
+        migrations.RunPython(fill_completed, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.0.1 on 2026-10-17 04:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0055_qrcodegeneration_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalqrcodegeneration',
+            name='export_file',
+            field=models.TextField(blank=True, max_length=100, null=True, verbose_name='Excel fayl'),
+        ),
+        migrations.AddField(
+            model_name='historicalqrcodegeneration',
+            name='export_progress',
+            field=models.IntegerField(default=0, verbose_name='Eksport qilingan'),
+        ),
+        migrations.AddField(
+            model_name='historicalqrcodegeneration',
+            name='export_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Kutilmoqda'), ('processing', 'Jarayonda'), ('completed', 'Yakunlandi'), ('failed', 'Xatolik')], max_length=20, verbose_name='Eksport holati'),
+        ),
+        migrations.AddField(
+            model_name='qrcodegeneration',
+            name='export_file',
+            field=models.FileField(blank=True, null=True, upload_to='qrcodes/exports/', verbose_name='Excel fayl'),
+        ),
+        migrations.AddField(
+            model_name='qrcodegeneration',
+            name='export_progress',
+            field=models.IntegerField(default=0, verbose_name='Eksport qilingan'),
+        ),
+        migrations.AddField(
+            model_name='qrcodegeneration',
+            name='export_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Kutilmoqda'), ('processing', 'Jarayonda'), ('completed', 'Yakunlandi'), ('failed', 'Xatolik')], max_length=20, verbose_name='Eksport holati'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.1 on 2026-10-17 04:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0056_qrcodegeneration_export'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalqrcode',
+            name='generation',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='core.qrcodegeneration', verbose_name='Yaratilish'),
+        ),
+        migrations.AddField(
+            model_name='qrcode',
+            name='generation',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.qrcodegeneration', verbose_name='Yaratilish'),
+        ),
+        migrations.AddIndex(
+            model_name='qrcode',
+            index=models.Index(fields=['generation', 'id'], name='core_qrcode_generat_8bd2b6_idx'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+from django.db import migrations, transaction
+
+CHUNK_SIZE = 10000
+
+
+def backfill_generation(apps, schema_editor):
+    """
+    Заполняет QRCode.generation по таблице связей генерация ↔ код.
+
+    Миграция без общей транзакции: каждая пачка связей (по id) — отдельная короткая транзакция,
+    поэтому таблица кодов не блокируется надолго и миграцию можно прервать и запустить снова
+    (уже заполненные коды пропускаются).
+    """
+    QRCode = apps.get_model('core', 'QRCode')
+    QRCodeGeneration = apps.get_model('core', 'QRCodeGeneration')
+    Link = QRCodeGeneration._meta.get_field('qr_codes').remote_field.through
+
+    last_id = 0
+    while True:
+        links = list(
+            Link.objects.filter(id__gt=last_id).order_by('id')
+            .values_list('id', 'qrcodegeneration_id', 'qrcode_id')[:CHUNK_SIZE]
+        )
+        if not links:
+            break
+        by_generation = {}
+        for _, generation_id, qr_code_id in links:
+            by_generation.setdefault(generation_id, []).append(qr_code_id)
+        with transaction.atomic():
+            for generation_id, qr_code_ids in by_generation.items():
+                QRCode.objects.filter(id__in=qr_code_ids, generation__isnull=True).update(
+                    generation_id=generation_id
+                )
+        last_id = links[-1][0]
+
+
+def restore_links(apps, schema_editor):
+    QRCode = apps.get_model('core', 'QRCode')
+    QRCodeGeneration = apps.get_model('core', 'QRCodeGeneration')
+    Link = QRCodeGeneration._meta.get_field('qr_codes').remote_field.through
+
+    codes = QRCode.objects.filter(generation__isnull=False).order_by('id').values_list('id', 'generation_id')
+    last_id = 0
+    while True:
+        chunk = list(codes.filter(id__gt=last_id)[:CHUNK_SIZE])
+        if not chunk:
+            break
+        Link.objects.bulk_create(
+            [Link(qrcodegeneration_id=generation_id, qrcode_id=qr_code_id) for qr_code_id, generation_id in chunk],
+            ignore_conflicts=True,
+        )
+        last_id = chunk[-1][0]
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('core', '0057_qrcode_generation'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_generation, restore_links),
+    ]
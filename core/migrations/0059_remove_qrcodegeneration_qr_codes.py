@@ -0,0 +1,23 @@
+# Generated by Django 5.0.1 on 2026-10-17 04:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0058_backfill_qrcode_generation'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='qrcodegeneration',
+            name='qr_codes',
+        ),
+        migrations.AlterField(
+            model_name='qrcode',
+            name='generation',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='qr_codes', to='core.qrcodegeneration', verbose_name='Yaratilish'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.1 on 2026-10-17 05:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0059_remove_qrcodegeneration_qr_codes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='broadcastmessage',
+            name='flood_wait_count',
+            field=models.IntegerField(default=0, verbose_name='Telegram cheklovlari (429)'),
+        ),
+        migrations.AddField(
+            model_name='broadcastmessage',
+            name='retry_count',
+            field=models.IntegerField(default=0, verbose_name='Qayta yuborishlar'),
+        ),
+        migrations.AddField(
+            model_name='historicalbroadcastmessage',
+            name='flood_wait_count',
+            field=models.IntegerField(default=0, verbose_name='Telegram cheklovlari (429)'),
+        ),
+        migrations.AddField(
+            model_name='historicalbroadcastmessage',
+            name='retry_count',
+            field=models.IntegerField(default=0, verbose_name='Qayta yuborishlar'),
+        ),
+    ]
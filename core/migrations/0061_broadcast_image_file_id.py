@@ -0,0 +1,28 @@
+# Generated by Django 5.0.1 on 2026-10-17 05:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0060_broadcast_retry_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='broadcastmessage',
+            name='image_file_id',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='Rasm file_id (Telegram)'),
+        ),
+        migrations.AddField(
+            model_name='historicalbroadcastmessage',
+            name='image_file_id',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='Rasm file_id (Telegram)'),
+        ),
+        migrations.AddField(
+            model_name='regionmessagelog',
+            name='image_file_id',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='file_id изображения в Telegram'),
+        ),
+    ]
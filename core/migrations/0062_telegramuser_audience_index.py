@@ -0,0 +1,17 @@
+# Generated by Django 5.0.1 on 2026-10-17 05:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0061_broadcast_image_file_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='telegramuser',
+            index=models.Index(fields=['is_active', 'user_type', 'language', 'region'], name='core_telegr_is_acti_e0a4fe_idx'),
+        ),
+    ]
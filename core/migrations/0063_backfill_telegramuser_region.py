@@ -0,0 +1,56 @@
+from django.db import migrations, models
+
+CHUNK_SIZE = 2000
+
+
+def backfill_region(apps, schema_editor):
+    """
+    Пересчитывает TelegramUser.region и district по координатам у всех пользователей.
+
+    Получатели рассылок по области выбираются в SQL по полю region, поэтому оно должно
+    соответствовать координатам: раньше бот сохранял новые координаты без области, и у
+    переехавших пользователей осталась старая. Записываются только отличающиеся строки.
+    Миграция без общей транзакции: пачки по id, каждая — один bulk_update; прерванную
+    миграцию можно запустить снова.
+    """
+    from core.regions import get_district_by_coordinates, get_region_by_coordinates
+
+    TelegramUser = apps.get_model('core', 'TelegramUser')
+    # Без координат области нет (как в TelegramUser.update_location)
+    TelegramUser.objects.filter(
+        models.Q(latitude__isnull=True) | models.Q(longitude__isnull=True),
+    ).exclude(region__isnull=True, district__isnull=True).update(region=None, district=None)
+
+    users = TelegramUser.objects.filter(
+        latitude__isnull=False, longitude__isnull=False,
+    ).order_by('id').only('id', 'latitude', 'longitude', 'region', 'district')
+
+    last_id = 0
+    while True:
+        chunk = list(users.filter(id__gt=last_id)[:CHUNK_SIZE])
+        if not chunk:
+            break
+        changed = []
+        for user in chunk:
+            # Координаты вне областей оставляют region пустым — как в TelegramUser.update_location
+            region = get_region_by_coordinates(user.latitude, user.longitude)
+            district = None
+            if region:
+                district = get_district_by_coordinates(user.latitude, user.longitude, region)[0]
+            if (region, district) != (user.region, user.district):
+                user.region, user.district = region, district
+                changed.append(user)
+        TelegramUser.objects.bulk_update(changed, ['region', 'district'])
+        last_id = chunk[-1].id
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('core', '0062_telegramuser_audience_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_region, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.1 on 2026-10-17 05:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0063_backfill_telegramuser_region'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalqrcodegeneration',
+            name='export_updated_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Eksport yangilangan vaqt'),
+        ),
+        migrations.AddField(
+            model_name='qrcodegeneration',
+            name='export_updated_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Eksport yangilangan vaqt'),
+        ),
+    ]
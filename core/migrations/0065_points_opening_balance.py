@@ -0,0 +1,39 @@
+from django.db import migrations
+from django.db.models import Sum
+
+BATCH_SIZE = 5000
+
+
+def clamp_negative_balances(apps, schema_editor):
+    """
+    До журнала баланс не опускался ниже 0 (calculate_points: max(0, заработано − потрачено)),
+    а заполнение журнала (0049) перенесло отрицательные суммы в TelegramUser.points.
+    Пользователям с отрицательной суммой журнала добавляется корректирующая запись
+    ('adjustment') до 0 — журнал и баланс снова совпадают.
+    """
+    PointsTransaction = apps.get_model('core', 'PointsTransaction')
+    TelegramUser = apps.get_model('core', 'TelegramUser')
+
+    negative = list(
+        PointsTransaction.objects.order_by().values('user_id')
+        .annotate(total=Sum('delta')).filter(total__lt=0)
+        .values_list('user_id', 'total')
+    )
+    for i in range(0, len(negative), BATCH_SIZE):
+        chunk = negative[i:i + BATCH_SIZE]
+        PointsTransaction.objects.bulk_create([
+            PointsTransaction(user_id=user_id, delta=-total, reason='adjustment')
+            for user_id, total in chunk
+        ])
+        TelegramUser.objects.filter(id__in=[user_id for user_id, _ in chunk]).update(points=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0064_qrcodegeneration_export_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(clamp_negative_balances, migrations.RunPython.noop),
+    ]
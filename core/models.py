@@ -5,12 +5,16 @@ import hashlib
 import secrets
 import string
 import random
-from django.db import models
+from collections import Counter
+from django.db import models, transaction
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import MinValueValidator
 from simple_history.models import HistoricalRecords
-from datetime import timedelta
+
+from core import code_filter, codespace, promo_limiter
 
 
 class TelegramUser(models.Model):
@@ -74,6 +78,29 @@ class TelegramUser(models.Model):
             ('send_region_messages', 'Can send messages to users by region'),
             ('change_user_type_call_center', 'Call Center: Can change user type'),
         ]
+        indexes = [
+            # Выбор получателей рассылки (audience) — одним индексом по всем фильтрам
+            models.Index(fields=['is_active', 'user_type', 'language', 'region']),
+        ]
+    
+    @classmethod
+    def audience(cls, user_type=None, language=None, region=None):
+        """
+        Активные пользователи — получатели рассылки по фильтрам.
+        
+        Область фильтруется в SQL по сохраненному полю region (его заполняет save() по
+        координатам); region='all' — все пользователи с координатами. Порядок — по id.
+        """
+        users = cls.objects.filter(is_active=True).order_by('id')
+        if user_type:
+            users = users.filter(user_type=user_type)
+        if language:
+            users = users.filter(language=language)
+        if region == 'all':
+            users = users.filter(latitude__isnull=False, longitude__isnull=False)
+        elif region:
+            users = users.filter(region=region)
+        return users
     
     def update_location(self):
         """Автоматически определяет и сохраняет область и район по координатам."""
@@ -100,8 +127,20 @@ class TelegramUser(models.Model):
     def save(self, *args, **kwargs):
         """Переопределяем save для автоматического определения локации."""
         # Обновляем локацию при сохранении, если есть координаты
-        if self.latitude is not None and self.longitude is not None:
+        update_fields = kwargs.get('update_fields')
+        location_changed = update_fields is not None and {'latitude', 'longitude'} & set(update_fields)
+        if location_changed or (self.latitude is not None and self.longitude is not None):
             self.update_location()
+        # Область и район сохраняются вместе с координатами: по ним выбираются получатели рассылок
+        if location_changed:
+            kwargs['update_fields'] = list({*update_fields, 'region', 'district'})
+        # points меняется только через журнал баллов (PointsTransaction.record):
+        # полное сохранение устаревшего объекта не должно затирать баланс
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name != 'points'
+            ]
         super().save(*args, **kwargs)
     
     def get_region(self):
@@ -141,50 +180,38 @@ class TelegramUser(models.Model):
         from core.regions import get_district_name
         return get_district_name(district_code, region_code, language)
     
-    def calculate_points(self, force=False):
+    def calculate_points(self):
         """
-        Вычисляет баллы пользователя на основе промокодов и активных заказов.
-        Использует Redis кеш (1 минута).
+        Возвращает текущий баланс пользователя.
         
-        points = сумма QR-кодов - сумма активных заказов
-        Отмененные, отклоненные и невыданные заказы НЕ учитываются (возвращаются).
+        Баланс ведётся журналом баллов (PointsTransaction): каждое изменение — одна запись
+        в журнале и атомарное изменение TelegramUser.points. Чтение — один запрос по PK,
+        без пересчёта агрегатов. Значение обновляется и в self.points.
         """
-        from django.core.cache import cache
-        
-        cache_key = f'user_points_{self.id}'
-        if not force:
-            cached = cache.get(cache_key)
-            if cached is not None:
-                return cached
+        points = TelegramUser.objects.filter(pk=self.pk).values_list('points', flat=True).first()
+        self.points = points or 0
+        return max(0, self.points)
+    
+    def aggregate_points(self):
+        """
+        Пересчитывает баланс по исходным данным (для сверки с журналом, см. reconcile_points).
         
-        # Сумма всех баллов с отсканированных QR-кодов
+        points = max(0, сумма QR-кодов - сумма активных заказов)
+        Отмененные, отклоненные и невыданные заказы НЕ учитываются (возвращаются).
+        """
         total_earned = QRCode.objects.filter(
             scanned_by=self, is_scanned=True
         ).aggregate(total=models.Sum('points'))['total'] or 0
         
-        # Сумма стоимости активных заказов (не отмененных/отклоненных)
         total_spent = GiftRedemption.objects.filter(
             user=self
         ).exclude(
-            status__in=['rejected', 'cancelled_by_user', 'not_received']
+            status__in=GiftRedemption.REFUNDED_STATUSES
         ).aggregate(
             total=models.Sum('gift__points_cost')
         )['total'] or 0
         
-        calculated = max(0, total_earned - total_spent)
-        
-        # Синхронизируем денормализованное поле
-        if self.points != calculated:
-            TelegramUser.objects.filter(id=self.id).update(points=calculated)
-            self.points = calculated
-        
-        cache.set(cache_key, calculated, 60)  # 1 минута кеш
-        return calculated
-    
-    def invalidate_points_cache(self):
-        """Инвалидирует кеш баллов пользователя."""
-        from django.core.cache import cache
-        cache.delete(f'user_points_{self.id}')
+        return max(0, total_earned - total_spent)
     
     # ──────────────────────────────────────────────────────────────────────
     # Promo code lock helpers
@@ -194,6 +221,7 @@ class TelegramUser(models.Model):
         Проверяет, заблокирован ли пользователь для ввода промокодов.
 
         Логика: только блокировка на 1 день (нет 5 минут и навсегда).
+        Состояние блокировки — в Redis (core/promo_limiter.py), запросов к БД нет.
         Returns (blocked: bool, block_type: str, blocked_until: datetime | None)
         block_type: 'none' | '1d' | 'permanent' (permanent только для старых записей)
         """
@@ -203,122 +231,68 @@ class TelegramUser(models.Model):
         if self.promo_block_stage >= 3:
             return True, 'permanent', None
 
-        # Временная блокировка на день
+        # Блокировка, выставленная до переноса счётчиков в Redis
         if self.promo_blocked_until and self.promo_blocked_until > now:
             return True, '1d', self.promo_blocked_until
 
-        # Время блокировки истекло — снимаем
-        if self.promo_blocked_until and self.promo_blocked_until <= now:
-            self.promo_blocked_until = None
-            self.promo_failed_attempts = 0
-            TelegramUser.objects.filter(id=self.id).update(
-                promo_blocked_until=None,
-                promo_failed_attempts=0,
-            )
+        blocked_until = promo_limiter.blocked_until(self.id)
+        if blocked_until:
+            return True, '1d', blocked_until
 
         return False, 'none', None
     
-    def register_invalid_promo_attempt(self, source: str, raw_code: str = ""):
+    def register_invalid_promo_attempt(self, source: str, raw_code: str = "", qr_code=None):
         """
         Регистрирует неверную попытку ввода промокода.
 
         Алгоритм:
         - Счётчик только подряд: при верном вводе обнуляется (2 неверных + верный → с нуля).
         - 3 неверных подряд ИЛИ 3 неверных за текущий день → блокировка на 1 день (не на 5 минут и не навсегда).
+        Счётчики и блокировка — в Redis (core/promo_limiter.py); в БД пишется только
+        время блокировки (для админки) и, через буфер, журнал PromoCodeAttempt.
+        qr_code — найденный, но не активированный код (уже использован / другого типа).
         """
         from .models import PromoCodeAttempt
 
-        now = timezone.now()
-        today = now.date()
-
         # Всегда пишем попытку в лог
-        PromoCodeAttempt.objects.create(
-            user=self,
-            raw_code=raw_code or "",
-            attempted_at=now,
-            is_successful=False,
-            source=source,
-        )
+        PromoCodeAttempt.log(self.id, raw_code, is_successful=False, source=source, qr_code=qr_code)
 
         if self.promo_block_stage >= 3:
             return {'blocked': True, 'block_type': 'permanent', 'blocked_until': None}
 
-        if self.promo_blocked_until and self.promo_blocked_until > now:
-            return {
-                'blocked': True,
-                'block_type': '1d',
-                'blocked_until': self.promo_blocked_until,
-            }
-
-        # Сколько неверных попыток сегодня (уже с учётом только что созданной)
-        today_failed = PromoCodeAttempt.objects.filter(
-            user=self,
-            is_successful=False,
-            attempted_at__date=today,
-        ).count()
-
-        if today_failed >= 3:
-            # Лимит дня: 3 неверных в день → блок на 1 день
-            self.promo_blocked_until = now + timedelta(days=1)
-            self.promo_failed_attempts = 0
-            TelegramUser.objects.filter(id=self.id).update(
-                promo_blocked_until=self.promo_blocked_until,
-                promo_failed_attempts=0,
-            )
-            return {
-                'blocked': True,
-                'block_type': '1d',
-                'blocked_until': self.promo_blocked_until,
-            }
-
-        # Увеличиваем только подряд идущие неверные
-        consecutive = (self.promo_failed_attempts or 0) + 1
-        self.promo_failed_attempts = consecutive
-
-        if consecutive >= 3:
-            self.promo_blocked_until = now + timedelta(days=1)
-            self.promo_failed_attempts = 0
-            TelegramUser.objects.filter(id=self.id).update(
-                promo_failed_attempts=0,
-                promo_blocked_until=self.promo_blocked_until,
-            )
-            return {
-                'blocked': True,
-                'block_type': '1d',
-                'blocked_until': self.promo_blocked_until,
-            }
-
-        TelegramUser.objects.filter(id=self.id).update(
-            promo_failed_attempts=self.promo_failed_attempts,
-        )
-        return {'blocked': False, 'block_type': 'none', 'blocked_until': None}
-    
-    def register_successful_promo(self, raw_code: str = "", source: str = ""):
+        # Попытка учитывается и во время блокировки: она входит в дневной лимит
+        blocked_until = promo_limiter.register_failure(self.id)
+        if blocked_until is None:
+            if self.promo_blocked_until and self.promo_blocked_until > timezone.now():
+                # Блокировки нет в Redis (недоступен или очищен) — действует копия из БД
+                return {
+                    'blocked': True,
+                    'block_type': '1d',
+                    'blocked_until': self.promo_blocked_until,
+                }
+            return {'blocked': False, 'block_type': 'none', 'blocked_until': None}
+
+        if self.promo_blocked_until != blocked_until:
+            # Блокировка выставляется раз в сутки — копия в БД для админки
+            self.promo_blocked_until = blocked_until
+            TelegramUser.objects.filter(id=self.id).update(promo_blocked_until=blocked_until)
+        return {
+            'blocked': True,
+            'block_type': '1d',
+            'blocked_until': blocked_until,
+        }
+    
+    def register_successful_promo(self, raw_code: str = "", source: str = "", qr_code=None):
         """
         Фиксирует успешный ввод промокода и обнуляет счётчик подряд идущих
         неверных попыток (2 неверных + верный → счётчик с нуля).
         """
         from .models import PromoCodeAttempt
 
-        now = timezone.now()
-
-        PromoCodeAttempt.objects.create(
-            user=self,
-            raw_code=raw_code or "",
-            attempted_at=now,
-            is_successful=True,
-            source=source or 'unknown',
-        )
+        PromoCodeAttempt.log(self.id, raw_code, is_successful=True, source=source or 'unknown', qr_code=qr_code)
 
         if self.promo_block_stage < 3:
-            self.promo_failed_attempts = 0
-            if self.promo_blocked_until and self.promo_blocked_until <= now:
-                self.promo_blocked_until = None
-
-            TelegramUser.objects.filter(id=self.id).update(
-                promo_failed_attempts=self.promo_failed_attempts,
-                promo_blocked_until=self.promo_blocked_until,
-            )
+            promo_limiter.register_success(self.id)
     
     def __str__(self):
         return f"{self.first_name or 'Unknown'} (@{self.username or 'no_username'})"
@@ -347,6 +321,16 @@ class QRCode(models.Model):
         related_name='scanned_qrcodes'
     )
     is_scanned = models.BooleanField(default=False)
+    # Генерация, в которой создан код (задается при bulk_create). Индекс — составной (generation, id)
+    generation = models.ForeignKey(
+        'QRCodeGeneration',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        db_index=False,
+        related_name='qr_codes',
+        verbose_name='Yaratilish'
+    )
     
     history = HistoricalRecords()
     
@@ -358,6 +342,7 @@ class QRCode(models.Model):
             models.Index(fields=['code']),
             models.Index(fields=['hash_code']),
             models.Index(fields=['is_scanned']),
+            models.Index(fields=['generation', 'id']),
         ]
         permissions = [
             ('view_qrcode_detail', 'Can view QR code details'),
@@ -377,16 +362,141 @@ class QRCode(models.Model):
         return f"{masked_code} ({self.get_code_type_display()})"
     
     @classmethod
-    def generate_hash(cls, length=4):
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем состояние сканирования для записи изменений баллов в save()
+        instance._loaded_scan = instance._scan_state()
+        return instance
+    
+    def _scan_state(self):
+        """(id владельца баллов или None, баллы) — по загруженным полям, без запросов."""
+        data = self.__dict__
+        owner_id = data.get('scanned_by_id') if data.get('is_scanned') else None
+        return owner_id, data.get('points') or 0
+    
+    def save(self, *args, **kwargs):
+        """
+        Хранит code и hash_code в верхнем регистре — поиск идёт точным сравнением по индексу.
+        Изменение сканирования (отмена в админке, смена баллов) отражается в журнале баллов.
+        """
+        if self.code:
+            self.code = self.normalize_code(self.code)
+        if self.hash_code:
+            self.hash_code = self.normalize_code(self.hash_code)
+        
+        update_fields = kwargs.get('update_fields')
+        track = update_fields is None or {'is_scanned', 'scanned_by', 'scanned_by_id', 'points'} & set(update_fields)
+        old_owner, old_points = getattr(self, '_loaded_scan', (None, 0))
+        
+        is_new = self._state.adding
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            if is_new or update_fields is None or {'code', 'hash_code'} & set(update_fields):
+                code_filter.add_codes([self.code, self.hash_code])
+            if not track:
+                return
+            new_owner, new_points = self._scan_state()
+            if old_owner == new_owner:
+                if new_owner and new_points != old_points:
+                    PointsTransaction.record(new_owner, new_points - old_points, 'adjustment', qr_code=self)
+            else:
+                if old_owner:
+                    PointsTransaction.record(old_owner, -old_points, 'qr_unscan', qr_code=self)
+                if new_owner:
+                    PointsTransaction.record(new_owner, new_points, 'qr_scan', qr_code=self)
+        self._loaded_scan = self._scan_state()
+    
+    @staticmethod
+    def normalize_code(raw_code):
+        """Приводит введённый промокод к виду хранения в БД (без пробелов, верхний регистр)."""
+        return (raw_code or '').strip().upper()
+    
+    @classmethod
+    def find_by_code(cls, raw_code):
+        """
+        Находит QR-код по полному коду (EABC123) или hash_code (ABC123) без учёта регистра.
+        
+        Коды хранятся в верхнем регистре, поэтому вместо iexact (UPPER(col), без индекса)
+        используется точное сравнение: один запрос по уникальным индексам code и hash_code.
+        
+        Returns:
+            QRCode или None
+        """
+        normalized = cls.normalize_code(raw_code)
+        if not normalized or not code_filter.might_exist(normalized):
+            return None
+        candidates = list(
+            cls.objects.filter(models.Q(code=normalized) | models.Q(hash_code=normalized)).order_by()[:2]
+        )
+        # Совпадение по полному коду приоритетнее совпадения по hash_code
+        for qr_code in candidates:
+            if qr_code.code == normalized:
+                return qr_code
+        return candidates[0] if candidates else None
+    
+    @classmethod
+    def claim(cls, raw_code, user):
+        """
+        Атомарно активирует промокод для пользователя.
+        
+        Один запрос UPDATE ... WHERE is_scanned = FALSE ... RETURNING: из нескольких
+        одновременных попыток с одним кодом успешной будет ровно одна. Если у пользователя
+        уже есть тип, код другого типа не активируется. Баллы начисляются в журнал.
+        Вызывать внутри transaction.atomic(): начисление баллов пишется в той же транзакции.
+        
+        Returns:
+            tuple: (status, qr_code), status — 'claimed', 'not_found', 'already_scanned'
+            или 'wrong_type'; qr_code — None только для 'not_found'
+        """
+        normalized = cls.normalize_code(raw_code)
+        # Фильтр выданных кодов отсекает несуществующие коды без запроса в БД
+        if not normalized or not code_filter.might_exist(normalized):
+            return 'not_found', None
+    
+        table = cls._meta.db_table
+        sql = (
+            f'UPDATE {table} SET is_scanned = %s, scanned_at = %s, scanned_by_id = %s '
+            f'WHERE id = ('
+            f'SELECT id FROM {table} WHERE code = %s OR hash_code = %s '
+            f'ORDER BY CASE WHEN code = %s THEN 0 ELSE 1 END LIMIT 1'
+            f') AND is_scanned = %s'
+        )
+        params = [True, timezone.now(), user.pk, normalized, normalized, normalized, False]
+        if user.user_type:
+            sql += ' AND code_type = %s'
+            params.append(user.user_type)
+        sql += ' RETURNING *'
+    
+        claimed = list(cls.objects.raw(sql, params))
+        if claimed:
+            qr_code = claimed[0]
+            # UPDATE минует save(), поэтому запись истории и начисление баллов делаем явно
+            cls.history.bulk_history_create([qr_code], update=True)
+            PointsTransaction.record(user.pk, qr_code.points, 'qr_scan', qr_code=qr_code)
+            return 'claimed', qr_code
+    
+        # Код не активирован — определяем причину (только на пути ошибки)
+        qr_code = cls.find_by_code(normalized)
+        if qr_code is None:
+            return 'not_found', None
+        if qr_code.is_scanned:
+            return 'already_scanned', qr_code
+        return 'wrong_type', qr_code
+    
+    @classmethod
+    def generate_hash(cls, length=None):
         """
         Генерирует уникальный короткий хеш для QR-кода.
         
         Args:
-            length: Длина хеша (минимум 6 символов, по умолчанию 6)
+            length: Длина хеша (по умолчанию — по заполненности пространства, см. core/codespace.py)
         
         Returns:
             str: Уникальный хеш-код из букв и цифр
         """
+        if length is None:
+            length = codespace.choose_length()
+        
         # Используем буквы и цифры для более короткого кода
         characters = string.ascii_uppercase + string.digits
         
@@ -400,8 +510,8 @@ class QRCode(models.Model):
             # Генерируем случайный код заданной длины
             hash_code = ''.join(random.choice(characters) for _ in range(length))
             
-            # Проверяем уникальность
-            if not cls.objects.filter(hash_code=hash_code).exists():
+            # Проверяем уникальность (и отсутствие совпадений с полными кодами)
+            if not cls._taken_hashes([hash_code]):
                 return hash_code
             
             attempts += 1
@@ -410,6 +520,12 @@ class QRCode(models.Model):
         if attempts >= max_attempts:
             return cls.generate_hash(length + 1)
     
+    # Последовательности PostgreSQL для серийных номеров (миграция 0054), по одной на префикс
+    SERIAL_SEQUENCES = {
+        'E': 'core_qrcode_serial_e_seq',
+        'D': 'core_qrcode_serial_d_seq',
+    }
+
     @classmethod
     def generate_serial_number(cls, code_type):
         """
@@ -421,33 +537,7 @@ class QRCode(models.Model):
         Returns:
             str: Уникальный серийный номер
         """
-        prefix = 'E' if code_type == 'electrician' else 'D'
-        
-        # Получаем последний серийный номер для этого типа
-        last_qr = cls.objects.filter(code_type=code_type).order_by('-id').first()
-        
-        if last_qr and last_qr.serial_number:
-            # Извлекаем номер из последнего серийного номера
-            try:
-                last_num = int(last_qr.serial_number.replace(prefix, ''))
-                new_num = last_num + 1
-            except ValueError:
-                new_num = 1
-        else:
-            new_num = 1
-        
-        # Форматируем с ведущими нулями (например, E000001, D000001)
-        serial_number = f"{prefix}{new_num:06d}"
-        
-        # Проверяем уникальность
-        max_attempts = 1000
-        attempts = 0
-        while cls.objects.filter(serial_number=serial_number).exists() and attempts < max_attempts:
-            new_num += 1
-            serial_number = f"{prefix}{new_num:06d}"
-            attempts += 1
-        
-        return serial_number
+        return cls._reserve_serials(code_type, 1)[0]
     
     @classmethod
     def create_code(cls, code_type, points=None):
@@ -462,41 +552,170 @@ class QRCode(models.Model):
         if points is None:
             points = settings.ELECTRICIAN_POINTS if code_type == 'electrician' else settings.SELLER_POINTS
         
-        return cls.objects.create(
+        qr_code = cls.objects.create(
             code=code,
             code_type=code_type,
             hash_code=hash_code,
             serial_number=serial_number,
             points=points
         )
+        codespace.register_created(len(hash_code), 1)
+        return qr_code
 
+    # Алфавит generate_hash: без похожих символов (0, O, I, 1) — ровно 32 символа
+    HASH_ALPHABET = ''.join(c for c in string.ascii_uppercase + string.digits if c not in '0O1I')
+    # Префиксы полного кода (code = префикс + hash_code): электрик, продавец
+    CODE_PREFIXES = ('E', 'D')
 
-class QRCodeScanAttempt(models.Model):
-    """Модель для отслеживания попыток сканирования QR-кода."""
-    user = models.ForeignKey(
-        TelegramUser,
-        on_delete=models.CASCADE,
-        related_name='scan_attempts'
-    )
-    qr_code = models.ForeignKey(
-        QRCode,
-        on_delete=models.CASCADE,
-        related_name='scan_attempts'
-    )
-    attempted_at = models.DateTimeField(auto_now_add=True)
-    is_successful = models.BooleanField(default=False)
-    
-    class Meta:
-        verbose_name = _('Skanerlash urinishi')
-        verbose_name_plural = _('Skanerlash urinishlari')
-        ordering = ['-attempted_at']
-        # Удален unique_together, так как пользователь может делать несколько попыток сканирования одного QR-кода
-    
-    def __str__(self):
-        status = 'Muvaffaqiyatli' if self.is_successful else 'Muvaffaqiyatsiz'
-        # Для коротких кодов показываем полностью или первые символы
-        code_display = self.qr_code.code if len(self.qr_code.code) <= 10 else f"{self.qr_code.code[:10]}..."
-        return f"{self.user} - {code_display} - {status}"
+    @classmethod
+    def _random_hashes(cls, count, length):
+        """count случайных хешей длины length (криптостойкий ГСЧ, 5 бит на символ без смещения)."""
+        alphabet = cls.HASH_ALPHABET
+        data = secrets.token_bytes(count * length)
+        return {
+            ''.join(alphabet[b & 31] for b in data[i:i + length])
+            for i in range(0, len(data), length)
+        }
+
+    @classmethod
+    def _taken_hashes(cls, candidates):
+        """
+        Кандидаты в хеши (одной длины), которые нельзя выдать.
+
+        find_by_code и claim ищут введённый код и по code, и по hash_code, поэтому хеш
+        занят, если он совпадает с hash_code или с полным кодом (E/D + хеш) другого QR-кода,
+        а также если полный код с ним (E/D + кандидат) совпадает с чужим hash_code.
+        """
+        candidates = set(candidates)
+        prefixed = [prefix + c for c in candidates for prefix in cls.CODE_PREFIXES]
+        rows = (
+            cls.objects.filter(
+                models.Q(hash_code__in=[*candidates, *prefixed]) | models.Q(code__in=candidates)
+            )
+            .order_by().values_list('code', 'hash_code')
+        )
+        taken = set()
+        for code, hash_code in rows:
+            taken.update(value for value in (code, hash_code) if value in candidates)
+            if hash_code[1:] in candidates and hash_code[:1] in cls.CODE_PREFIXES:
+                taken.add(hash_code[1:])
+        return taken
+
+    @classmethod
+    def ambiguous_codes(cls):
+        """QR-коды, чей hash_code совпадает с полным кодом другого QR-кода (ввод неоднозначен)."""
+        return cls.objects.filter(hash_code__in=cls.objects.order_by().values('code'))
+
+    @classmethod
+    def _free_hashes(cls, count, length):
+        """
+        Подбирает count новых уникальных хешей: кандидаты с запасом проверяются в БД
+        одним запросом на пачку (_taken_hashes). Длина выбирается по заполненности
+        (codespace.choose_length), поэтому занято не больше QR_CODE_HASH_MAX_COLLISION
+        кандидатов; если свободных почти не осталось (устаревший кэш), длина увеличивается.
+        """
+        result = set()
+        while len(result) < count:
+            missing = count - len(result)
+            candidates = cls._random_hashes(int(missing * 1.2) + 16, length) - result
+            candidates = list(candidates)
+            taken = set()
+            for i in range(0, len(candidates), 2000):
+                taken.update(cls._taken_hashes(candidates[i:i + 2000]))
+            fresh = [c for c in candidates if c not in taken]
+            if len(fresh) < len(candidates) // 10:
+                length += 1
+            result.update(fresh[:missing])
+        return list(result)
+
+    @classmethod
+    def _reserve_serials(cls, code_type, count):
+        """
+        Резервирует count серийных номеров (например, E000001, D000001).
+
+        В PostgreSQL номера берутся из последовательности типа одним запросом
+        (nextval по generate_series): параллельные генерации получают разные номера без
+        блокировок и повторов. На других СУБД (локальная разработка) — диапазон после
+        последнего кода этого типа.
+        """
+        from django.db import connections
+
+        prefix = 'E' if code_type == 'electrician' else 'D'
+        connection = connections[cls.objects.db]
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT nextval(%s) FROM generate_series(1, %s)",
+                    [cls.SERIAL_SEQUENCES[prefix], count],
+                )
+                numbers = sorted(row[0] for row in cursor.fetchall())
+            return [f"{prefix}{num:06d}" for num in numbers]
+
+        last_serial = (
+            cls.objects.filter(code_type=code_type).order_by('-id')
+            .values_list('serial_number', flat=True).first()
+        )
+        try:
+            start = int(last_serial.replace(prefix, '')) + 1 if last_serial else 1
+        except ValueError:
+            start = 1
+        while True:
+            serials = [f"{prefix}{num:06d}" for num in range(start, start + count)]
+            taken = list(
+                cls.objects.filter(serial_number__in=serials)
+                .order_by().values_list('serial_number', flat=True)
+            )
+            if not taken:
+                return serials
+            start = max(int(s.replace(prefix, '')) for s in taken) + 1
+
+    @classmethod
+    def bulk_create_codes(cls, code_type, count, points=None, max_retries=5, generation=None):
+        """
+        Создаёт count QR-кодов пачкой: хеши проверяются на уникальность набором,
+        серийные номера — непрерывным диапазоном, вставка — одним bulk_create
+        (плюс история и фильтр выданных кодов). Без запросов на каждый код.
+        generation (QRCodeGeneration) записывается в коды при вставке.
+
+        Returns:
+            list: созданные QRCode (с id) в порядке серийных номеров
+        """
+        from django.conf import settings
+        from django.db import IntegrityError
+
+        if count <= 0:
+            return []
+        if points is None:
+            points = settings.ELECTRICIAN_POINTS if code_type == 'electrician' else settings.SELLER_POINTS
+        prefix = 'E' if code_type == 'electrician' else 'D'
+
+        for attempt in range(max_retries):
+            hashes = cls._free_hashes(count, codespace.choose_length(count))
+            serials = cls._reserve_serials(code_type, count)
+            qr_codes = [
+                cls(
+                    code=f"{prefix}{hash_code}",
+                    code_type=code_type,
+                    hash_code=hash_code,
+                    serial_number=serial_number,
+                    points=points,
+                    generation=generation,
+                )
+                for hash_code, serial_number in zip(hashes, serials)
+            ]
+            try:
+                with transaction.atomic():
+                    cls.objects.bulk_create(qr_codes)
+                    cls.history.bulk_history_create(qr_codes)
+            except IntegrityError:
+                # Параллельная генерация заняла те же хеши или номера — подбираем заново
+                if attempt == max_retries - 1:
+                    raise
+                continue
+            code_filter.add_codes([value for qr in qr_codes for value in (qr.code, qr.hash_code)])
+            for length, created in Counter(len(h) for h in hashes).items():
+                codespace.register_created(length, created)
+            return qr_codes
 
 
 class Gift(models.Model):
@@ -558,6 +777,9 @@ class Gift(models.Model):
 
 class GiftRedemption(models.Model):
     """Модель получения подарка пользователем."""
+    # Статусы, при которых баллы за заказ возвращаются пользователю
+    REFUNDED_STATUSES = ('rejected', 'cancelled_by_user', 'not_received')
+    
     STATUS_CHOICES = [
         ('pending', 'So\'rov qabul qilindi'),  # Запрос принят к обработке
         ('approved', 'Mahsulot tayyorlash bosqichida'),  # Продукт находится в стадии подготовки
@@ -607,6 +829,149 @@ class GiftRedemption(models.Model):
     def __str__(self):
         gift_name = self.gift.name_uz_latin or self.gift.name_ru or 'Подарок'
         return f"{self.user} - {gift_name} ({self.get_status_display()})"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем статус для списания/возврата баллов в save()
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+    
+    def save(self, *args, **kwargs):
+        """
+        Сохраняет заказ и отражает его в журнале баллов: новый заказ списывает стоимость
+        подарка, переход в REFUNDED_STATUSES возвращает списанное, обратный переход — списывает снова.
+        """
+        update_fields = kwargs.get('update_fields')
+        track = update_fields is None or 'status' in update_fields
+        if self._state.adding:
+            old_status = None
+        elif hasattr(self, '_loaded_status'):
+            old_status = self._loaded_status
+        else:
+            old_status = GiftRedemption.objects.filter(pk=self.pk).values_list('status', flat=True).first()
+        
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            if track:
+                was_charged = old_status is not None and old_status not in self.REFUNDED_STATUSES
+                is_charged = self.status not in self.REFUNDED_STATUSES
+                if is_charged and not was_charged:
+                    PointsTransaction.record(self.user_id, -self.gift.points_cost, 'redemption', redemption=self)
+                elif was_charged and not is_charged:
+                    # Возвращаем ровно то, что было списано по этому заказу
+                    charged = PointsTransaction.objects.filter(redemption=self).aggregate(
+                        total=models.Sum('delta')
+                    )['total'] or 0
+                    if charged:
+                        PointsTransaction.record(self.user_id, -charged, 'redemption_refund', redemption=self)
+        self._loaded_status = self.status
+
+
+class PointsTransaction(models.Model):
+    """
+    Журнал баллов (только добавление записей).
+    
+    TelegramUser.points всегда равен сумме delta пользователя: запись в журнал и изменение
+    счётчика выполняются в одной транзакции (PointsTransaction.record). Сверка с исходными
+    данными — python manage.py reconcile_points.
+    """
+    REASON_CHOICES = [
+        ('qr_scan', 'Promo-kod skanerlandi'),
+        ('qr_unscan', 'Skanerlash bekor qilindi'),
+        ('redemption', 'Sovg‘a uchun yechildi'),
+        ('redemption_refund', 'Sovg‘a uchun qaytarildi'),
+        ('adjustment', 'Tuzatish'),
+    ]
+    
+    user = models.ForeignKey(
+        TelegramUser,
+        on_delete=models.CASCADE,
+        related_name='points_transactions',
+        verbose_name='Foydalanuvchi'
+    )
+    delta = models.IntegerField(verbose_name='O‘zgarish')
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES, verbose_name='Sabab')
+    qr_code = models.ForeignKey(
+        QRCode,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='points_transactions',
+        verbose_name='Promo-kod'
+    )
+    redemption = models.ForeignKey(
+        GiftRedemption,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='points_transactions',
+        verbose_name='Ariza'
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Vaqt')
+    
+    class Meta:
+        verbose_name = _('Ballar jurnali')
+        verbose_name_plural = _('Ballar jurnali')
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id}: {self.delta:+d} ({self.get_reason_display()})"
+    
+    @classmethod
+    def record(cls, user_id, delta, reason, qr_code=None, redemption=None):
+        """
+        Записывает изменение баллов: один INSERT в журнал и один UPDATE points = points + delta.
+        """
+        if not delta:
+            return None
+        with transaction.atomic(savepoint=False):
+            entry = cls.objects.create(
+                user_id=user_id,
+                delta=delta,
+                reason=reason,
+                qr_code=qr_code,
+                redemption=redemption,
+            )
+            TelegramUser.objects.filter(pk=user_id).update(points=models.F('points') + delta)
+        return entry
+
+
+def _deleting_user(origin):
+    """Удаление начато с пользователя: его журнал удаляется вместе с ним, записи не нужны."""
+    return isinstance(origin, TelegramUser) or getattr(origin, 'model', None) is TelegramUser
+
+
+@receiver(pre_delete, sender=QRCode)
+def _unscan_deleted_qr_code(sender, instance, origin=None, **kwargs):
+    """
+    Удаление отсканированного кода списывает его баллы (как отмена сканирования).
+    Состояние читается из БД (объект может быть устаревшим); запись не ссылается на
+    удаляемый код — ссылки на него обнуляются до сигнала.
+    """
+    if _deleting_user(origin):
+        return
+    scan = QRCode.objects.filter(pk=instance.pk, is_scanned=True, scanned_by__isnull=False).values_list(
+        'scanned_by_id', 'points'
+    ).first()
+    if scan:
+        PointsTransaction.record(scan[0], -scan[1], 'qr_unscan')
+
+
+@receiver(pre_delete, sender=GiftRedemption)
+def _refund_deleted_redemption(sender, instance, origin=None, **kwargs):
+    """Удаление активного заказа возвращает его стоимость (как отмена заказа)."""
+    if _deleting_user(origin):
+        return
+    order = (
+        GiftRedemption.objects.filter(pk=instance.pk).exclude(status__in=GiftRedemption.REFUNDED_STATUSES)
+        .values_list('user_id', 'gift__points_cost').first()
+    )
+    if order:
+        PointsTransaction.record(order[0], order[1], 'redemption_refund')
 
 
 class BroadcastMessage(models.Model):
@@ -627,6 +992,8 @@ class BroadcastMessage(models.Model):
         blank=True,
         help_text='Ixtiyoriy. Rasm qo\'shilsa, xabar caption sifatida yuboriladi. HTML formatlash va havolalar qo\'llab-quvvatlanadi.'
     )
+    # file_id фото в Telegram: фото загружается при первой отправке, остальным — по file_id
+    image_file_id = models.CharField(max_length=255, blank=True, default='', verbose_name='Rasm file_id (Telegram)')
     user_type_filter = models.CharField(
         max_length=20,
         choices=TelegramUser.USER_TYPE_CHOICES,
@@ -681,6 +1048,9 @@ class BroadcastMessage(models.Model):
     total_users = models.IntegerField(default=0, verbose_name='Jami foydalanuvchilar')
     sent_count = models.IntegerField(default=0, verbose_name='Yuborildi')
     failed_count = models.IntegerField(default=0, verbose_name='Xatolar')
+    # Повторы отправки: все (флуд-контроль, ошибки сервера Telegram и сети) и ответы 429
+    retry_count = models.IntegerField(default=0, verbose_name='Qayta yuborishlar')
+    flood_wait_count = models.IntegerField(default=0, verbose_name='Telegram cheklovlari (429)')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Yaratilgan')
     started_at = models.DateTimeField(null=True, blank=True, verbose_name='Yuborish boshlangan')
     completed_at = models.DateTimeField(null=True, blank=True, verbose_name='Yakunlangan')
@@ -720,6 +1090,7 @@ class RegionMessageLog(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Запущена')
     completed_at = models.DateTimeField(null=True, blank=True, verbose_name='Завершена')
     error_message = models.TextField(blank=True, verbose_name='Сообщение об ошибке')
+    image_file_id = models.CharField(max_length=255, blank=True, default='', verbose_name='file_id изображения в Telegram')
 
     class Meta:
         verbose_name = _('Лог рассылки по области')
@@ -806,13 +1177,27 @@ class QRCodeGeneration(models.Model):
         blank=True,
         verbose_name='ZIP fayl'
     )
-    qr_codes = models.ManyToManyField(
-        QRCode,
-        related_name='generations',
+    error_message = models.TextField(blank=True, verbose_name='Xatolik xabari')
+    # Прогресс: батчи выполняются параллельно (chord), каждый отмечается здесь в своей транзакции
+    generated_count = models.IntegerField(default=0, verbose_name='Yaratilgan')
+    completed_batches = models.JSONField(default=list, blank=True, verbose_name='Yakunlangan partiyalar')
+    # Excel-выгрузка больших генераций готовится Celery-задачей (core/code_export.py)
+    export_status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
         blank=True,
-        verbose_name='QR-kodlar'
+        verbose_name='Eksport holati'
+    )
+    export_progress = models.IntegerField(default=0, verbose_name='Eksport qilingan')
+    # Обновляется при запуске и с каждым прогрессом: задача, упавшая без ответа (kill, лимит
+    # времени), не блокирует новую выгрузку дольше QR_CODE_EXPORT_STALE_SECONDS
+    export_updated_at = models.DateTimeField(null=True, blank=True, verbose_name='Eksport yangilangan vaqt')
+    export_file = models.FileField(
+        upload_to='qrcodes/exports/',
+        null=True,
+        blank=True,
+        verbose_name='Excel fayl'
     )
-    error_message = models.TextField(blank=True, verbose_name='Xatolik xabari')
     created_by = models.ForeignKey(
         'auth.User',
         on_delete=models.SET_NULL,
@@ -836,15 +1221,55 @@ class QRCodeGeneration(models.Model):
     
     def __str__(self):
         return f"{self.get_code_type_display()} - {self.quantity} ta ({self.get_status_display()})"
+    
+    @staticmethod
+    def export_stale_before():
+        """Выгрузка без обновлений с этого момента считается прерванной."""
+        from datetime import timedelta
+        from django.conf import settings
+        return timezone.now() - timedelta(seconds=settings.QR_CODE_EXPORT_STALE_SECONDS)
+    
+    def export_in_progress(self):
+        """Идет ли выгрузка в Excel (и не прервана ли она без обновления статуса)."""
+        return (
+            self.export_status in ('pending', 'processing')
+            and self.export_updated_at is not None
+            and self.export_updated_at >= self.export_stale_before()
+        )
+    
+    def mark_batch_completed(self, batch_number, count):
+        """
+        Отмечает батч выполненным. Вызывать в транзакции батча после создания кодов:
+        строка генерации блокируется до коммита, поэтому повторный запуск того же батча
+        (retry, повторная доставка задачи) увидит отметку.
+        
+        Returns:
+            bool: False — батч уже выполнен другим запуском (транзакцию нужно откатить)
+        """
+        completed = (
+            QRCodeGeneration.objects.select_for_update()
+            .values_list('completed_batches', flat=True).get(pk=self.pk)
+        )
+        if batch_number in completed:
+            return False
+        # update() вместо save(): без записи в историю на каждый батч
+        QRCodeGeneration.objects.filter(pk=self.pk).update(
+            completed_batches=completed + [batch_number],
+            generated_count=models.F('generated_count') + count,
+        )
+        return True
 
 
 class PromoCodeAttempt(models.Model):
     """
-    Лог попыток ввода промокода (короткий код / hash) пользователем.
+    Журнал попыток ввода промокода (короткий код / hash) и сканирования QR-кодов.
+    
+    Одна запись на попытку: qr_code заполнен, если код найден (успешная активация,
+    уже использованный код или код другого типа). Пишется через буфер (core/scan_log.py).
     
     Используется для:
     - анализа подозрительной активности (возможный мошенник)
-    - применения алгоритма блокировки по неверным вводам
+    - истории сканирований QR-кода в админке
     """
     SOURCE_CHOICES = [
         ('bot', 'Telegram bot'),
@@ -858,13 +1283,22 @@ class PromoCodeAttempt(models.Model):
         related_name='promo_code_attempts',
         verbose_name='Foydalanuvchi',
     )
+    qr_code = models.ForeignKey(
+        QRCode,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='promo_code_attempts',
+        verbose_name='QR-kod',
+    )
     raw_code = models.CharField(
         max_length=255,
         blank=True,
         verbose_name='Kiritilgan promokod',
         help_text='Foydalanuvchi kiritgan asl matn (kod mavjud bo‘lmasligi mumkin)',
     )
-    attempted_at = models.DateTimeField(auto_now_add=True, verbose_name='Urinish vaqti')
+    # Время задаётся при вводе: запись создаётся позже, при сбросе буфера
+    attempted_at = models.DateTimeField(default=timezone.now, editable=False, verbose_name='Urinish vaqti')
     is_successful = models.BooleanField(default=False, verbose_name='Muvaffaqiyatli')
     source = models.CharField(
         max_length=20,
@@ -882,8 +1316,19 @@ class PromoCodeAttempt(models.Model):
             models.Index(fields=['attempted_at']),
             models.Index(fields=['source']),
             models.Index(fields=['is_successful']),
+            models.Index(fields=['user', 'attempted_at']),
         ]
     
+    @classmethod
+    def log(cls, user_id, raw_code, is_successful, source, qr_code=None):
+        """Добавляет попытку в журнал через буфер (запись в БД батчами, см. core/scan_log.py)."""
+        from core import scan_log
+
+        scan_log.record(
+            user_id, raw_code, is_successful, source,
+            qr_code_id=qr_code.pk if qr_code is not None else None,
+        )
+
     def __str__(self):
         status = '✅' if self.is_successful else '❌'
         src = dict(self.SOURCE_CHOICES).get(self.source, self.source)
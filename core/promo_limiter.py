@@ -0,0 +1,129 @@
+"""
+Ограничение неверных вводов промокода (Redis).
+
+Правила прежние: 3 неверных подряд ИЛИ 3 неверных за текущий день → блокировка на 1 день;
+верный ввод обнуляет счётчик «подряд». Состояние хранится в Redis, проверка и учёт
+попытки — один Lua-скрипт (атомарно, без запросов к БД):
+- promo:{user_id}:block — время окончания блокировки (ключ живёт до конца блокировки);
+- promo:{user_id}:consecutive — неверные подряд;
+- promo:{user_id}:daily — ZSET неверных попыток, окно обрезается по началу текущего дня;
+  попытки во время блокировки тоже учитываются (как в прежнем подсчёте по журналу попыток).
+
+Журнал PromoCodeAttempt пишется через буфер (core/scan_log.py) и на блокировку не влияет.
+Если Redis недоступен, ограничение не применяется (ошибка пишется в лог).
+"""
+import logging
+import time
+import uuid
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# KEYS: block, consecutive, daily
+# ARGV: now, day_start, limit, block_seconds, member
+# Попытка во время блокировки учитывается в дневном лимите (как раньше по журналу попыток),
+# но не в счётчике «подряд» и не продлевает блокировку
+_REGISTER_FAILURE_LUA = """
+local now = tonumber(ARGV[1])
+local limit = tonumber(ARGV[3])
+local block_seconds = tonumber(ARGV[4])
+redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', '(' .. ARGV[2])
+redis.call('ZADD', KEYS[3], now, ARGV[5])
+redis.call('EXPIRE', KEYS[3], 2 * 86400)
+local blocked_until = redis.call('GET', KEYS[1])
+if blocked_until then
+    return blocked_until
+end
+local daily = redis.call('ZCARD', KEYS[3])
+local consecutive = redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], 30 * 86400)
+if daily >= limit or consecutive >= limit then
+    blocked_until = tostring(now + block_seconds)
+    redis.call('SET', KEYS[1], blocked_until, 'EX', block_seconds)
+    redis.call('DEL', KEYS[2])
+    return blocked_until
+end
+return false
+"""
+
+_client = None
+_register_failure_script = None
+
+
+def _get_client():
+    global _client, _register_failure_script
+    if _client is None:
+        import redis
+        _client = redis.Redis.from_url(
+            settings.PROMO_LIMITER_REDIS_URL,
+            socket_connect_timeout=0.5,
+            socket_timeout=0.5,
+        )
+        _register_failure_script = _client.register_script(_REGISTER_FAILURE_LUA)
+    return _client
+
+
+def _keys(user_id):
+    # {user_id} — hash tag: ключи одного пользователя в одном слоте Redis Cluster
+    prefix = f'promo:{{{user_id}}}'
+    return f'{prefix}:block', f'{prefix}:consecutive', f'{prefix}:daily'
+
+
+def _to_datetime(value):
+    return datetime.fromtimestamp(int(float(value)), tz=dt_timezone.utc)
+
+
+def blocked_until(user_id):
+    """Время окончания блокировки или None, если пользователь не заблокирован."""
+    try:
+        value = _get_client().get(_keys(user_id)[0])
+    except Exception as e:
+        logger.error(f"[promo_limiter] Redis недоступен, блокировка не проверена: {e}")
+        return None
+    return _to_datetime(value) if value else None
+
+
+def register_failure(user_id):
+    """
+    Учитывает неверную попытку.
+
+    Returns:
+        datetime | None: время окончания блокировки, если пользователь заблокирован
+    """
+    now = int(time.time())
+    day_start = int(timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+    try:
+        _get_client()
+        value = _register_failure_script(
+            keys=_keys(user_id),
+            args=[
+                now,
+                day_start,
+                settings.PROMO_MAX_FAILED_ATTEMPTS,
+                settings.PROMO_BLOCK_SECONDS,
+                f'{now}:{uuid.uuid4().hex[:8]}',
+            ],
+        )
+    except Exception as e:
+        logger.error(f"[promo_limiter] Redis недоступен, попытка не учтена: {e}")
+        return None
+    return _to_datetime(value) if value else None
+
+
+def register_success(user_id):
+    """Верный ввод: обнуляет счётчик неверных попыток подряд."""
+    try:
+        _get_client().delete(_keys(user_id)[1])
+    except Exception as e:
+        logger.error(f"[promo_limiter] Redis недоступен, счётчик не сброшен: {e}")
+
+
+def reset(user_id):
+    """Снимает блокировку и обнуляет все счётчики (ручная разблокировка из админки)."""
+    try:
+        _get_client().delete(*_keys(user_id))
+    except Exception as e:
+        logger.error(f"[promo_limiter] Redis недоступен, блокировка не снята: {e}")
@@ -0,0 +1,208 @@
+"""
+Буфер журнала попыток ввода промокода (PromoCodeAttempt), запись с отложенным сбросом.
+
+record() после коммита транзакции кладёт событие в список Redis (RPUSH, без запроса к БД).
+Celery-задача flush_scan_events переносит события в БД батчами bulk_create:
+- каждые SCAN_LOG_FLUSH_INTERVAL секунд (celery beat);
+- сразу, когда в буфере набралось SCAN_LOG_BATCH_SIZE событий.
+
+Буфер живёт в Redis и переживает падение бота/webapp/воркера. Батч сначала атомарно
+переносится в список «в обработке» и удаляется только после записи в БД, поэтому при падении
+воркера он будет записан при следующем сбросе (возможен повтор, потерь нет).
+Если батч не записывается целиком, он пишется половинами; события, которые не удалось записать
+даже поодиночке, переносятся в список DEAD_KEY и сброс не блокируют.
+Если Redis недоступен или SCAN_LOG_BATCH_SIZE=0, событие пишется в БД сразу.
+"""
+import json
+import logging
+from functools import partial
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+BUFFER_KEY = 'scan_events'
+PROCESSING_KEY = 'scan_events:processing'
+DEAD_KEY = 'scan_events:dead'
+LOCK_KEY = 'scan_events:lock'
+LOCK_TTL = 300
+
+# KEYS: буфер, в обработке; ARGV: размер батча
+_TAKE_BATCH_LUA = """
+local items = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #items > 0 then
+    redis.call('LTRIM', KEYS[1], #items, -1)
+    redis.call('RPUSH', KEYS[2], unpack(items))
+end
+return items
+"""
+
+_client = None
+_take_batch_script = None
+
+
+def _get_client():
+    global _client, _take_batch_script
+    if _client is None:
+        import redis
+        _client = redis.Redis.from_url(
+            settings.SCAN_LOG_REDIS_URL,
+            socket_connect_timeout=0.5,
+            socket_timeout=0.5,
+        )
+        _take_batch_script = _client.register_script(_TAKE_BATCH_LUA)
+    return _client
+
+
+def _raw_code_max_length():
+    from .models import PromoCodeAttempt
+    return PromoCodeAttempt._meta.get_field('raw_code').max_length
+
+
+def record(user_id, raw_code, is_successful, source, qr_code_id=None):
+    """Добавляет событие в журнал (после коммита текущей транзакции)."""
+    event = {
+        'user_id': user_id,
+        'qr_code_id': qr_code_id,
+        # Текст от пользователя может быть длиннее поля (сообщение Telegram — до 4096 символов)
+        'raw_code': (raw_code or "")[:_raw_code_max_length()],
+        'is_successful': is_successful,
+        'source': source,
+        'attempted_at': timezone.now().isoformat(),
+    }
+    transaction.on_commit(partial(_push, event))
+
+
+def _push(event):
+    batch_size = settings.SCAN_LOG_BATCH_SIZE
+    if batch_size <= 0:
+        _write([event])
+        return
+    try:
+        length = _get_client().rpush(BUFFER_KEY, json.dumps(event))
+    except Exception as e:
+        logger.warning(f"[scan_log] Redis недоступен, событие записано сразу: {e}")
+        _write([event])
+        return
+    if length == batch_size:
+        from .tasks import flush_scan_events
+        try:
+            flush_scan_events.delay()
+        except Exception as e:
+            # Буфер сбросит периодическая задача
+            logger.warning(f"[scan_log] Не удалось поставить сброс буфера в очередь: {e}")
+
+
+def _write(events):
+    """
+    Записывает события в БД (пропуская удалённых пользователей).
+
+    Returns:
+        tuple: (количество записанных событий, список событий, которые записать не удалось)
+    """
+    from .models import PromoCodeAttempt, QRCode, TelegramUser
+
+    if not events:
+        return 0, []
+    user_ids = set(TelegramUser.objects.filter(
+        id__in={e['user_id'] for e in events}
+    ).values_list('id', flat=True))
+    qr_code_ids = set(QRCode.objects.filter(
+        id__in={e['qr_code_id'] for e in events if e['qr_code_id']}
+    ).values_list('id', flat=True))
+    max_length = _raw_code_max_length()
+    rows = [
+        (e, PromoCodeAttempt(
+            user_id=e['user_id'],
+            qr_code_id=e['qr_code_id'] if e['qr_code_id'] in qr_code_ids else None,
+            # События, попавшие в буфер до обрезки в record()
+            raw_code=(e['raw_code'] or "")[:max_length],
+            attempted_at=parse_datetime(e['attempted_at']),
+            is_successful=e['is_successful'],
+            source=e['source'],
+        ))
+        for e in events
+        if e['user_id'] in user_ids
+    ]
+    return _bulk_create(rows)
+
+
+def _bulk_create(rows):
+    """bulk_create пар (событие, PromoCodeAttempt); при ошибке БД пишет батч половинами."""
+    from .models import PromoCodeAttempt
+
+    if not rows:
+        return 0, []
+    try:
+        with transaction.atomic():
+            PromoCodeAttempt.objects.bulk_create([attempt for _, attempt in rows])
+        return len(rows), []
+    except DatabaseError as e:
+        if len(rows) == 1:
+            logger.error(f"[scan_log] Событие не записано: {e}; {rows[0][0]}")
+            return 0, [rows[0][0]]
+    middle = len(rows) // 2
+    written_left, failed_left = _bulk_create(rows[:middle])
+    written_right, failed_right = _bulk_create(rows[middle:])
+    return written_left + written_right, failed_left + failed_right
+
+
+def flush(batch_size=None):
+    """
+    Переносит накопленные события в БД.
+
+    Returns:
+        int: количество записанных событий
+    """
+    from redis.exceptions import LockError
+
+    batch_size = batch_size or settings.SCAN_LOG_BATCH_SIZE or 500
+    client = _get_client()
+    # Блокировка с токеном: снять ее может только владелец, даже если сброс дольше LOCK_TTL
+    lock = client.lock(LOCK_KEY, timeout=LOCK_TTL)
+    if not lock.acquire(blocking=False):
+        return 0  # буфер уже сбрасывает другой воркер
+    written = 0
+    try:
+        while True:
+            # Перед каждым батчем продлеваем блокировку; если она истекла и ее взял другой
+            # воркер — прекращаем, чтобы не писать батчи параллельно
+            lock.reacquire()
+            # Батч, не записанный из-за падения предыдущего сброса, — первым
+            items = client.lrange(PROCESSING_KEY, 0, -1)
+            recovered = bool(items)
+            if not recovered:
+                items = _take_batch_script(keys=[BUFFER_KEY, PROCESSING_KEY], args=[batch_size])
+            if not items:
+                break
+            batch_written, failed = _write([json.loads(item) for item in items])
+            written += batch_written
+            pipe = client.pipeline()
+            if failed:
+                # Иначе батч повторялся бы при каждом сбросе и блокировал бы весь буфер
+                pipe.rpush(DEAD_KEY, *[json.dumps(event) for event in failed])
+            pipe.delete(PROCESSING_KEY)
+            pipe.execute()
+            if failed:
+                logger.error(f"[scan_log] Не записано событий: {len(failed)}, перенесены в {DEAD_KEY}")
+            if not recovered and len(items) < batch_size:
+                break
+    except LockError as e:
+        logger.warning(f"[scan_log] Блокировка сброса потеряна, сброс прерван: {e}")
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            pass
+    if written:
+        logger.info(f"[scan_log] Записано событий: {written}")
+    return written
+
+
+def pending():
+    """Количество событий в буфере (для мониторинга)."""
+    client = _get_client()
+    return client.llen(BUFFER_KEY) + client.llen(PROCESSING_KEY)
@@ -0,0 +1,223 @@
+"""
+Общий лимит отправки сообщений ботом (token bucket) и параллельная отправка.
+
+Telegram ограничивает рассылку бота ~30 сообщениями в секунду суммарно, поэтому лимит
+общий для всех рассылок и всех воркеров Celery: корзина токенов хранится в Redis
+(TELEGRAM_RATE_LIMIT_REDIS_URL), выдача токена — один Lua-скрипт по часам Redis.
+Корзина пополняется со скоростью TELEGRAM_BROADCAST_RATE токенов в секунду, вмещает
+TELEGRAM_BROADCAST_BURST токенов (1 — равномерный темп, без всплесков).
+
+send_concurrently() держит до TELEGRAM_BROADCAST_CONCURRENCY отправок одновременно: задержка
+ответа Telegram и запись в БД больше не складываются с паузой между сообщениями.
+Если Redis недоступен, лимит соблюдается только внутри процесса (ошибка пишется в лог).
+Флуд-контроль Telegram (429 retry_after) приостанавливает отправку всех процессов, ошибки
+сервера и сети повторяются с экспоненциальной задержкой (retry_delay).
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+BUCKET_KEY = 'telegram:send_bucket'
+REDIS_RETRY_SECONDS = 10
+RETRY_MAX_DELAY = 60
+
+_DONE = object()
+
+# Токены выдаются как слоты времени (GCRA): следующий слот — через 1/скорость после предыдущего,
+# не раньше чем «сейчас − (емкость − 1)/скорость». Отправитель ждет свой слот сам, поэтому
+# опоздавшее пробуждение одного отправителя не сдвигает слоты остальных и темп не теряется.
+# KEYS: время следующего слота; ARGV: скорость (токенов/с), емкость
+# Возвращает, сколько секунд ждать до выданного слота (0 — отправлять сразу)
+_TAKE_TOKEN_LUA = """
+local interval = 1 / tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local slot = math.max(tonumber(redis.call('GET', KEYS[1])) or 0, now - (capacity - 1) * interval)
+redis.call('SET', KEYS[1], tostring(slot + interval), 'EX', math.ceil(slot - now) + 60)
+return tostring(math.max(0, slot - now))
+"""
+
+# Пауза всех отправителей (Telegram ответил 429 Too Many Requests): следующий слот — не раньше
+# чем через ARGV[1] секунд. KEYS: время следующего слота
+_PAUSE_LUA = """
+local time = redis.call('TIME')
+local resume = tonumber(time[1]) + tonumber(time[2]) / 1000000 + tonumber(ARGV[1])
+if (tonumber(redis.call('GET', KEYS[1])) or 0) < resume then
+    redis.call('SET', KEYS[1], tostring(resume), 'EX', math.ceil(tonumber(ARGV[1])) + 60)
+end
+return 1
+"""
+
+
+class TokenBucket:
+    """Корзина токенов в памяти процесса (запасной вариант без Redis)."""
+
+    def __init__(self, rate, capacity):
+        self.interval = 1.0 / rate
+        self.capacity = capacity
+        self.next_slot = 0.0
+
+    async def take(self):
+        now = time.monotonic()
+        slot = max(self.next_slot, now - (self.capacity - 1) * self.interval)
+        self.next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def pause(self, seconds):
+        self.next_slot = max(self.next_slot, time.monotonic() + seconds)
+
+    async def close(self):
+        pass
+
+
+class RedisTokenBucket:
+    """Корзина токенов в Redis, общая для всех процессов."""
+
+    def __init__(self, rate, capacity, url=None, key=BUCKET_KEY):
+        import redis.asyncio
+
+        self.rate = rate
+        self.capacity = capacity
+        self.key = key
+        self._client = redis.asyncio.Redis.from_url(
+            url or settings.TELEGRAM_RATE_LIMIT_REDIS_URL,
+            socket_connect_timeout=1,
+            socket_timeout=1,
+        )
+        self._script = self._client.register_script(_TAKE_TOKEN_LUA)
+        self._pause_script = self._client.register_script(_PAUSE_LUA)
+        # Слоты запрашиваются по одному: одно соединение с Redis на процесс
+        self._lock = asyncio.Lock()
+        # Пока Redis недоступен, токены выдает локальная корзина; Redis проверяется снова
+        # через REDIS_RETRY_SECONDS
+        self._fallback = TokenBucket(rate, capacity)
+        self._redis_retry_at = 0
+
+    async def take(self):
+        if time.monotonic() >= self._redis_retry_at:
+            try:
+                async with self._lock:
+                    wait = float(await self._script(keys=[self.key], args=[self.rate, self.capacity]))
+            except Exception as e:
+                # Параллельные отправки могут получить ошибку одновременно — пишем в лог один раз
+                if time.monotonic() >= self._redis_retry_at:
+                    logger.error(f"[send_rate] Redis недоступен, лимит только внутри процесса: {e}")
+                    self._redis_retry_at = time.monotonic() + REDIS_RETRY_SECONDS
+            else:
+                if wait:
+                    await asyncio.sleep(wait)
+                return
+        await self._fallback.take()
+
+    async def pause(self, seconds):
+        await self._fallback.pause(seconds)
+        if time.monotonic() >= self._redis_retry_at:
+            try:
+                async with self._lock:
+                    await self._pause_script(keys=[self.key], args=[seconds])
+            except Exception as e:
+                logger.error(f"[send_rate] Не удалось приостановить отправку в Redis: {e}")
+
+    async def close(self):
+        await self._client.aclose()
+
+
+def make_bucket():
+    """Общая корзина отправки бота по настройкам."""
+    return RedisTokenBucket(settings.TELEGRAM_BROADCAST_RATE, settings.TELEGRAM_BROADCAST_BURST)
+
+
+def retry_delay(error, attempt):
+    """
+    Через сколько секунд повторить отправку после ошибки или None, если повторять не нужно.
+
+    Флуд-контроль Telegram (429) — через retry_after; ошибки сервера Telegram (5xx) и сети —
+    экспоненциально: TELEGRAM_SEND_RETRY_BASE_DELAY × 2^attempt (со случайным разбросом),
+    не больше RETRY_MAX_DELAY.
+    """
+    if isinstance(error, TelegramRetryAfter):
+        return error.retry_after
+    if isinstance(error, (TelegramServerError, TelegramNetworkError)):
+        delay = min(RETRY_MAX_DELAY, settings.TELEGRAM_SEND_RETRY_BASE_DELAY * 2 ** attempt)
+        return delay * random.uniform(0.5, 1)
+    return None
+
+
+async def send_concurrently(items, send, concurrency=None, bucket=None, on_result=None, on_retry=None):
+    """
+    Отправляет по элементу items через send(item) параллельно, не превышая общий лимит.
+
+    Если send() выбрасывает TelegramRetryAfter, отправка всех процессов приостанавливается на
+    retry_after (bucket.pause), а получатель возвращается в очередь. При ошибках сервера Telegram
+    и сети получатель повторяется с экспоненциальной задержкой. После TELEGRAM_SEND_MAX_RETRIES
+    повторов отправка считается неудачной.
+
+    Args:
+        items: итерируемый список получателей
+        send: корутина send(item) -> (успешно, ошибка)
+        concurrency: одновременных отправок (по умолчанию TELEGRAM_BROADCAST_CONCURRENCY)
+        bucket: корзина токенов (по умолчанию — общая в Redis, закрывается по окончании)
+        on_result: корутина on_result(item, success, error) после каждой отправки
+        on_retry: корутина on_retry(item, error, delay) перед каждым повтором
+
+    Returns:
+        tuple: (отправлено, ошибок)
+    """
+    concurrency = concurrency or settings.TELEGRAM_BROADCAST_CONCURRENCY
+    max_retries = settings.TELEGRAM_SEND_MAX_RETRIES
+    own_bucket = bucket is None
+    bucket = bucket or make_bucket()
+    iterator = iter(items)
+    # Повторы: куча (время готовности, порядковый номер, попытка, получатель)
+    retries = []
+    sequence = itertools.count()
+    counts = {'sent': 0, 'failed': 0}
+
+    async def worker():
+        while True:
+            # Сначала — готовые повторы, затем новые получатели из общего итератора
+            if retries and retries[0][0] <= time.monotonic():
+                _, _, attempt, item = heapq.heappop(retries)
+            else:
+                item, attempt = next(iterator, _DONE), 0
+                if item is _DONE:
+                    if not retries:
+                        return
+                    await asyncio.sleep(max(0, retries[0][0] - time.monotonic()))
+                    continue
+
+            await bucket.take()
+            try:
+                success, error = await send(item)
+            except Exception as e:
+                delay = retry_delay(e, attempt)
+                if delay is not None and attempt < max_retries:
+                    if isinstance(e, TelegramRetryAfter):
+                        logger.warning(f"[send_rate] Флуд-контроль Telegram, пауза {e.retry_after} с")
+                        await bucket.pause(e.retry_after)
+                    heapq.heappush(retries, (time.monotonic() + delay, next(sequence), attempt + 1, item))
+                    if on_retry:
+                        await on_retry(item, e, delay)
+                    continue
+                logger.error(f"[send_rate] Ошибка при отправке: {e}")
+                success, error = False, str(e)
+            counts['sent' if success else 'failed'] += 1
+            if on_result:
+                await on_result(item, success, error)
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    finally:
+        if own_bucket:
+            await bucket.close()
+    return counts['sent'], counts['failed']
@@ -2,106 +2,144 @@
 Celery tasks for core app.
 """
 import os
-import zipfile
 import asyncio
 import logging
-from celery import shared_task, chain
+from celery import shared_task, chord
 from django.conf import settings
+from django.db.models import F
 from django.utils import timezone
 from aiogram import Bot
 from .models import QRCode, QRCodeGeneration, BroadcastMessage, TelegramUser
-from .utils import generate_qr_code_image, generate_qr_codes_batch, generate_qr_code_images_batch
-from .messaging import send_message_to_user, TELEGRAM_MESSAGE_DELAY
+from .utils import generate_qr_code_image, generate_qr_codes_batch, generate_qr_code_images_batch, generate_missing_images
+from .messaging import send_to_users, stored_photo
 
 logger = logging.getLogger(__name__)
 
 
-@shared_task(bind=True)
+@shared_task(bind=True, max_retries=3, default_retry_delay=10)
 def generate_qr_codes_batch_task(self, prev_result=None, **kwargs):
     """
     Генерирует один батч QR-кодов.
     
+    Батчи одной генерации выполняются параллельно (chord). Коды батча и отметка о его
+    выполнении (QRCodeGeneration.completed_batches) пишутся в одной транзакции, поэтому
+    повторный запуск (retry после ошибки, повторная доставка) не создаёт коды заново.
+    
     Args:
         prev_result: Результат предыдущей задачи в цепочке (если есть)
         **kwargs: Может содержать generation_id, batch_start, batch_size
     """
+    from django.db import transaction
+    
+    # Параметры батча — из kwargs, для старых цепочек — из результата предыдущей задачи
+    if prev_result and isinstance(prev_result, dict):
+        kwargs = {**prev_result, **kwargs}
+    generation_id = kwargs.get('generation_id')
+    batch_start = kwargs.get('batch_start')
+    batch_size = kwargs.get('batch_size')
+    
+    # Проверяем, что все необходимые параметры есть
+    if generation_id is None:
+        raise ValueError("generation_id должен быть передан")
+    if batch_start is None:
+        raise ValueError("batch_start должен быть передан")
+    if batch_size is None:
+        raise ValueError("batch_size должен быть передан")
+    
+    batch_number = batch_start // batch_size
     try:
-        # Если есть результат предыдущей задачи, извлекаем параметры из него
-        if prev_result and isinstance(prev_result, dict):
-            generation_id = prev_result.get('generation_id') or kwargs.get('generation_id')
-            batch_start = prev_result.get('batch_start') or kwargs.get('batch_start')
-            batch_size = prev_result.get('batch_size') or kwargs.get('batch_size')
-        else:
-            # Иначе используем параметры из kwargs
-            generation_id = kwargs.get('generation_id')
-            batch_start = kwargs.get('batch_start')
-            batch_size = kwargs.get('batch_size')
-        
-        # Проверяем, что все необходимые параметры есть
-        if generation_id is None:
-            raise ValueError("generation_id должен быть передан")
-        if batch_start is None:
-            raise ValueError("batch_start должен быть передан")
-        if batch_size is None:
-            raise ValueError("batch_size должен быть передан")
-        
         generation = QRCodeGeneration.objects.get(id=generation_id)
-        
-        # Генерируем QR-коды для этого батча
-        qr_codes = []
         batch_end = min(batch_start + batch_size, generation.quantity)
+        result = {
+            'generation_id': generation_id,
+            'batch_start': batch_start,
+            'batch_end': batch_end,
+            'generated': 0,
+        }
         
-        # Сначала создаем все QR-коды в БД
-        for i in range(batch_start, batch_end):
-            qr_code = QRCode.create_code(
+        if batch_number in generation.completed_batches:
+            logger.info(f"Батч {batch_number} генерации {generation_id} уже выполнен, пропускаем")
+            return result
+        
+        with transaction.atomic():
+            # Создаем все QR-коды батча одной пачкой (без запросов на каждый код)
+            qr_codes = QRCode.bulk_create_codes(
                 code_type=generation.code_type,
-                points=generation.points
+                count=batch_end - batch_start,
+                points=generation.points,
+                generation=generation
             )
-            qr_codes.append(qr_code)
-        
-        # Затем генерируем изображения батчем (переиспользуя один браузер)
-        # Это значительно эффективнее, чем создавать браузер для каждого QR-кода
-        # ВРЕМЕННО ЗАКОММЕНТИРОВАНО
-        # try:
-        #     generate_qr_code_images_batch(qr_codes)
-        # except Exception as e:
-        #     logger.error(f"Ошибка при генерации изображений для батча {batch_start}-{batch_end}: {e}")
-        #     # Если батчевая генерация не удалась, пробуем по одному
-        #     logger.info(f"Пробуем генерировать изображения по одному...")
-        #     for qr_code in qr_codes:
-        #         try:
-        #             generate_qr_code_image(qr_code)
-        #         except Exception as img_error:
-        #             logger.error(f"Ошибка при генерации изображения для QR-кода {qr_code.code}: {img_error}")
-        #             # Продолжаем с другими QR-кодами даже если один не удался
-        
-        # Добавляем QR-коды к генерации
-        generation.qr_codes.add(*qr_codes)
+            
+            if not generation.mark_batch_completed(batch_number, len(qr_codes)):
+                # Тот же батч параллельно выполнил другой запуск — откатываем свои коды
+                transaction.set_rollback(True)
+                logger.info(f"Батч {batch_number} генерации {generation_id} выполнен другим запуском, откат")
+                return result
+        
+        # Карточки рисуются после коммита: без открытой транзакции и блокировки строки генерации,
+        # в процессе воркера (параллельность — число воркеров Celery). Если отрисовка прервется,
+        # недостающие карточки нарисует завершение генерации (_complete_generation)
+        try:
+            generate_qr_code_images_batch(qr_codes, workers=1)
+        except Exception as e:
+            logger.error(f"Карточки батча {batch_number} генерации {generation_id} не нарисованы: {e}")
         
         logger.info(
             f"Батч QR-кодов для генерации {generation_id}: "
             f"сгенерировано {len(qr_codes)} кодов (индексы {batch_start}-{batch_end-1})"
         )
-        
-        return {
-            'generation_id': generation_id,
-            'batch_start': batch_start,
-            'batch_end': batch_end,
-            'generated': len(qr_codes)
-        }
+        result['generated'] = len(qr_codes)
+        return result
         
     except QRCodeGeneration.DoesNotExist:
         logger.error(f"Генерация {generation_id} не найдена")
         return {'error': f'Generation {generation_id} not found'}
     except Exception as e:
-        logger.error(f"Ошибка при генерации батча QR-кодов: {e}")
+        logger.error(f"Ошибка при генерации батча {batch_number} генерации {generation_id}: {e}")
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e)
+        # Повторы исчерпаны: chord не вызовет завершение, отмечаем ошибку здесь
+        QRCodeGeneration.objects.filter(id=generation_id).update(
+            status='failed',
+            error_message=f"Батч {batch_number}: {e}",
+        )
         raise
 
 
+def _complete_generation(generation):
+    """
+    Отмечает генерацию завершенной.
+    
+    ZIP архив заранее не собирается: админка отдает его потоком (core/zip_stream.py),
+    поэтому завершение не зависит от количества кодов. Карточки, не нарисованные батчами,
+    рисуются здесь.
+    """
+    generated = generation.qr_codes.count()
+    if not generated:
+        generation.status = 'failed'
+        generation.error_message = 'Не было сгенерировано ни одного QR-кода'
+        generation.save(update_fields=['status', 'error_message'])
+        return {'error': 'No QR codes generated'}
+    
+    rendered = generate_missing_images(generation, workers=1)
+    if rendered:
+        logger.info(f"Генерация {generation.id}: дорисовано карточек: {rendered}")
+    
+    generation.status = 'completed'
+    generation.completed_at = timezone.now()
+    generation.save(update_fields=['status', 'completed_at'])
+    
+    logger.info(f"Генерация QR-кодов {generation.id} завершена: сгенерировано {generated} кодов")
+    return {
+        'generation_id': generation.id,
+        'total_generated': generated,
+    }
+
+
 @shared_task(bind=True)
 def finalize_qr_generation_task(self, prev_result=None, **kwargs):
     """
-    Завершает генерацию QR-кодов и создает ZIP архив.
+    Завершает генерацию QR-кодов (после всех батчей).
     
     Args:
         prev_result: Результат предыдущей задачи в цепочке (если есть)
@@ -119,50 +157,7 @@ def finalize_qr_generation_task(self, prev_result=None, **kwargs):
             raise ValueError("generation_id должен быть передан")
         
         generation = QRCodeGeneration.objects.get(id=generation_id)
-        
-        # Получаем все QR-коды для этой генерации
-        qr_codes = list(generation.qr_codes.all())
-        
-        if not qr_codes:
-            generation.status = 'failed'
-            generation.error_message = 'Не было сгенерировано ни одного QR-кода'
-            generation.save(update_fields=['status', 'error_message'])
-            return {'error': 'No QR codes generated'}
-        
-        # Создаем ZIP архив
-        qr_dir = os.path.join(settings.MEDIA_ROOT, 'qrcodes')
-        zip_filename = f"qrcodes_{generation.id}_{timezone.now().strftime('%Y%m%d_%H%M%S')}.zip"
-        zip_path = os.path.join(settings.MEDIA_ROOT, 'qrcodes', 'generations', zip_filename)
-        
-        # Создаем директорию, если её нет
-        os.makedirs(os.path.dirname(zip_path), exist_ok=True)
-        
-        logger.info(f"Создание ZIP архива для генерации {generation_id}: {len(qr_codes)} QR-кодов")
-        
-        with zipfile.ZipFile(zip_path, 'w') as zip_file:
-            for qr_code in qr_codes:
-                if qr_code.image_path and os.path.exists(qr_code.image_path):
-                    zip_file.write(
-                        qr_code.image_path,
-                        os.path.basename(qr_code.image_path)
-                    )
-        
-        # Сохраняем путь к ZIP файлу
-        generation.zip_file.name = f"qrcodes/generations/{zip_filename}"
-        generation.status = 'completed'
-        generation.completed_at = timezone.now()
-        generation.save(update_fields=['zip_file', 'status', 'completed_at'])
-        
-        logger.info(
-            f"Генерация QR-кодов {generation_id} завершена: "
-            f"сгенерировано {len(qr_codes)} кодов, ZIP архив создан"
-        )
-        
-        return {
-            'generation_id': generation_id,
-            'total_generated': len(qr_codes),
-            'zip_file': zip_filename
-        }
+        return _complete_generation(generation)
         
     except QRCodeGeneration.DoesNotExist:
         logger.error(f"Генерация {generation_id} не найдена")
@@ -200,43 +195,13 @@ def generate_qr_codes_task(self, generation_id):
         if generation.quantity <= BATCH_SIZE:
             logger.info(f"Генерация {generation_id}: небольшое количество ({generation.quantity}), генерируем сразу")
             
-            # Генерируем QR-коды
-            qr_codes = []
-            for _ in range(generation.quantity):
-                qr_code = QRCode.create_code(
-                    code_type=generation.code_type,
-                    points=generation.points
-                )
-                # ВРЕМЕННО ЗАКОММЕНТИРОВАНО
-                # generate_qr_code_image(qr_code)
-                qr_codes.append(qr_code)
-            
-            # Сохраняем QR-коды в генерацию
-            generation.qr_codes.set(qr_codes)
-            
-            # Создаем ZIP архив
-            qr_dir = os.path.join(settings.MEDIA_ROOT, 'qrcodes')
-            zip_filename = f"qrcodes_{generation.id}_{timezone.now().strftime('%Y%m%d_%H%M%S')}.zip"
-            zip_path = os.path.join(settings.MEDIA_ROOT, 'qrcodes', 'generations', zip_filename)
-            
-            # Создаем директорию, если её нет
-            os.makedirs(os.path.dirname(zip_path), exist_ok=True)
-            
-            with zipfile.ZipFile(zip_path, 'w') as zip_file:
-                for qr_code in qr_codes:
-                    if qr_code.image_path and os.path.exists(qr_code.image_path):
-                        zip_file.write(
-                            qr_code.image_path,
-                            os.path.basename(qr_code.image_path)
-                        )
-            
-            # Сохраняем путь к ZIP файлу
-            generation.zip_file.name = f"qrcodes/generations/{zip_filename}"
-            generation.status = 'completed'
-            generation.completed_at = timezone.now()
-            generation.save(update_fields=['zip_file', 'status', 'completed_at'])
-            
-            logger.info(f"Генерация {generation_id} завершена: {generation.quantity} QR-кодов")
+            # Генерируем QR-коды одним батчем в этом же воркере (повторный запуск не создаст дубли)
+            generate_qr_codes_batch_task(
+                generation_id=generation_id,
+                batch_start=0,
+                batch_size=generation.quantity
+            )
+            _complete_generation(generation)
             return f"Successfully generated {generation.quantity} QR codes"
         else:
             # Большое количество - разбиваем на батчи
@@ -247,28 +212,26 @@ def generate_qr_codes_task(self, generation_id):
                 f"разбиваем на {total_batches} батчей по {BATCH_SIZE} кодов"
             )
             
-            # Создаем цепочку задач для батчей
-            tasks = []
-            for batch_num in range(total_batches):
-                batch_start = batch_num * BATCH_SIZE
-                # Передаем параметры как именованные аргументы
-                # При использовании chain() результат предыдущей задачи будет передан как prev_result
-                task = generate_qr_codes_batch_task.s(
+            # Батчи выполняются параллельно на всех воркерах (серийные номера и хеши
+            # резервируются независимо). Уже выполненные батчи (перезапуск) пропускаем.
+            tasks = [
+                generate_qr_codes_batch_task.s(
                     generation_id=generation_id,
-                    batch_start=batch_start,
+                    batch_start=batch_num * BATCH_SIZE,
                     batch_size=BATCH_SIZE
                 )
-                tasks.append(task)
+                for batch_num in range(total_batches)
+                if batch_num not in generation.completed_batches
+            ]
             
-            # Добавляем задачу завершения в конец цепочки
-            # Она получит generation_id из результата последней задачи батча
-            tasks.append(finalize_qr_generation_task.s(generation_id=generation_id))
-            
-            # Запускаем цепочку задач последовательно
-            chain(*tasks).apply_async()
+            # Завершение — после всех батчей
+            if tasks:
+                chord(tasks)(finalize_qr_generation_task.s(generation_id=generation_id))
+            else:
+                finalize_qr_generation_task.delay(generation_id=generation_id)
             
             logger.info(
-                f"Запущена цепочка из {total_batches + 1} задач для генерации {generation_id}"
+                f"Запущено {len(tasks)} параллельных батчей для генерации {generation_id}"
             )
             
             return {
@@ -294,6 +257,51 @@ def generate_qr_codes_task(self, generation_id):
         raise
 
 
+@shared_task(bind=True)
+def export_generation_excel_task(self, generation_id):
+    """
+    Выгружает коды большой генерации в Excel (core/code_export.py).
+    Прогресс (количество выгруженных строк) пишется в QRCodeGeneration.export_progress,
+    готовый файл — в QRCodeGeneration.export_file.
+    
+    Args:
+        generation_id: ID объекта QRCodeGeneration
+    """
+    from .code_export import write_excel
+    
+    generations = QRCodeGeneration.objects.filter(id=generation_id)
+    generation = generations.first()
+    if generation is None:
+        logger.error(f"Генерация {generation_id} не найдена")
+        return f"Generation {generation_id} not found"
+    
+    generations.update(export_status='processing', export_progress=0, export_updated_at=timezone.now())
+    filename = f"qrcodes_{generation.id}_{timezone.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    export_dir = os.path.join(settings.MEDIA_ROOT, 'qrcodes', 'exports')
+    os.makedirs(export_dir, exist_ok=True)
+    path = os.path.join(export_dir, filename)
+    try:
+        rows = write_excel(
+            generation,
+            path,
+            progress=lambda rows: generations.update(export_progress=rows, export_updated_at=timezone.now()),
+        )
+    except Exception as e:
+        # В том числе SoftTimeLimitExceeded: статус не остается «в процессе»
+        logger.error(f"Ошибка при выгрузке генерации {generation_id} в Excel: {e}")
+        generations.update(export_status='failed')
+        if os.path.exists(path):
+            os.unlink(path)
+        raise
+    
+    # Предыдущая выгрузка больше не нужна
+    if generation.export_file:
+        generation.export_file.delete(save=False)
+    generations.update(export_status='completed', export_file=f"qrcodes/exports/{filename}")
+    logger.info(f"Выгрузка генерации {generation_id} в Excel готова: {rows} строк")
+    return {'generation_id': generation_id, 'rows': rows, 'file': filename}
+
+
 @shared_task(bind=True)
 def send_broadcast_batch(self, broadcast_id, user_ids, batch_number, total_batches):
     """
@@ -318,56 +326,43 @@ def send_broadcast_batch(self, broadcast_id, user_ids, batch_number, total_batch
             except (ValueError, OSError):
                 pass
 
+        retry_stats = {'retry_count': 0, 'flood_wait_count': 0}
+
         async def send_batch():
             bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
             try:
-                sent = 0
-                failed = 0
-                
-                for i, user in enumerate(users):
-                    try:
-                        success, error = await send_message_to_user(
-                            bot=bot,
-                            user=user,
-                            text=broadcast.message_text,
-                            parse_mode='HTML',
-                            photo_path=photo_path,
-                        )
-                        
-                        if success:
-                            sent += 1
-                        else:
-                            failed += 1
-                            logger.warning(f"Не удалось отправить пользователю {user.telegram_id}: {error}")
-                        
-                        # Соблюдаем лимит Telegram API
-                        if i < len(users) - 1:
-                            await asyncio.sleep(TELEGRAM_MESSAGE_DELAY)
-                            
-                    except Exception as e:
-                        logger.error(f"Ошибка при отправке пользователю {user.telegram_id}: {e}")
-                        failed += 1
-                
-                return sent, failed
+                async def on_result(user, success, error):
+                    if not success:
+                        logger.warning(f"Не удалось отправить пользователю {user.telegram_id}: {error}")
+
+                # file_id фото сохраняется в рассылке — следующие батчи не загружают файл
+                return await send_to_users(
+                    bot, users, broadcast.message_text, parse_mode='HTML',
+                    photo=stored_photo(broadcast, photo_path), on_result=on_result, retry_stats=retry_stats,
+                )
             finally:
                 await bot.session.close()
         
         sent, failed = asyncio.run(send_batch())
         
-        # Обновляем статистику рассылки
-        broadcast.sent_count += sent
-        broadcast.failed_count += failed
-        broadcast.save(update_fields=['sent_count', 'failed_count'])
+        # Обновляем статистику рассылки (батчи выполняются параллельно — атомарно в БД)
+        BroadcastMessage.objects.filter(id=broadcast_id).update(
+            sent_count=F('sent_count') + sent,
+            failed_count=F('failed_count') + failed,
+            retry_count=F('retry_count') + retry_stats['retry_count'],
+            flood_wait_count=F('flood_wait_count') + retry_stats['flood_wait_count'],
+        )
         
         logger.info(
             f"Батч {batch_number}/{total_batches} рассылки '{broadcast.title}' завершен: "
-            f"отправлено {sent}, ошибок {failed}"
+            f"отправлено {sent}, ошибок {failed}, повторов {retry_stats['retry_count']}"
         )
         
         return {
             'batch_number': batch_number,
             'sent': sent,
-            'failed': failed
+            'failed': failed,
+            'retries': retry_stats['retry_count'],
         }
         
     except BroadcastMessage.DoesNotExist:
@@ -377,9 +372,9 @@ def send_broadcast_batch(self, broadcast_id, user_ids, batch_number, total_batch
         logger.error(f"Ошибка при отправке батча {batch_number}: {e}")
         # Обновляем статистику ошибок
         try:
-            broadcast = BroadcastMessage.objects.get(id=broadcast_id)
-            broadcast.failed_count += len(user_ids)
-            broadcast.save(update_fields=['failed_count'])
+            BroadcastMessage.objects.filter(id=broadcast_id).update(
+                failed_count=F('failed_count') + len(user_ids)
+            )
         except:
             pass
         raise
@@ -406,7 +401,6 @@ def send_region_message_task(
     Вызывается из админки при числе получателей > REGION_MESSAGE_ASYNC_THRESHOLD.
     Обновляет RegionMessageLog по завершении.
     """
-    from core.regions import get_region_by_coordinates
     from core.models import RegionMessageLog
     from django.core.files.storage import default_storage
     from django.utils import timezone
@@ -424,24 +418,9 @@ def send_region_message_task(
         except RegionMessageLog.DoesNotExist:
             pass
 
-    users_qs = TelegramUser.objects.filter(
-        latitude__isnull=False,
-        longitude__isnull=False,
-        is_active=True,
-    )
-    if user_type_filter:
-        users_qs = users_qs.filter(user_type=user_type_filter)
-    if language_filter:
-        users_qs = users_qs.filter(language=language_filter)
-
-    users = list(users_qs)
-    if region_code == 'all':
-        filtered = users
-    else:
-        filtered = [
-            u for u in users
-            if get_region_by_coordinates(u.latitude, u.longitude) == region_code
-        ]
+    filtered = list(TelegramUser.audience(
+        user_type=user_type_filter, language=language_filter, region=region_code,
+    ))
     if not filtered:
         msg = 'Нет пользователей с координатами' if region_code == 'all' else f'В области {region_code} нет пользователей'
         logger.warning('send_region_message_task: %s', msg)
@@ -457,25 +436,15 @@ def send_region_message_task(
                 tmp.write(f.read())
                 photo_path = tmp.name
     try:
+        log = RegionMessageLog.objects.filter(id=log_id).first()
+        photo = stored_photo(log, photo_path) if log else None
+
         async def _send_all():
             bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
-            sent, failed = 0, 0
             try:
-                for i, user in enumerate(filtered):
-                    success, err = await send_message_to_user(
-                        bot=bot,
-                        user=user,
-                        text=message_text or '',
-                        parse_mode='HTML',
-                        photo_path=photo_path,
-                    )
-                    if success:
-                        sent += 1
-                    else:
-                        failed += 1
-                    if i < len(filtered) - 1:
-                        await asyncio.sleep(TELEGRAM_MESSAGE_DELAY)
-                return sent, failed
+                return await send_to_users(
+                    bot, filtered, message_text or '', parse_mode='HTML', photo_path=photo_path, photo=photo,
+                )
             finally:
                 await bot.session.close()
 
@@ -506,8 +475,8 @@ def send_region_message_task(
 @shared_task(bind=True)
 def send_broadcast_chained(self, broadcast_id):
     """
-    Запускает цепочку задач для отправки большой рассылки.
-    Разбивает пользователей на батчи и отправляет последовательно.
+    Запускает отправку большой рассылки.
+    Разбивает пользователей на батчи и отправляет их параллельно (chord).
     
     Args:
         broadcast_id: ID объекта BroadcastMessage
@@ -516,35 +485,11 @@ def send_broadcast_chained(self, broadcast_id):
         broadcast = BroadcastMessage.objects.get(id=broadcast_id)
         
         # Получаем список пользователей с применением фильтров
-        users_query = TelegramUser.objects.filter(is_active=True)
-        
-        # Фильтр по типу пользователя
-        if broadcast.user_type_filter:
-            users_query = users_query.filter(user_type=broadcast.user_type_filter)
-        
-        # Фильтр по языку
-        if broadcast.language_filter:
-            users_query = users_query.filter(language=broadcast.language_filter)
-        
-        # Фильтр по региону
-        if broadcast.region_filter:
-            from core.regions import get_region_by_coordinates
-            
-            users_with_location = list(users_query.filter(
-                latitude__isnull=False,
-                longitude__isnull=False
-            ))
-            
-            filtered_user_ids = []
-            for user in users_with_location:
-                user_region = get_region_by_coordinates(user.latitude, user.longitude)
-                if user_region == broadcast.region_filter:
-                    filtered_user_ids.append(user.id)
-            
-            if filtered_user_ids:
-                users_query = users_query.filter(id__in=filtered_user_ids)
-            else:
-                users_query = users_query.none()
+        users_query = TelegramUser.audience(
+            user_type=broadcast.user_type_filter,
+            language=broadcast.language_filter,
+            region=broadcast.region_filter,
+        )
         
         user_ids = list(users_query.values_list('id', flat=True))
         total_users = len(user_ids)
@@ -571,12 +516,12 @@ def send_broadcast_chained(self, broadcast_id):
             f"({total_batches} батчей по {BATCH_SIZE} пользователей)"
         )
         
-        # Создаем цепочку задач
+        # Создаем задачи батчей
         if batches:
             # Создаем задачи для каждого батча
             tasks = []
             for batch_num, batch_user_ids in enumerate(batches, 1):
-                task = send_broadcast_batch.s(
+                task = send_broadcast_batch.si(
                     broadcast_id=broadcast_id,
                     user_ids=batch_user_ids,
                     batch_number=batch_num,
@@ -584,13 +529,17 @@ def send_broadcast_chained(self, broadcast_id):
                 )
                 tasks.append(task)
             
-            # Добавляем задачу завершения в конец цепочки
-            tasks.append(finalize_broadcast.s(broadcast_id=broadcast_id))
-            
-            # Запускаем цепочку задач последовательно
-            chain(*tasks).apply_async()
+            # Батчи выполняются параллельно на воркерах: общий темп ограничен лимитом бота
+            # в Redis (core/send_rate.py), завершение — после всех батчей
+            finalize = finalize_broadcast.si(broadcast_id=broadcast_id)
+            if broadcast.image and not broadcast.image_file_id and len(tasks) > 1:
+                # Первый батч загружает фото в Telegram и сохраняет file_id, остальные
+                # отправляют по нему. Темп и так ограничен общим лимитом — время не теряется.
+                (tasks[0] | chord(tasks[1:], finalize)).apply_async()
+            else:
+                chord(tasks)(finalize)
             
-            logger.info(f"Запущена цепочка из {total_batches + 1} задач для рассылки {broadcast_id}")
+            logger.info(f"Запущено {total_batches} батчей рассылки {broadcast_id}")
         else:
             # Если нет пользователей, завершаем рассылку
             broadcast.status = 'completed'
@@ -646,3 +595,17 @@ def finalize_broadcast(self, broadcast_id):
         logger.error(f"Рассылка {broadcast_id} не найдена")
         return {'error': f'Broadcast {broadcast_id} not found'}
 
+
+
+
+@shared_task(ignore_result=True)
+def flush_scan_events():
+    """
+    Переносит буфер журнала попыток (core/scan_log.py) в БД.
+    
+    Запускается celery beat каждые SCAN_LOG_FLUSH_INTERVAL секунд и сразу
+    при заполнении батча.
+    """
+    from . import scan_log
+    
+    return scan_log.flush()
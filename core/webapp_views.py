@@ -242,8 +242,8 @@ def request_gift(request):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        # Проверяем баланс (вычисляемый, без кеша для точности)
-        current_points = user.calculate_points(force=True)
+        # Проверяем баланс (из журнала баллов)
+        current_points = user.calculate_points()
         if current_points < gift.points_cost:
             from bot.translations import get_text
             error_message = get_text(user, 'INSUFFICIENT_POINTS')
@@ -259,10 +259,6 @@ def request_gift(request):
             status='pending'
         )
         
-        # Инвалидируем кеш и пересчитываем баллы
-        user.invalidate_points_cache()
-        user.calculate_points(force=True)
-        
         serializer = GiftRedemptionSerializer(redemption, context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
         
@@ -312,14 +308,10 @@ def cancel_order(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Отменяем заказ
+        # Отменяем заказ (баллы возвращаются в журнале баллов при сохранении)
         redemption.status = 'cancelled_by_user'
         redemption.save(update_fields=['status'])
         
-        # Инвалидируем кеш и пересчитываем баллы (баллы возвращаются автоматически)
-        user.invalidate_points_cache()
-        user.calculate_points(force=True)
-        
         serializer = GiftRedemptionSerializer(redemption, context={'request': request})
         return Response({
             'success': True,
@@ -584,9 +576,7 @@ def update_user_language(request):
 @no_cache_response
 def register_qr_code(request):
     """Регистрирует QR-код для пользователя."""
-    from django.utils import timezone
-    from django.conf import settings
-    from core.models import QRCode, QRCodeScanAttempt
+    from core.models import QRCode
     
     telegram_id = request.data.get('telegram_id')
     qr_code_str = request.data.get('qr_code')
@@ -624,36 +614,21 @@ def register_qr_code(request):
 
         # Используем транзакцию для атомарности операций
         with transaction.atomic():
-            # Нормализуем ввод: приводим к верхнему регистру для поиска
-            qr_code_str_normalized = qr_code_str.upper().strip()
-            
-            # Ищем QR-код по коду или hash_code (case-insensitive)
-            qr_code = None
-            try:
-                # Сначала ищем по полному коду (E-ABC123 или D-ABC123) - нечувствительно к регистру
-                qr_code = QRCode.objects.get(code__iexact=qr_code_str_normalized)
-            except QRCode.DoesNotExist:
-                # Если не нашли, пробуем найти по hash_code (без префикса) - нечувствительно к регистру
-                try:
-                    qr_code = QRCode.objects.get(hash_code__iexact=qr_code_str_normalized)
-                except QRCode.DoesNotExist:
-                    # QR-код не найден — регистрируем неверную попытку
-                    user.register_invalid_promo_attempt(source='webapp', raw_code=qr_code_str)
-                    error_message = get_text(user, 'QR_NOT_FOUND')
-                    return Response(
-                        {'error': error_message, 'error_code': 'not_found'},
-                        status=status.HTTP_404_NOT_FOUND
-                    )
+            # Активируем код одним условным UPDATE (без гонки при одновременном вводе)
+            claim_status, qr_code = QRCode.claim(qr_code_str, user)
+            if claim_status == 'not_found':
+                # QR-код не найден — регистрируем неверную попытку
+                user.register_invalid_promo_attempt(source='webapp', raw_code=qr_code_str)
+                error_message = get_text(user, 'QR_NOT_FOUND')
+                return Response(
+                    {'error': error_message, 'error_code': 'not_found'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
             
             # Проверяем, не был ли уже отсканирован
-            if qr_code.is_scanned:
-                # Создаем запись о неудачной попытке
-                QRCodeScanAttempt.objects.create(
-                    user=user,
-                    qr_code=qr_code,
-                    is_successful=False
-                )
-                user.register_invalid_promo_attempt(source='webapp', raw_code=qr_code_str)
+            if claim_status == 'already_scanned':
+                # Неудачная попытка попадает в журнал вместе с найденным кодом
+                user.register_invalid_promo_attempt(source='webapp', raw_code=qr_code_str, qr_code=qr_code)
                 error_message = get_text(user, 'QR_ALREADY_SCANNED')
                 return Response(
                     {'error': error_message, 'error_code': 'already_scanned'},
@@ -661,14 +636,9 @@ def register_qr_code(request):
                 )
             
             # Валидация типа кода - проверяем соответствие типу пользователя
-            if user.user_type and user.user_type != qr_code.code_type:
-                # Создаем запись о неудачной попытке (несоответствие типа)
-                QRCodeScanAttempt.objects.create(
-                    user=user,
-                    qr_code=qr_code,
-                    is_successful=False
-                )
-                user.register_invalid_promo_attempt(source='webapp', raw_code=qr_code_str)
+            if claim_status == 'wrong_type':
+                # Неудачная попытка попадает в журнал вместе с найденным кодом
+                user.register_invalid_promo_attempt(source='webapp', raw_code=qr_code_str, qr_code=qr_code)
                 error_message = get_text(user, 'QR_WRONG_TYPE')
                 return Response(
                     {'error': error_message, 'error_code': 'wrong_type'},
@@ -680,24 +650,11 @@ def register_qr_code(request):
                 user.user_type = qr_code.code_type
                 user.save(update_fields=['user_type'])
             
-            # Отмечаем QR-код как отсканированный
-            qr_code.is_scanned = True
-            qr_code.scanned_at = timezone.now()
-            qr_code.scanned_by = user
-            qr_code.save(update_fields=['is_scanned', 'scanned_at', 'scanned_by'])
-            
-            # Создаем запись об успешной попытке
-            QRCodeScanAttempt.objects.create(
-                user=user,
-                qr_code=qr_code,
-                is_successful=True
-            )
-            # Фиксируем успешный промокод (сброс последовательности ошибок)
-            user.register_successful_promo(raw_code=qr_code_str, source='webapp')
+            # Фиксируем успешный промокод (сброс последовательности ошибок; журнал — после коммита)
+            user.register_successful_promo(raw_code=qr_code_str, source='webapp', qr_code=qr_code)
             
-            # Инвалидируем кеш и пересчитываем баллы
-            user.invalidate_points_cache()
-            total_points = user.calculate_points(force=True)
+            # Баллы начислены в журнал в QRCode.claim — читаем актуальный баланс
+            total_points = user.calculate_points()
             
             success_message = get_text(user, 'QR_ACTIVATED',
                 points=qr_code.points,
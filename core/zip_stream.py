@@ -0,0 +1,58 @@
+"""
+ZIP архив потоком: файлы читаются с диска и отдаются по мере записи, без временного архива.
+
+zipfile умеет писать в поток без seek (размеры и CRC пишутся после данных каждого файла),
+поэтому архив целиком не хранится ни в памяти, ни на диске. Изображения уже сжаты (PNG),
+поэтому файлы кладутся без сжатия (ZIP_STORED) — архив собирается со скоростью чтения диска.
+"""
+import os
+import zipfile
+
+
+class _Buffer:
+    """Файл только для записи: накапливает байты до следующего take()."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(paths, chunk_size=1024 * 1024):
+    """
+    Генерирует ZIP архив по частям.
+
+    Args:
+        paths: итератор путей к файлам (в архиве — по имени файла); отсутствующие пропускаются
+        chunk_size: размер блока чтения файла
+
+    Yields:
+        bytes: очередной фрагмент архива
+    """
+    buffer = _Buffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for path in paths:
+            if not path or not os.path.exists(path):
+                continue
+            info = zipfile.ZipInfo.from_file(path, os.path.basename(path))
+            with open(path, 'rb') as source, archive.open(info, 'w') as target:
+                while True:
+                    data = source.read(chunk_size)
+                    if not data:
+                        break
+                    target.write(data)
+                    yield buffer.take()
+            # Дескриптор данных (CRC и размер) пишется при закрытии файла в архиве
+            yield buffer.take()
+    # Центральный каталог — при закрытии архива
+    yield buffer.take()
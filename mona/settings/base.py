@@ -198,6 +198,48 @@ WEBHOOK_PATH = env('WEBHOOK_PATH', default=f'/webhook/{TELEGRAM_BOT_TOKEN}')
 WEBHOOK_HOST = env('WEBHOOK_HOST', default='0.0.0.0')
 WEBHOOK_PORT = int(env('WEBHOOK_PORT', default='8443'))
 
+# Кеш TelegramUser в процессе бота (секунды). 0 — кеш выключен, пользователь
+# загружается из БД один раз на каждый апдейт (UserMiddleware). Записи вне процесса бота
+# (админка, веб-приложение, Celery) кеш не сбрасывают — держите TTL в пределах нескольких секунд.
+BOT_USER_CACHE_TTL = float(env('BOT_USER_CACHE_TTL', default='0'))
+
+# Хранилище FSM бота: 'memory' (один процесс) или 'redis' (общее для нескольких
+# процессов/нод webhook, состояние переживает деплой). Переключение не требует миграций.
+BOT_FSM_STORAGE = env('BOT_FSM_STORAGE', default='memory')
+BOT_FSM_REDIS_URL = env('BOT_FSM_REDIS_URL', default=f'redis://{REDIS_HOST}:{REDIS_PORT}/2')
+BOT_FSM_TTL = int(env('BOT_FSM_TTL', default=str(7 * 24 * 3600)))  # TTL ключей состояния, секунды (0 — без TTL)
+
+# Пул потоков для запросов бота к БД (bot/db.py); у каждого потока своё соединение,
+# т.е. до BOT_DB_THREADS соединений на процесс webhook. 0 — один общий поток (sync_to_async).
+BOT_DB_THREADS = int(env('BOT_DB_THREADS', default='8'))
+
+# Количество процессов webhook-сервера (run_webhook.py). При > 1 требуется BOT_FSM_STORAGE=redis.
+WEBHOOK_WORKERS = int(env('WEBHOOK_WORKERS', default='1'))
+
+# Очередь апдейтов webhook: Telegram получает ответ сразу, обработка — пулом воркеров
+# с сохранением порядка внутри чата. 0 — обработка напрямую через SimpleRequestHandler.
+WEBHOOK_QUEUE_WORKERS = int(env('WEBHOOK_QUEUE_WORKERS', default='0'))
+WEBHOOK_QUEUE_MAXSIZE = int(env('WEBHOOK_QUEUE_MAXSIZE', default='2000'))  # при переполнении — 503, Telegram повторит
+
+# Дедупликация апдейтов по update_id: Telegram повторяет доставку при таймаутах.
+# TTL — сколько секунд помнить update_id (0 — выключено); без Redis работает локальный LRU.
+BOT_UPDATE_DEDUP_TTL = int(env('BOT_UPDATE_DEDUP_TTL', default='3600'))
+BOT_UPDATE_DEDUP_REDIS_URL = env('BOT_UPDATE_DEDUP_REDIS_URL', default=BOT_FSM_REDIS_URL)
+
+# Рассылки (core/send_rate.py): общий для всех воркеров лимит бота в Redis — TELEGRAM_BROADCAST_RATE
+# сообщений в секунду (емкость корзины TELEGRAM_BROADCAST_BURST), до TELEGRAM_BROADCAST_CONCURRENCY
+# одновременных отправок в каждом процессе.
+TELEGRAM_BROADCAST_RATE = float(env('TELEGRAM_BROADCAST_RATE', default='30'))
+TELEGRAM_BROADCAST_BURST = float(env('TELEGRAM_BROADCAST_BURST', default='1'))
+TELEGRAM_BROADCAST_CONCURRENCY = int(env('TELEGRAM_BROADCAST_CONCURRENCY', default='10'))
+TELEGRAM_RATE_LIMIT_REDIS_URL = env('TELEGRAM_RATE_LIMIT_REDIS_URL', default=f'redis://{REDIS_HOST}:{REDIS_PORT}/1')
+# Повторы отправки: флуд-контроль (429) приостанавливает все рассылки на retry_after, ошибки сервера
+# Telegram и сети — с экспоненциальной задержкой от TELEGRAM_SEND_RETRY_BASE_DELAY секунд.
+TELEGRAM_SEND_MAX_RETRIES = int(env('TELEGRAM_SEND_MAX_RETRIES', default='5'))
+TELEGRAM_SEND_RETRY_BASE_DELAY = float(env('TELEGRAM_SEND_RETRY_BASE_DELAY', default='1'))
+# Статусы получателей рассылки (last_message_sent_at, is_active, blocked_bot_at) пишутся в БД пачками такого размера
+BROADCAST_STATUS_FLUSH_SIZE = int(env('BROADCAST_STATUS_FLUSH_SIZE', default='250'))
+
 # Web App Settings
 WEB_APP_URL = env('WEB_APP_URL', default='')  # HTTPS URL для Web App (можно использовать ngrok для тестирования)
 
@@ -208,6 +250,52 @@ SELLER_POINTS = 20  # 20 dollars
 # QR Code Settings
 QR_CODE_MAX_ATTEMPTS = 5  # Максимальное количество неудачных попыток в день
 QR_CODE_BATCH_SIZE = 200  # Размер батча для генерации QR-кодов (для избежания таймаутов)
+# Карточки промокодов (core/card_renderer.py): макет 1000×600 × QR_CODE_IMAGE_SCALE (3 → 300 dpi).
+# QR_CODE_RENDER_WORKERS — процессов отрисовки вне Celery (0 — по числу ядер; задачи Celery
+# рисуют в своем процессе). Шрифты по умолчанию — Liberation Sans (fonts-liberation).
+QR_CODE_IMAGE_SCALE = int(env('QR_CODE_IMAGE_SCALE', default='3'))
+QR_CODE_RENDER_WORKERS = int(env('QR_CODE_RENDER_WORKERS', default='0'))
+QR_CODE_FONT_PATH = env('QR_CODE_FONT_PATH', default='')
+QR_CODE_FONT_BOLD_PATH = env('QR_CODE_FONT_BOLD_PATH', default='')
+# PDF-листы для типографии (core/card_sheets.py): формат листа (A4, A3, SRA3) и ширина карточки, мм
+QR_CODE_PDF_PAGE_SIZE = env('QR_CODE_PDF_PAGE_SIZE', default='A4')
+QR_CODE_PDF_CARD_WIDTH_MM = float(env('QR_CODE_PDF_CARD_WIDTH_MM', default='90'))
+# Выгрузка кодов в Excel из админки: больше этого количества — Celery-задачей в файл (core/code_export.py)
+QR_CODE_EXPORT_SYNC_LIMIT = int(env('QR_CODE_EXPORT_SYNC_LIMIT', default='20000'))
+# Фоновая выгрузка без обновления прогресса дольше этого (секунды) считается прерванной — можно запустить заново
+QR_CODE_EXPORT_STALE_SECONDS = int(env('QR_CODE_EXPORT_STALE_SECONDS', default='600'))
+# Длина хеша промокода (core/codespace.py): наименьшая, при которой доля занятых хешей этой длины
+# не больше MAX_COLLISION (скорость подбора) и MAX_GUESS_PROBABILITY (шанс угадать код одной попыткой).
+QR_CODE_HASH_MIN_LENGTH = int(env('QR_CODE_HASH_MIN_LENGTH', default='4'))
+QR_CODE_HASH_MAX_COLLISION = float(env('QR_CODE_HASH_MAX_COLLISION', default='0.05'))
+QR_CODE_HASH_MAX_GUESS_PROBABILITY = float(env('QR_CODE_HASH_MAX_GUESS_PROBABILITY', default='0.01'))
+
+# Фильтр Блума выданных промокодов в Redis (core/code_filter.py): неверные коды отсекаются
+# без запроса в БД. До первой сборки (manage.py rebuild_code_filter) пропускает все коды.
+QR_CODE_FILTER_ENABLED = env.bool('QR_CODE_FILTER_ENABLED', default=True)
+QR_CODE_FILTER_REDIS_URL = env('QR_CODE_FILTER_REDIS_URL', default=f'redis://{REDIS_HOST}:{REDIS_PORT}/1')
+QR_CODE_FILTER_BITS = int(env('QR_CODE_FILTER_BITS', default=str(2 ** 27)))  # 16 МБ; ~0.3% ложных срабатываний на 10 млн значений
+QR_CODE_FILTER_HASHES = int(env('QR_CODE_FILTER_HASHES', default='7'))
+
+# Блокировка за неверные промокоды (core/promo_limiter.py): счётчики в Redis.
+# PROMO_MAX_FAILED_ATTEMPTS неверных подряд или за день → блокировка на PROMO_BLOCK_SECONDS.
+PROMO_LIMITER_REDIS_URL = env('PROMO_LIMITER_REDIS_URL', default=f'redis://{REDIS_HOST}:{REDIS_PORT}/1')
+PROMO_MAX_FAILED_ATTEMPTS = int(env('PROMO_MAX_FAILED_ATTEMPTS', default='3'))
+PROMO_BLOCK_SECONDS = int(env('PROMO_BLOCK_SECONDS', default=str(24 * 3600)))
+
+# Журнал попыток ввода промокода пишется через буфер в Redis (core/scan_log.py): батч
+# сбрасывается в БД при заполнении или раз в SCAN_LOG_FLUSH_INTERVAL секунд (celery beat).
+# SCAN_LOG_BATCH_SIZE=0 — писать сразу, без буфера. Батч не больше ~5000 (ограничение Lua unpack).
+SCAN_LOG_REDIS_URL = env('SCAN_LOG_REDIS_URL', default=f'redis://{REDIS_HOST}:{REDIS_PORT}/1')
+SCAN_LOG_BATCH_SIZE = int(env('SCAN_LOG_BATCH_SIZE', default='500'))
+SCAN_LOG_FLUSH_INTERVAL = float(env('SCAN_LOG_FLUSH_INTERVAL', default='2'))
+
+CELERY_BEAT_SCHEDULE = {
+    'flush-scan-events': {
+        'task': 'core.tasks.flush_scan_events',
+        'schedule': SCAN_LOG_FLUSH_INTERVAL,
+    },
+}
 
 # REST Framework
 REST_FRAMEWORK = {
@@ -34,7 +34,7 @@ if _sentry_dsn:
         send_default_pii=False,
     )
 
-from bot.webhook import get_webhook_app
+from bot.webhook import get_webhook_app, run_webhook_workers
 
 logging.basicConfig(
     level=logging.INFO,
@@ -50,10 +50,16 @@ def main():
         logger.error("TELEGRAM_BOT_TOKEN не установлен!")
         return
     
-    app = get_webhook_app()
-    
     host = settings.WEBHOOK_HOST
     port = settings.WEBHOOK_PORT
+    workers = settings.WEBHOOK_WORKERS
+    
+    if workers > 1:
+        logger.info(f"Запуск webhook сервера на {host}:{port} ({workers} процессов)")
+        run_webhook_workers(host, port, workers)
+        return
+    
+    app = get_webhook_app()
     
     logger.info(f"Запуск webhook сервера на {host}:{port}")
     web.run_app(app, host=host, port=port)
@@ -6,7 +6,7 @@
   2. Скопировать и вставить весь код ниже (от from до конца блока).
 """
 
-from core.models import TelegramUser, QRCodeScanAttempt
+from core.models import TelegramUser, PromoCodeAttempt
 
 TOP_N = 10
 SHOW_FAILED_LIST = True  # поставить False, если нужна только сводка
@@ -21,13 +21,13 @@ electricians = list(
 )
 print(f"\nТОП-{TOP_N} электриков по рейтингу. Попытки сканирования QR.\n")
 for i, user in enumerate(electricians, 1):
-    success = QRCodeScanAttempt.objects.filter(user=user, is_successful=True).count()
-    fail = QRCodeScanAttempt.objects.filter(user=user, is_successful=False).count()
+    success = PromoCodeAttempt.objects.filter(user=user, qr_code__isnull=False, is_successful=True).count()
+    fail = PromoCodeAttempt.objects.filter(user=user, qr_code__isnull=False, is_successful=False).count()
     name = user.first_name or user.username or "—"
     print(f"{i}. telegram_id={user.telegram_id} | {name} | баллы={user.points}")
     print(f"   Верных попыток: {success} | Неверных попыток: {fail}")
     if SHOW_FAILED_LIST and fail:
-        for a in QRCodeScanAttempt.objects.filter(user=user, is_successful=False).select_related("qr_code").order_by("-attempted_at"):
+        for a in PromoCodeAttempt.objects.filter(user=user, qr_code__isnull=False, is_successful=False).select_related("qr_code").order_by("-attempted_at"):
             code_display = mask_qr(a.qr_code.code) if a.qr_code_id else "—"
             print(f"   — {a.attempted_at.strftime('%Y-%m-%d %H:%M:%S')} | QR: {code_display} (id={a.qr_code_id})")
 print()